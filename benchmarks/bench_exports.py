@@ -0,0 +1,71 @@
+"""Times the export paths of the FileProcessor on the same input file: the Excel
+output against the csv, json lines and parquet exports of the same records, plain
+and compressed.
+
+Run from the repository root, e.g.:
+
+    python -m benchmarks.bench_exports path/to/file.xml --out-dir path/to/output
+"""
+
+# ------------------
+# Imports
+# ------------------
+import argparse
+import os
+import tempfile
+
+from webapp.fileprocessor import FileProcessor
+from webapp.profiler import StopWatch
+
+
+def get_exports(fp, out_dir):
+    # the export runs by run label
+    return (
+        ("to_excel", lambda: fp.to_excel(out_dir)),
+        ("to_excel direct", lambda: fp.to_excel(out_dir, direct_output=True)),
+        ("to_csv", lambda: fp.to_csv(out_dir)),
+        ("to_csv gzip", lambda: fp.to_csv(out_dir, compress=True)),
+        ("to_jsonl", lambda: fp.to_jsonl(out_dir)),
+        ("to_jsonl gzip", lambda: fp.to_jsonl(out_dir, compress=True)),
+        ("to_parquet", lambda: fp.to_parquet(out_dir)),
+        ("to_parquet gzip", lambda: fp.to_parquet(out_dir, compress=True)),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Times the export paths of the FileProcessor on an xml file."
+    )
+    parser.add_argument("source_file", help="the xml file to process")
+    parser.add_argument(
+        "--out-dir",
+        help="the directory for the database and the exports (default: a new "
+        "temporary directory)",
+    )
+    args = parser.parse_args(argv)
+
+    if args.out_dir:
+        out_dir = args.out_dir
+        os.makedirs(out_dir, exist_ok=True)
+    else:
+        out_dir = tempfile.mkdtemp(prefix="bench_exports_")
+    print(f"Writing to {out_dir}")
+
+    # load the file into the file processor
+    stopwatch = StopWatch(run_label="processing file")
+    fp = FileProcessor(source_file=args.source_file, data_directory=out_dir)
+    print(stopwatch.time_run())
+
+    # parse the documents within the file
+    stopwatch = StopWatch(run_label="parsing documents")
+    fp.process_file()
+    print(stopwatch.time_run())
+
+    for run_label, export in get_exports(fp, out_dir):
+        stopwatch = StopWatch(run_label=run_label)
+        export()
+        print(stopwatch.time_run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import pytest
+
+from webapp.fileprocessor import FileProcessor
+
+
+@pytest.fixture
+def make_file_processor(tmp_path):
+    """Returns a function writing the given content to a source file and creating
+    a FileProcessor for it, with its database in a directory of its own.
+    """
+
+    counter = iter(range(1_000_000))
+
+    def _make_file_processor(content, **kwargs):
+        run_path = tmp_path / f"run_{next(counter)}"
+        run_path.mkdir()
+        source_file = run_path / "source.xml"
+        source_file.write_text(content)
+        return FileProcessor(
+            str(source_file), data_directory=str(run_path), **kwargs
+        )
+
+    return _make_file_processor
+
+
+def get_doc_list(file_processor):
+    # the (DocID, DocValidity, DocText) of all documents stored in the DocList
+    return [
+        (row["DocID"], row["DocValidity"], row["DocText"])
+        for row in file_processor.pm.get_all_docs()
+    ]
+
+
+def get_split_log(file_processor):
+    # the (log level, log entry) of the split, logged with doc id 0
+    return [
+        (log_level, log_entry)
+        for doc_id, log_level, log_entry in file_processor.get_process_log()
+        if doc_id == 0
+    ]
+
+
+def get_output(file_processor, attrs_to_split_on=None):
+    # the header and the rows of the FinalOutput table by document type
+    pm = file_processor.pm
+    output = {}
+    # the types are read first, a table can't be dropped while the cursor is open
+    for doc_type in list(pm.get_xml_types()):
+        create_record_on = file_processor._get_create_record_on(
+            attrs_to_split_on, doc_type
+        )
+        pm.create_output_by_xml_type(doc_type, create_record_on)
+        header = [row["Tag"] for row in pm.get_xml_tags_by_type(doc_type)]
+        output[doc_type] = [header] + [
+            list(row) for row in pm.get_output_by_xml_type(doc_type)
+        ]
+    return output
@@ -0,0 +1,246 @@
+import csv
+import gzip
+import json
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+import pytest
+import xlsxwriter
+
+from webapp.fileprocessor import write_excel_sheets
+
+from conftest import get_output
+
+
+SOURCE = "\n".join(
+    [
+        '<?xml version="1.0"?><Document><Hdr><Id>1</Id><Nm>Smith, "J"</Nm></Hdr>'
+        "<Itm><Ref>a</Ref><Amt>1.5</Amt></Itm><Itm><Ref>b</Ref><Amt>2</Amt></Itm>"
+        "</Document>",
+        '<?xml version="1.0"?><Document><Hdr><Id>2</Id><Nm>Müller\nLine</Nm></Hdr>'
+        "<Itm><Ref>c</Ref></Itm></Document>",
+        '<?xml version="1.0"?><Other><Id>3</Id></Other>',
+    ]
+)
+
+ATTRS_TO_SPLIT_ON = {"Hdr": ["xml.Document.Itm.Ref"]}
+
+NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+
+def read_xlsx(file_name):
+    # the rows of the sheets of the workbook by sheet name, blank cells as ""
+    with zipfile.ZipFile(file_name) as workbook:
+        shared_strings = []
+        if "xl/sharedStrings.xml" in workbook.namelist():
+            root = ET.fromstring(workbook.read("xl/sharedStrings.xml"))
+            for item in root.iter(f"{NS}si"):
+                shared_strings.append(
+                    "".join(text.text or "" for text in item.iter(f"{NS}t"))
+                )
+
+        root = ET.fromstring(workbook.read("xl/workbook.xml"))
+        sheet_names = [sheet.get("name") for sheet in root.iter(f"{NS}sheet")]
+
+        sheets = {}
+        for sheet_no, sheet_name in enumerate(sheet_names, start=1):
+            root = ET.fromstring(workbook.read(f"xl/worksheets/sheet{sheet_no}.xml"))
+            rows = []
+            for row in root.iter(f"{NS}row"):
+                cells = {}
+                for cell in row.iter(f"{NS}c"):
+                    if cell.get("t") == "s":
+                        value = shared_strings[int(cell.find(f"{NS}v").text)]
+                    else:
+                        value = "".join(text.text or "" for text in cell.iter(f"{NS}t"))
+                    column = re.match("[A-Z]+", cell.get("r")).group()
+                    cells[ord(column) - ord("A")] = value
+                rows.append(cells)
+
+            width = len(rows[0])
+            sheets[sheet_name] = [
+                [cells.get(column, "") for column in range(width)] for cells in rows
+            ]
+
+    return sheets
+
+
+def read_csv(file_name, compress):
+    opener = gzip.open if compress else open
+    with opener(file_name, "rt", encoding="utf-8", newline="") as file_handle:
+        return list(csv.reader(file_handle))
+
+
+def read_jsonl(file_name, header, compress):
+    opener = gzip.open if compress else open
+    with opener(file_name, "rt", encoding="utf-8") as file_handle:
+        records = [json.loads(line) for line in file_handle]
+    assert all(list(record) == header for record in records)
+    return [header] + [list(record.values()) for record in records]
+
+
+def read_parquet(file_name):
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(file_name)
+    return [table.column_names] + [list(row.values()) for row in table.to_pylist()]
+
+
+def as_excel_rows(rows):
+    # Excel keeps no difference between an empty and a missing value
+    return [["" if value is None else value for value in row] for row in rows]
+
+
+@pytest.fixture
+def file_processor(make_file_processor):
+    file_processor = make_file_processor(SOURCE)
+    file_processor.process_file()
+    return file_processor
+
+
+@pytest.mark.parametrize(
+    "attrs_to_split_on", [None, ATTRS_TO_SPLIT_ON], ids=["pivot", "split"]
+)
+@pytest.mark.parametrize(
+    "file_format, compress",
+    [
+        ("csv", False),
+        ("csv", True),
+        ("jsonl", False),
+        ("jsonl", True),
+        ("parquet", False),
+        ("parquet", True),
+    ],
+)
+def test_export_matches_excel(
+    file_processor, tmp_path, attrs_to_split_on, file_format, compress
+):
+    if file_format == "parquet":
+        pytest.importorskip("pyarrow")
+        file_extension = "parquet"
+    else:
+        file_extension = f"{file_format}.gz" if compress else file_format
+
+    excel_name = file_processor.to_excel(str(tmp_path), attrs_to_split_on)
+    sheets = read_xlsx(tmp_path / excel_name)
+
+    export = getattr(file_processor, f"to_{file_format}")
+    file_names = export(str(tmp_path), attrs_to_split_on, compress=compress)
+
+    doc_types = list(file_processor.pm.get_xml_types())
+    assert sorted(doc_types) == sorted(sheets) == ["Hdr", "Other"]
+    assert len(file_names) == len(doc_types)
+
+    for doc_type, file_name in zip(doc_types, file_names):
+        assert file_name.endswith(f"_{doc_type}.{file_extension}")
+        file_out = tmp_path / file_name
+        header = sheets[doc_type][0]
+        if file_format == "csv":
+            rows = read_csv(file_out, compress)
+        elif file_format == "jsonl":
+            rows = read_jsonl(file_out, header, compress)
+        else:
+            rows = read_parquet(file_out)
+
+        assert as_excel_rows(rows) == sheets[doc_type]
+
+    # the content is not only blank
+    assert sheets["Hdr"][1][:2] == ["1", 'Smith, "J"']
+    assert len(sheets["Hdr"]) == (4 if attrs_to_split_on else 3)
+
+
+@pytest.mark.parametrize(
+    "attrs_to_split_on", [None, ATTRS_TO_SPLIT_ON], ids=["pivot", "split"]
+)
+def test_direct_output_matches_final_output(
+    file_processor, tmp_path, attrs_to_split_on
+):
+    direct_dir = tmp_path / "direct"
+    direct_dir.mkdir()
+    direct_name = file_processor.to_excel(
+        str(direct_dir), attrs_to_split_on, direct_output=True
+    )
+    excel_name = file_processor.to_excel(str(tmp_path), attrs_to_split_on)
+
+    sheets = read_xlsx(tmp_path / excel_name)
+    assert read_xlsx(direct_dir / direct_name) == sheets
+    assert len(sheets["Hdr"]) == (4 if attrs_to_split_on else 3)
+
+    # the records are the same as the ones stored in the FinalOutput tables
+    pm = file_processor.pm
+    for doc_type, rows in get_output(file_processor, attrs_to_split_on).items():
+        create_record_on = file_processor._get_create_record_on(
+            attrs_to_split_on, doc_type
+        )
+        records = pm.get_output_records_by_xml_type(doc_type, create_record_on)
+        assert [list(record) for record in records] == rows[1:]
+
+
+def test_write_excel_sheets_spills_into_continuation_sheets(tmp_path):
+    file_out = tmp_path / "spill.xlsx"
+    long_type = "T" * 31
+    workbook = xlsxwriter.Workbook(str(file_out))
+    rows = [(str(idx), f"value {idx}") for idx in range(7)]
+
+    assert write_excel_sheets(workbook, "Hdr", ["Id", "Nm"], rows, max_rows=3) == 4
+    assert write_excel_sheets(workbook, long_type, ["Id"], [("1",)], max_rows=3) == 1
+    # the name of the type is the same as the one before in its first 31 chars
+    assert write_excel_sheets(workbook, long_type + "X", ["Id"], [], max_rows=3) == 1
+    workbook.close()
+
+    sheets = read_xlsx(file_out)
+    sheet_names = list(sheets)
+    assert sheet_names[:5] == ["Hdr", "Hdr_2", "Hdr_3", "Hdr_4", long_type]
+    # the duplicate name is replaced by a default sheet name
+    assert sheet_names[5].startswith("Sheet")
+    assert [len(sheets[name]) for name in sheet_names] == [3, 3, 3, 2, 2, 1]
+
+    hdr_sheets = [sheets[name] for name in sheet_names[:4]]
+    assert all(sheet[0] == ["Id", "Nm"] for sheet in hdr_sheets)
+    assert [row for sheet in hdr_sheets for row in sheet[1:]] == [
+        list(row) for row in rows
+    ]
+
+
+def test_write_excel_sheets_names_continuation_sheets_of_long_types(tmp_path):
+    file_out = tmp_path / "spill.xlsx"
+    doc_type = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefgh"
+    workbook = xlsxwriter.Workbook(str(file_out))
+    write_excel_sheets(workbook, doc_type, ["Id"], [("1",), ("2",)], max_rows=2)
+    workbook.close()
+
+    assert list(read_xlsx(file_out)) == [doc_type[:31], f"{doc_type[:29]}_2"]
+
+
+@pytest.mark.parametrize("background_writer", [False, True])
+@pytest.mark.parametrize("excel_workers", [1, 2])
+def test_workbook_per_type(
+    make_file_processor, tmp_path, background_writer, excel_workers
+):
+    file_processor = make_file_processor(SOURCE, background_writer=background_writer)
+    file_processor.process_file()
+
+    sheets = read_xlsx(tmp_path / file_processor.to_excel(str(tmp_path)))
+    zip_name = file_processor.to_excel(
+        str(tmp_path), workbook_per_type=True, excel_workers=excel_workers
+    )
+
+    assert zip_name.endswith(".zip")
+    timestamp = zip_name[len(file_processor.file_name_root) + 1 : -len(".zip")]
+    with zipfile.ZipFile(tmp_path / zip_name) as zip_file:
+        members = zip_file.namelist()
+        assert sorted(members) == sorted(
+            f"{file_processor.file_name_root}_{timestamp}_{doc_type}.xlsx"
+            for doc_type in ["Hdr", "Other"]
+        )
+        for member in members:
+            zip_file.extract(member, tmp_path / "unzipped")
+
+    for member in members:
+        doc_type = member[: -len(".xlsx")].rsplit("_", 1)[-1]
+        assert read_xlsx(tmp_path / "unzipped" / member) == {
+            doc_type: sheets[doc_type]
+        }
+    # the workbooks are only in the zip file
+    assert not any((tmp_path / member).exists() for member in members)
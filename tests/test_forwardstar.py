@@ -0,0 +1,276 @@
+import random
+
+import pytest
+
+from webapp.forwardstar import SHORT_MAX_NODES, ForwardStar, ForwardStarForest
+
+
+def random_parents(num_nodes, seed):
+    # a parent array, every node is the child of a node added before
+    rng = random.Random(seed)
+    return [-1] + [rng.randrange(node) for node in range(1, num_nodes)]
+
+
+def build_with_add_child(parents, node_captions):
+    fstar = ForwardStar(node_captions[0])
+    for node in range(1, len(parents)):
+        fstar.add_child(node_captions[parents[node]], node_captions[node])
+    return fstar
+
+
+def fstar_state(fstar):
+    return (
+        list(fstar.node_caption),
+        list(fstar.first_link),
+        list(fstar.to_node),
+        list(fstar.parent),
+        fstar.num_links,
+        fstar.num_nodes,
+        fstar.selected_node,
+    )
+
+
+def ancestors(parents, node):
+    # the ancestors of the node by walking up the parent array
+    result = []
+    while parents[node] != -1:
+        node = parents[node]
+        result.append(node)
+    return result
+
+
+TREES = [
+    pytest.param([-1], id="root_only"),
+    pytest.param([-1, 0, 0, 0, 0], id="flat"),
+    pytest.param(list(range(-1, 20)), id="chain"),
+    pytest.param([-1, 0, 0, 1, 2, 2, 1, 3, 6, 6], id="small"),
+] + [
+    pytest.param(random_parents(num_nodes, seed), id=f"random_{num_nodes}_{seed}")
+    for num_nodes, seed in [(50, 1), (200, 2), (500, 3)]
+]
+
+
+@pytest.mark.parametrize("parents", TREES)
+def test_from_parent_array_matches_add_child(parents):
+    node_captions = list(range(len(parents)))
+    expected = build_with_add_child(parents, node_captions)
+
+    assert fstar_state(ForwardStar.from_parent_array(parents)) == fstar_state(expected)
+
+
+def test_from_parent_array_with_captions():
+    parents = [-1, 0, 1, 0, 3]
+    node_captions = ["A", "B", "C", "D", "E"]
+    fstar = ForwardStar.from_parent_array(parents, node_captions)
+
+    assert fstar_state(fstar) == fstar_state(
+        build_with_add_child(parents, node_captions)
+    )
+    assert fstar.find_node_by_caption("D") == 3
+
+
+def test_from_parent_array_requires_parents_added_before():
+    with pytest.raises(IndexError):
+        ForwardStar.from_parent_array([-1, 2, 0])
+
+
+@pytest.mark.parametrize(
+    "num_nodes, typecode", [(300, "h"), (SHORT_MAX_NODES + 10, "i")]
+)
+@pytest.mark.parametrize("captions", ["range", "json"])
+def test_bytes_round_trip(num_nodes, typecode, captions):
+    parents = random_parents(num_nodes, seed=num_nodes)
+    if captions == "range":
+        node_captions = list(range(7, 7 + num_nodes))
+    else:
+        node_captions = [f"tag {node}" for node in range(num_nodes)]
+    fstar = ForwardStar.from_parent_array(parents, node_captions)
+
+    blob = fstar.to_bytes()
+    loaded = ForwardStar.from_bytes(blob)
+
+    assert loaded.first_link.format == typecode
+    assert fstar_state(loaded) == fstar_state(fstar)
+    assert isinstance(loaded.node_caption, range) == (captions == "range")
+    assert loaded.to_bytes() == blob
+    assert loaded.get_shape_hash() == fstar.get_shape_hash()
+    assert loaded.find_node_by_caption(node_captions[-1]) == num_nodes - 1
+
+
+def test_from_bytes_rejects_unknown_format():
+    blob = bytearray(ForwardStar.from_parent_array([-1, 0]).to_bytes())
+    blob[:4] = b"XXXX"
+    with pytest.raises(ValueError):
+        ForwardStar.from_bytes(bytes(blob))
+
+
+@pytest.mark.parametrize("captions", ["range", "json"])
+def test_add_child_to_loaded_fstar(captions):
+    parents = random_parents(30, seed=4)
+    if captions == "range":
+        node_captions = list(range(len(parents) + 2))
+    else:
+        node_captions = [f"tag {node}" for node in range(len(parents) + 2)]
+    blob = ForwardStar.from_parent_array(parents, node_captions[:-2]).to_bytes()
+    loaded = ForwardStar.from_bytes(blob)
+
+    loaded.add_child(node_captions[3], node_captions[-2])
+    loaded.add_child(node_captions[0], node_captions[-1])
+
+    expected = build_with_add_child(parents + [3, 0], node_captions)
+    assert fstar_state(loaded) == fstar_state(expected)
+    assert loaded.find_parent_by_caption(node_captions[-2]) == expected.find_parent(
+        len(parents)
+    )
+    # the blob the forward star was loaded from is not changed
+    assert ForwardStar.from_bytes(blob).num_nodes == len(parents)
+
+
+@pytest.mark.parametrize("parents", TREES)
+@pytest.mark.parametrize("loaded", [False, True], ids=["built", "loaded"])
+def test_find_parent_matches_linear_scan(parents, loaded):
+    fstar = ForwardStar.from_parent_array(parents)
+    if loaded:
+        fstar = ForwardStar.from_bytes(fstar.to_bytes())
+
+    assert fstar.find_parent(0) == (-1, -1)
+    for node in range(1, len(parents)):
+        expected = next(
+            (parent, link)
+            for parent in range(fstar.num_nodes)
+            for link in range(fstar.first_link[parent], fstar.first_link[parent + 1])
+            if fstar.to_node[link] == node
+        )
+        assert fstar.find_parent(node) == expected
+        assert fstar.find_parent_by_caption(node) == expected
+
+
+@pytest.mark.parametrize("parents", TREES)
+def test_interval_labels_match_ancestor_walk(parents):
+    fstar = ForwardStar.from_parent_array(parents)
+    num_nodes = len(parents)
+    node_ancestors = [set(ancestors(parents, node)) for node in range(num_nodes)]
+
+    for node in range(num_nodes):
+        assert fstar.get_depth(node) == len(node_ancestors[node])
+        for other in range(num_nodes):
+            assert fstar.is_ancestor(other, node) == (other in node_ancestors[node])
+
+        # the subtree range holds the node and its descendants
+        start, end = fstar.subtree_range(node)
+        assert fstar.get_pre_order()[start] == node
+        assert set(fstar.get_pre_order()[start:end]) == {node} | {
+            other for other in range(num_nodes) if node in node_ancestors[other]
+        }
+
+    # the pre-order visits the children of a node in order of their index
+    assert list(fstar.get_pre_order()) == [0] + [
+        int(child) for _, child in fstar.visit_tree()
+    ]
+
+
+@pytest.mark.parametrize("parents", TREES)
+def test_nodes_at_depth(parents):
+    fstar = ForwardStar.from_parent_array(parents)
+    pre_order = list(fstar.get_pre_order())
+    depths = [len(ancestors(parents, node)) for node in range(len(parents))]
+
+    for depth in range(-1, max(depths) + 3):
+        assert fstar.nodes_at_depth(depth) == [
+            node for node in pre_order if depths[node] == depth
+        ]
+
+
+def make_forest(with_labels=True):
+    # documents of different shapes, two documents share the same forward star
+    shared = ForwardStar.from_parent_array(random_parents(40, seed=5))
+    doc_fstars = {
+        7: ForwardStar.from_parent_array(random_parents(60, seed=6)),
+        3: shared,
+        9: ForwardStar.from_bytes(
+            ForwardStar.from_parent_array(random_parents(80, seed=7)).to_bytes()
+        ),
+        4: shared,
+        5: ForwardStar.from_parent_array([-1]),
+    }
+    rng = random.Random(8)
+    node_labels = {
+        doc_id: [rng.choice("ABC") for _ in range(fstar.num_nodes)]
+        for doc_id, fstar in doc_fstars.items()
+    }
+    if not with_labels:
+        node_labels = None
+    return doc_fstars, node_labels, ForwardStarForest(doc_fstars, node_labels)
+
+
+def test_forest_matches_the_forward_stars():
+    doc_fstars, _, forest = make_forest()
+
+    assert forest.num_nodes == sum(fstar.num_nodes for fstar in doc_fstars.values())
+    assert forest.first_link[-1] == len(forest.to_node)
+    for doc_id, fstar in doc_fstars.items():
+        nodes = forest.get_doc_nodes(doc_id)
+        offset = nodes.start
+        assert len(nodes) == fstar.num_nodes
+        assert [forest.get_doc_id(node) for node in nodes] == [doc_id] * len(nodes)
+        assert list(forest.get_pre_order()[nodes.start : nodes.stop]) == [
+            offset + node for node in fstar.get_pre_order()
+        ]
+        for node in range(fstar.num_nodes):
+            global_node = forest.find_node(doc_id, fstar.node_caption[node])
+            assert global_node == offset + node
+            parent = fstar.parent[node]
+            assert forest.get_parent(global_node) == (
+                -1 if parent == -1 else offset + parent
+            )
+            start, end = fstar.subtree_range(node)
+            assert forest.subtree_range(global_node) == (offset + start, offset + end)
+            assert list(
+                forest.to_node[
+                    forest.first_link[global_node] : forest.first_link[global_node + 1]
+                ]
+            ) == [
+                offset + child
+                for child in fstar.to_node[
+                    fstar.first_link[node] : fstar.first_link[node + 1]
+                ]
+            ]
+
+
+@pytest.mark.parametrize("children_only", [True, False])
+@pytest.mark.parametrize("ancestor_label, descendant_label", [("A", "B"), ("B", "B")])
+def test_forest_count_by_label(children_only, ancestor_label, descendant_label):
+    doc_fstars, node_labels, forest = make_forest()
+
+    expected = []
+    for doc_id, fstar in doc_fstars.items():
+        labels = node_labels[doc_id]
+        parents = list(fstar.parent)
+        for node in range(fstar.num_nodes):
+            if labels[node] != ancestor_label:
+                continue
+            if children_only:
+                below = [
+                    other for other in range(fstar.num_nodes) if parents[other] == node
+                ]
+            else:
+                below = [
+                    other
+                    for other in range(fstar.num_nodes)
+                    if node in ancestors(parents, other)
+                ]
+            count = sum(1 for other in below if labels[other] == descendant_label)
+            expected.append((doc_id, fstar.node_caption[node], count))
+
+    assert forest.count_by_label(ancestor_label, descendant_label, children_only) == (
+        expected
+    )
+
+
+def test_forest_count_by_unknown_label():
+    _, _, forest = make_forest()
+
+    assert forest.count_by_label("X", "A") == []
+    assert all(count == 0 for _, _, count in forest.count_by_label("A", "X"))
+    with pytest.raises(ValueError):
+        make_forest(with_labels=False)[2].count_by_label("A", "B")
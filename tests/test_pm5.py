@@ -0,0 +1,233 @@
+import gc
+import os
+import pickle
+import sqlite3
+
+import pytest
+
+from webapp.forwardstar import ForwardStar
+from webapp.pm5 import DocValidity, PersistenceManager, XmlAttribute
+
+from conftest import get_doc_list, get_output
+
+
+DOCUMENTS = "\n".join(
+    f'<?xml version="1.0"?><Document a="{idx}"><Nm>Name {idx}</Nm><Amt>{idx}</Amt></Document>'
+    for idx in range(1, 6)
+)
+
+# documents with a tag repeated as data tag and as node, the tag type of the first
+# repetition decides whether it is a data tag
+MIXED_DOCUMENTS = "\n".join(
+    [
+        '<?xml version="1.0"?><Document><Nm>A</Nm><Itm>1</Itm><Itm><X>2</X></Itm><Itm>3</Itm></Document>',
+        '<?xml version="1.0"?><Document><Nm>B</Nm><Itm><X>4</X></Itm><Itm>5</Itm><Itm>6</Itm></Document>',
+        '<?xml version="1.0"?><Document><Nm>C</Nm>'
+        + "".join(f"<Itm>{idx}</Itm>" for idx in range(7, 20))
+        + "</Document>",
+    ]
+)
+
+
+def test_pivot_output_matches_parsed_xml(make_file_processor):
+    file_processor = make_file_processor(MIXED_DOCUMENTS)
+    file_processor.process_file()
+    pm = file_processor.pm
+
+    (doc_type,) = pm.get_xml_types()
+    headers = [row["Tag"] for row in pm.get_xml_tags_by_type(doc_type)]
+    expected = []
+    for doc_id in range(1, 4):
+        parsed_xml = pm.get_xml_doc_parsed(doc_id, XmlAttribute.ParsedXml, True)
+        expected.append(tuple(parsed_xml.get(tag) for tag in headers))
+
+    assert [tuple(row) for row in pm.get_output_records_by_xml_type(doc_type)] == expected
+    pm.create_output_by_xml_type(doc_type)
+    assert [tuple(row) for row in pm.get_output_by_xml_type(doc_type)] == expected
+    assert expected[2][headers.index("xml.Document.Itm")] == " | ".join(
+        str(idx) for idx in range(7, 20)
+    )
+
+
+@pytest.mark.parametrize("background_writer", [False, True])
+def test_small_cache_budget_flushes_the_cache(make_file_processor, background_writer):
+    content = f"{DOCUMENTS}\n{MIXED_DOCUMENTS}"
+    results = []
+    for cache_budget in [None, 256]:
+        kwargs = {"cache_budget": cache_budget} if cache_budget else {}
+        file_processor = make_file_processor(
+            content, background_writer=background_writer, **kwargs
+        )
+        file_processor.process_file()
+        file_processor.pm.commit_writes()
+        results.append(
+            (
+                file_processor.pm.get_cache_stats().auto_flushes,
+                get_doc_list(file_processor),
+                list(file_processor.get_process_log()),
+                get_output(file_processor),
+                get_output(file_processor, {"Nm": ["xml.Document.Itm"]}),
+            )
+        )
+
+    (default_flushes, *expected), (auto_flushes, *result) = results
+    assert default_flushes == 0
+    assert auto_flushes > 0
+    assert result == expected
+    # a header and a row per document, the split gives a row per Itm
+    assert len(expected[2]["Nm"]) == 9
+    assert len(expected[3]["Nm"]) > len(expected[2]["Nm"])
+
+
+def test_file_processor_with_background_writer_pickles(make_file_processor):
+    file_processor = make_file_processor(DOCUMENTS, background_writer=True)
+    file_processor.process_file()
+
+    restored = pickle.loads(pickle.dumps(file_processor))
+
+    assert restored.pm.writer is not None
+    assert restored.pm.writer is not file_processor.pm.writer
+    assert restored.pm.writer.is_alive()
+    assert restored.pm.get_doc_count(DocValidity.VALID) == 5
+    doc_types = list(restored.pm.get_xml_types())
+    assert doc_types == list(file_processor.pm.get_xml_types())
+
+    # the restored object writes through its own background writer
+    restored.process_file()
+    assert list(restored.pm.get_xml_types()) == doc_types
+    assert len(list(restored.pm.get_output_records_by_xml_type(doc_types[0]))) == 5
+
+
+def test_pickling_writes_the_cache(tmp_path):
+    pm = PersistenceManager(data_directory=str(tmp_path), background_writer=True)
+    pm.store_doc(1, DocValidity.VALID, "<a>1</a>")
+
+    restored = pickle.loads(pickle.dumps(pm))
+
+    assert pm.cache_bytes == 0
+    assert restored.cache_bytes == 0
+    assert restored.get_doc_count() == 1
+    restored.store_doc(2, DocValidity.VALID, "<a>2</a>")
+    restored.commit_writes()
+    assert pm.get_doc_count() == 2
+
+
+def test_pickling_drops_the_id_lookups(make_file_processor):
+    file_processor = make_file_processor(DOCUMENTS)
+    file_processor.process_file()
+    pm = file_processor.pm
+    assert pm.fstar_shapes and pm.tag_path_ids and pm.type_ids
+
+    state = pm.__getstate__()
+
+    assert state["fstar_shapes"] is None
+    assert state["tag_path_ids"] is None
+    assert state["type_ids"] is None
+    # the lookups of the pickled object stay in place
+    assert pm.fstar_shapes and pm.tag_path_ids and pm.type_ids
+
+
+def test_fstar_shape_ids_are_loaded_by_shape_hash(tmp_path):
+    pm = PersistenceManager(data_directory=str(tmp_path))
+    fstars = [
+        ForwardStar.from_parent_array([-1, 0, 0]),
+        ForwardStar.from_parent_array([-1, 0, 1]),
+        ForwardStar.from_parent_array([-1, 0, 0]),
+    ]
+    assert [pm._get_fstar_shape_id(fstar) for fstar in fstars] == [1, 2, 1]
+    pm.commit_writes()
+
+    rows = pm.conn.execute(
+        "SELECT ShapeID, ShapeHash, FStar FROM XmlFStarShapes ORDER BY ShapeID"
+    ).fetchall()
+    assert [tuple(row) for row in rows] == [
+        (1, fstars[0].get_shape_hash(), fstars[0].to_bytes()),
+        (2, fstars[1].get_shape_hash(), fstars[1].to_bytes()),
+    ]
+
+    # a new connection to the database reuses the stored shapes
+    reader = PersistenceManager(db_name=pm.db_name)
+    shape_ids = [
+        reader._get_fstar_shape_id(ForwardStar.from_parent_array(parents))
+        for parents in ([-1, 0, 1], [-1, 0, 0], [-1])
+    ]
+    assert shape_ids == [2, 1, 3]
+    assert set(reader.fstar_shapes) == {
+        fstar.get_shape_hash() for fstar in fstars
+    } | {ForwardStar.from_parent_array([-1]).get_shape_hash()}
+
+
+def test_connecting_keeps_the_wal_journal_mode(tmp_path):
+    pm = PersistenceManager(data_directory=str(tmp_path), background_writer=True)
+    pm.store_doc(1, DocValidity.VALID, "<a>1</a>")
+    pm.commit_writes()
+
+    # a second connection while the background writer is running
+    reader = PersistenceManager(db_name=pm.db_name)
+
+    assert reader.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert reader.get_doc_count() == 1
+    pm.store_doc(2, DocValidity.VALID, "<a>2</a>")
+    pm.commit_writes()
+    assert reader.get_doc_count() == 2
+
+
+@pytest.mark.filterwarnings("error::pytest.PytestUnraisableExceptionWarning")
+def test_failed_connect_is_not_committed_on_delete(tmp_path):
+    with pytest.raises(sqlite3.OperationalError):
+        PersistenceManager(db_name=str(tmp_path / "missing" / "db.db"))
+    gc.collect()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork()")
+def test_forked_copy_is_not_committed_on_delete(tmp_path):
+    pm = PersistenceManager(data_directory=str(tmp_path))
+    pm.store_doc(1, DocValidity.VALID, "<a>1</a>")
+
+    # the copy in a forked process (e.g. a validation worker) is garbage collected
+    pid = os.fork()
+    if pid == 0:
+        pm.__del__()
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert pm.get_doc_count() == 0
+    pm.commit_writes()
+    assert pm.get_doc_count() == 1
+
+
+def test_count_tags_by_xml_type(make_file_processor):
+    file_processor = make_file_processor(
+        "\n".join(
+            [
+                '<?xml version="1.0"?><Document><PmtInf><Tx><Id>1</Id></Tx>'
+                "<Tx><Id>2</Id></Tx></PmtInf><PmtInf><Tx><Id>3</Id></Tx></PmtInf>"
+                "</Document>",
+                '<?xml version="1.0"?><Document><PmtInf><Nm>A</Nm></PmtInf></Document>',
+            ]
+        )
+    )
+    file_processor.process_file()
+    pm = file_processor.pm
+    (doc_type,) = pm.get_xml_types()
+
+    pmt_inf_tag_ids = [
+        (row["DocID"], row["TagID"])
+        for row in pm.conn.execute(
+            """SELECT t.DocID, t.TagID FROM XmlTagsAndValues t
+            INNER JOIN XmlTagCatalog c ON c.TagPathID = t.TagPathID
+            WHERE c.Tag = 'xml.Document.PmtInf' ORDER BY t.DocID, t.TagID"""
+        )
+    ]
+    counts = pm.count_tags_by_xml_type(
+        doc_type, "xml.Document.PmtInf", "xml.Document.PmtInf.Tx"
+    )
+
+    assert [(doc_id, tag_id) for doc_id, tag_id, _ in counts] == pmt_inf_tag_ids
+    assert [count for _, _, count in counts] == [2, 1, 0]
+    assert [
+        count
+        for _, _, count in pm.count_tags_by_xml_type(
+            doc_type, "xml.Document", "xml.Document.PmtInf.Tx.Id", children_only=False
+        )
+    ] == [3, 0]
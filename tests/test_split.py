@@ -0,0 +1,211 @@
+import pytest
+
+from webapp.fileprocessor import SplitMode
+from webapp.pm5 import DocValidity
+from webapp.xmlparser import AttributeUsage
+
+from conftest import get_doc_list, get_output, get_split_log
+
+
+DOCUMENT_1 = '<?xml version="1.0"?><Document a="1"><Nm>One</Nm></Document>'
+DOCUMENT_2 = '<?xml version="1.0"?><Document a="2"><Nm>Two</Nm></Document>'
+
+NO_DELIMITER_LOG = [
+    (
+        "ERROR",
+        "Error during splitting of document: None of the known delimiters <xml*> and/or <document*> found",
+    )
+]
+
+
+SPLIT_CASES = {
+    "one_document_per_line": f"{DOCUMENT_1}\n{DOCUMENT_2}\n",
+    "documents_on_one_line": (
+        '<?xml version="1.0"?><Document a="1"><Nm>One</Nm></Document>'
+        '<Document a="2"><Nm>Two</Nm></Document>\n'
+    ),
+    "space_after_prolog": (
+        '<?xml version="1.0"?> <Document a="1"><Nm>One</Nm></Document>'
+        '<Document a="2"><Nm>Two</Nm></Document>\n'
+    ),
+    "prolog_on_line_of_its_own": f'<?xml version="1.0"?>\n<Document a="1"></Document>\n{DOCUMENT_2}\n',
+    "documents_without_prolog": '<Document a="1"></Document>\n<Document a="2"></Document>',
+    "crlf_line_endings": f"{DOCUMENT_1}\r\n\r\n{DOCUMENT_2}\r\n",
+    "mixed_case": '<?XML version="1.0"?><document a="1"></document>\n<DOCUMENT a="2"></DOCUMENT>\n',
+    "prolog_and_document_apart": '<?xml version="1.0"?><Root/><Document a="1"></Document>\n',
+    "tag_not_closed_on_line": f'{DOCUMENT_1}\n<Document a="2"\nb="2"></Document>\n',
+    "invalid_document": f"{DOCUMENT_1}\n<?xml version=\"1.0\"?><Document a=\"2\"><Nm>Two</Document>\n",
+}
+
+# documents of two types with repetitive elements and an invalid document
+INGEST_CONTENT = "\n".join(
+    [
+        '<?xml version="1.0"?><Document a="1"><Hdr><Id>1</Id></Hdr>'
+        "<Itm><Ref>a</Ref><Amt>1.5</Amt></Itm><Itm><Ref>b</Ref></Itm></Document>",
+        '<?xml version="1.0"?><Document a="2"><Hdr><Id>2</Id></Hdr>'
+        "<Itm><Ref>c</Ref><Amt>3</Amt></Itm></Document>",
+        '<?xml version="1.0"?><Document a="3"><Hdr><Id>3</Id></Document>',
+        '<?xml version="1.0"?><Other><Id>4</Id><Nm>Four</Nm></Other>',
+        '<?xml version="1.0"?><Document a="5"><Hdr><Id>5</Id></Hdr>'
+        + "".join(f"<Itm><Ref>{idx}</Ref></Itm>" for idx in range(6))
+        + "</Document>",
+    ]
+)
+
+INGEST_SPLIT_ON = {"Hdr": ["xml.Document.Itm.Ref"]}
+
+
+def get_ingest_result(file_processor, **options):
+    # everything stored by the split and by process_file() with the given options
+    result = file_processor.process_file(**options)
+    return (
+        result,
+        get_doc_list(file_processor),
+        list(file_processor.get_process_log()),
+        get_output(file_processor),
+        get_output(file_processor, INGEST_SPLIT_ON),
+    )
+
+
+@pytest.mark.parametrize("content", SPLIT_CASES.values(), ids=SPLIT_CASES.keys())
+def test_split_modes_give_the_same_result(make_file_processor, content):
+    results = {}
+    for split_mode in SplitMode:
+        file_processor = make_file_processor(
+            content, split_mode=split_mode, chunk_size=16
+        )
+        results[split_mode] = (
+            file_processor.xml_split_noerror,
+            sorted(file_processor.doc_delimiters),
+            get_doc_list(file_processor),
+            get_split_log(file_processor),
+        )
+
+    assert results[SplitMode.in_memory][2]
+    assert results[SplitMode.streaming] == results[SplitMode.in_memory]
+    assert results[SplitMode.mmap_scan] == results[SplitMode.in_memory]
+
+
+@pytest.mark.parametrize("split_mode", list(SplitMode))
+def test_custom_separator(make_file_processor, split_mode):
+    content = "<a>1</a>\n###\n<a>2</a>\n###\n<a>3</a>\n"
+    file_processor = make_file_processor(
+        content, split_mode=split_mode, custom_separator="###", chunk_size=5
+    )
+
+    assert file_processor.xml_split_noerror is True
+    assert file_processor.doc_delimiters == ["###"]
+    assert get_doc_list(file_processor) == [
+        (1, DocValidity.VALID, "<a>1</a>"),
+        (2, DocValidity.VALID, "<a>2</a>"),
+        (3, DocValidity.VALID, "<a>3</a>"),
+    ]
+
+
+@pytest.mark.parametrize("split_mode", list(SplitMode))
+@pytest.mark.parametrize(
+    "content",
+    [
+        "<a><b>1</b></a>\n",
+        '<?xml version="1.0"?><a><b>1</b></a>\n',
+    ],
+)
+def test_no_delimiter_stores_nothing(make_file_processor, split_mode, content):
+    file_processor = make_file_processor(content, split_mode=split_mode)
+
+    assert file_processor.xml_split_noerror is False
+    assert file_processor.doc_delimiters == []
+    assert get_doc_list(file_processor) == []
+    assert get_split_log(file_processor) == NO_DELIMITER_LOG
+
+
+@pytest.mark.parametrize("split_mode", [SplitMode.streaming, SplitMode.mmap_scan])
+def test_text_before_first_delimiter_is_a_document(make_file_processor, split_mode):
+    content = f"garbage\n{DOCUMENT_1}\n{DOCUMENT_2}\n"
+    file_processor = make_file_processor(content, split_mode=split_mode)
+
+    assert file_processor.xml_split_noerror is False
+    assert get_doc_list(file_processor) == [
+        (1, DocValidity.INVALID, "garbage"),
+        (2, DocValidity.VALID, DOCUMENT_1),
+        (3, DocValidity.VALID, DOCUMENT_2),
+    ]
+
+
+def test_text_before_first_delimiter_in_memory(make_file_processor):
+    # the in-memory split takes the text for a delimiter, see _split_into_documents_iter()
+    content = f"garbage\n{DOCUMENT_1}\n{DOCUMENT_2}\n"
+    file_processor = make_file_processor(content, split_mode=SplitMode.in_memory)
+
+    assert get_doc_list(file_processor) == []
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1024])
+def test_streaming_chunk_size_does_not_change_split(make_file_processor, chunk_size):
+    # a long document on a single line, followed by documents on lines of their own
+    long_document = DOCUMENT_1.replace("<Nm>One</Nm>", "<Nm>One</Nm>" * 200)
+    content = f"{long_document}{DOCUMENT_2}\n{DOCUMENT_1}\n<Document b=\"3\"></Document>\n"
+    in_memory = make_file_processor(content, split_mode=SplitMode.in_memory)
+    streaming = make_file_processor(
+        content,
+        split_mode=SplitMode.streaming,
+        chunk_size=chunk_size,
+        boundary_overlap=128,
+    )
+
+    assert get_doc_list(streaming) == get_doc_list(in_memory)
+    assert sorted(streaming.doc_delimiters) == sorted(in_memory.doc_delimiters)
+    assert streaming.line_count == in_memory.line_count
+
+
+@pytest.mark.parametrize(
+    "validation_workers, validation_batch_size", [(2, 1), (2, 2), (3, 1_000)]
+)
+@pytest.mark.parametrize("split_mode", list(SplitMode))
+def test_validation_workers_give_the_same_result(
+    make_file_processor, split_mode, validation_workers, validation_batch_size
+):
+    expected = get_ingest_result(
+        make_file_processor(INGEST_CONTENT, split_mode=split_mode)
+    )
+    file_processor = make_file_processor(
+        INGEST_CONTENT,
+        split_mode=split_mode,
+        validation_workers=validation_workers,
+        validation_batch_size=validation_batch_size,
+    )
+
+    assert [doc[1] for doc in expected[1]] == [
+        DocValidity.VALID,
+        DocValidity.VALID,
+        DocValidity.INVALID,
+        DocValidity.VALID,
+        DocValidity.VALID,
+    ]
+    assert get_ingest_result(file_processor) == expected
+
+
+@pytest.mark.parametrize("validation_workers", [1, 2])
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"attribute_usage": AttributeUsage.ignore}, {"type_distance_to_top": 2}],
+    ids=["same_options", "other_attribute_usage", "other_distance_to_top"],
+)
+def test_fused_ingest_gives_the_same_result(
+    make_file_processor, options, validation_workers
+):
+    expected = get_ingest_result(make_file_processor(INGEST_CONTENT), **options)
+    file_processor = make_file_processor(
+        INGEST_CONTENT,
+        fused_ingest=True,
+        validation_workers=validation_workers,
+        validation_batch_size=2,
+    )
+
+    # with fused ingest the documents are already parsed during the split
+    file_processor.pm.commit_writes()
+    assert list(file_processor.pm.get_xml_types())
+    assert file_processor.ingest_options is not None
+
+    assert get_ingest_result(file_processor, **options) == expected
+    assert expected[3] and expected[4]
@@ -0,0 +1,80 @@
+import pytest
+
+from webapp.xmlparser import (
+    AttributeUsage,
+    ParserBackend,
+    XmlEventCollector,
+    XmlParser,
+)
+from webapp.xmlvalidator import XmlValidator
+
+
+# every document of the corpus has to be flattened to the same tags, values, type,
+# tag counts and forward star by all backends: prolog / no prolog, namespaces,
+# comments, CDATA, processing instructions, whitespace only and repeated tags
+CORPUS = [
+    """<?xml version="1.0" encoding="UTF-8"?><Document xmlns="urn:iso:std:iso:20022:tech:xsd:pain.008.001.02" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><CstmrDrctDbtInitn><GrpHdr><MsgId>Message 9 200131106</MsgId><NbOfTxs>2</NbOfTxs><InitgPty><Nm>PILOTFORETAG B</Nm><Id><OrgId><Othr><Id>3321251633</Id><SchmeNm><Cd>BANK</Cd></SchmeNm></Othr></OrgId></Id></InitgPty></GrpHdr><PmtInf><PmtInfId>SEND PAYMENT VER 009</PmtInfId><DrctDbtTxInf><PmtId><EndToEndId>BMO1 SEND PROD VER 10 1106</EndToEndId></PmtId><InstdAmt Ccy="EUR">0.20</InstdAmt><RmtInf><Ustrd>Invoice 1</Ustrd></RmtInf></DrctDbtTxInf><DrctDbtTxInf><PmtId><EndToEndId>BMO2 SEND PROD VER 11 1106</EndToEndId></PmtId><InstdAmt Ccy="EUR">0.10</InstdAmt><RmtInf><Ustrd>Invoice 2</Ustrd></RmtInf></DrctDbtTxInf></PmtInf></CstmrDrctDbtInitn></Document>""",
+    """<?xml version="1.0" encoding="ISO-8859-1"?>\n<Document a="1">\n  <A x="1">1</A>\n  <A x="2">2</A>\n  <B><C>t<D>u</D>v</C></B>\n</Document>""",
+    """<r><a>  </a><b></b><c/><d>x<!--c--></d><e><!--only--></e><f><![CDATA[cd]]>t</f><g><?pi data?></g><h>&amp;&lt;</h></r>""",
+    """<r><e><!----></e><f><!--  --></f><g><?pi?></g><h><![CDATA[]]></h></r>""",
+    """<r xmlns:n="u"><n:a n:x="1" y="2">v</n:a><b xmlns="z" k="1">w</b><n:c>1</n:c><n:c a="2">2</n:c></r>""",
+    """<a><a>1</a><b c="1" d="2">x</b></a>""",
+    """<Document><Document><X>1</X></Document></Document>""",
+    """<a b="1">1</a>""",
+]
+
+BACKENDS = ["soup", "sax", "expat"]
+
+
+def parse_with(backend, document, top_node_tree_level, type_distance_to_top):
+    # the sax backend takes the elements collected during the validation of the document
+    event_collector = None
+    if backend == "sax":
+        event_collector = XmlEventCollector(document)
+        assert XmlValidator().validate_doc(document, event_collector).valid
+
+    try:
+        return XmlParser(
+            document,
+            top_node_tree_level,
+            type_distance_to_top,
+            event_collector=event_collector,
+            backend=ParserBackend.expat if backend == "expat" else ParserBackend.soup,
+        )
+    except (ValueError, IndexError) as e:
+        return type(e)
+
+
+def flatten(xml_parsed, attribute_usage):
+    tags_n_values = xml_parsed.get_tags_and_values(attribute_usage, True)
+    return (
+        tags_n_values.ok,
+        # errors are compared by type and message
+        tags_n_values.result if tags_n_values.ok else repr(tags_n_values.result),
+        xml_parsed.type,
+        xml_parsed.soup_no_of_tags,
+        xml_parsed.source_no_of_tags,
+        xml_parsed.fstar.get_fstar_data() if xml_parsed.fstar else None,
+    )
+
+
+@pytest.mark.parametrize("type_distance_to_top", [1, 2])
+@pytest.mark.parametrize("top_node_tree_level", [0, 1])
+@pytest.mark.parametrize("document", CORPUS, ids=range(len(CORPUS)))
+def test_backends_flatten_documents_the_same(
+    document, top_node_tree_level, type_distance_to_top
+):
+    parsed = {
+        backend: parse_with(backend, document, top_node_tree_level, type_distance_to_top)
+        for backend in BACKENDS
+    }
+
+    if not isinstance(parsed["soup"], XmlParser):
+        # all backends have to raise the same error
+        assert parsed["sax"] == parsed["expat"] == parsed["soup"]
+        return
+
+    for attribute_usage in AttributeUsage:
+        expected = flatten(parsed["soup"], attribute_usage)
+        assert flatten(parsed["sax"], attribute_usage) == expected
+        assert flatten(parsed["expat"], attribute_usage) == expected
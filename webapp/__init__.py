@@ -1,14 +1,9 @@
-import sys
 from os import path
 import pathlib
 
 from flask import Flask
 from webapp.appconfig import AppConfig
 
-# set the max recursion level to 2'500 (default is 1'000) for more complex xml files
-# to be serialized as part of the session handling with flask-kvsession
-sys.setrecursionlimit(9500)
-
 
 # Flask specific part
 app = Flask(__name__)
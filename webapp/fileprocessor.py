@@ -6,10 +6,19 @@ These docuemnts are then processed leveraging the xmlparser module and finally c
 # Imports
 # ------------------
 import os
+import csv
+import enum
+import gzip
+import json
+import mmap
 import datetime as dt
 from re import I
 import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import chain, islice
 
 # import re
 import regex as re
@@ -19,7 +28,14 @@ import xlsxwriter
 # import pandas as pd
 
 # import for usage in flask app
-from webapp.xmlparser import XmlParser, AttributeUsage, Result
+from webapp.xmlparser import (
+    XmlParser,
+    XmlEventCollector,
+    AttributeUsage,
+    ParserBackend,
+    FlatteningPlans,
+    Result,
+)
 from webapp.xmlvalidator import XmlValidator  # , ValidationResult
 
 from webapp.pm5 import (
@@ -28,6 +44,7 @@ from webapp.pm5 import (
     XmlAttribute,
     IndexGroup,
     LogLevel,
+    DEFAULT_CACHE_BUDGET,
 )
 
 # from webapp.persistencemanager import (
@@ -69,23 +86,85 @@ __email__ = "dani.grass@bluewin.ch"
 __status__ = "Development"
 
 
+# the maximum number of rows of an Excel sheet (including the header)
+EXCEL_MAX_ROWS = 1_048_576
+
+# the number of characters at the end of the text read so far, within which the
+# streaming split waits for the next chunk before it confirms a delimiter
+STREAMING_BOUNDARY_OVERLAP = 64 * 1024
+
+# the number of records written at once by the csv, jsonl and parquet exports and
+# the gzip compression level of the compressed exports
+EXPORT_CHUNK_SIZE = 10_000
+EXPORT_GZIP_LEVEL = 6
+
+
+class SplitMode(enum.Enum):
+    in_memory = 1
+    streaming = 2
+    mmap_scan = 3
+
+
 class FileProcessor:
 
     # ------------------
     # Standard Functions
     # ------------------
-    def __init__(self, source_file, custom_separator=None, data_directory=None):
+    def __init__(
+        self,
+        source_file,
+        custom_separator=None,
+        data_directory=None,
+        split_mode=SplitMode.in_memory,
+        chunk_size=8 * 1024 * 1024,
+        boundary_overlap=STREAMING_BOUNDARY_OVERLAP,
+        validation_workers=1,
+        validation_batch_size=1_000,
+        fused_ingest=False,
+        attribute_usage=AttributeUsage.add_separate_tag,
+        concat_on_key_error=True,
+        top_node_tree_level=0,
+        type_distance_to_top=1,
+        cache_budget=DEFAULT_CACHE_BUDGET,
+        background_writer=False,
+    ):
 
         with open(source_file) as file_handle:
 
             # basic attributes
-            self.file_content = file_handle.read()
             self.file_full_name = file_handle.name
             self.file_path = os.path.abspath(file_handle.name)
             self.file_name = os.path.basename(file_handle.name)
             self.file_name_root = os.path.splitext(self.file_name)[0]
-            self.line_count = self.file_content.count("\n")
+            self.file_encoding = file_handle.encoding
             self.custom_separator = custom_separator
+            self.split_mode = split_mode
+            self.chunk_size = chunk_size
+            self.boundary_overlap = boundary_overlap
+            self.validation_workers = validation_workers
+            self.validation_batch_size = validation_batch_size
+
+            # with fused_ingest the documents are parsed and flattened in the same sax pass
+            # that validates them, using the given options. process_file() called with
+            # the same options then only has to finalize the stored results.
+            if fused_ingest:
+                self.ingest_options = (
+                    attribute_usage,
+                    concat_on_key_error,
+                    top_node_tree_level,
+                    type_distance_to_top,
+                )
+            else:
+                self.ingest_options = None
+            self.ingest_result = "success"
+
+            # in streaming and mmap_scan mode the file is read during the split
+            # and the line count is calculated on the fly
+            if self.split_mode == SplitMode.in_memory:
+                self.file_content = file_handle.read()
+                self.line_count = self.file_content.count("\n")
+            else:
+                self.line_count = 0
 
         if data_directory:
             self._data_path = data_directory
@@ -93,8 +172,14 @@ class FileProcessor:
             # get the current temporary directory
             self._data_path = tempfile.gettempdir()
 
-        # create the persistence manager
-        self.pm = PersistenceManager(data_directory=self._data_path)
+        # create the persistence manager, the data is written to the database whenever
+        # the cached records exceed the cache budget (in bytes) - with the background
+        # writer on a separate thread, overlapping with the parsing
+        self.pm = PersistenceManager(
+            data_directory=self._data_path,
+            cache_budget=cache_budget,
+            background_writer=background_writer,
+        )
         self.db_name = self.pm.db_name
 
         # define the identifiers of a xml document
@@ -156,7 +241,16 @@ class FileProcessor:
         # read the file into a list of single xml documents
         # self.xml_source = []
         # self.xml_source_invalid = []
-        self.xml_split_noerror = self._split_into_documents()
+        if self.split_mode == SplitMode.streaming:
+            self.xml_split_noerror = self._split_into_documents_iter(
+                self._iter_documents_streaming()
+            )
+        elif self.split_mode == SplitMode.mmap_scan:
+            self.xml_split_noerror = self._split_into_documents_iter(
+                self._iter_documents_mmap()
+            )
+        else:
+            self.xml_split_noerror = self._split_into_documents()
         # self.no_of_docs_in_file = len(self.xml_source)
         # self.no_of_invalid_docs_in_file = len(self.xml_source_invalid)
         self.no_of_docs_in_file = self.pm.get_doc_count(DocValidity.VALID)
@@ -164,7 +258,8 @@ class FileProcessor:
 
         # the raw file content is no longer needed, once the _split_into_documents() has been executed.
         # so release that memory by deleting the variable
-        del self.file_content
+        if self.split_mode == SplitMode.in_memory:
+            del self.file_content
 
         # initiate the internal store for the the output
         self.doc_types = {}
@@ -193,15 +288,37 @@ class FileProcessor:
         concat_on_key_error=True,
         top_node_tree_level=0,
         type_distance_to_top=1,
+        backend=ParserBackend.soup,
     ):
 
+        # check if the documents have already been parsed during the split (fused ingest)
+        # with the same options - if yes, only the indices need to be created
+        options = (
+            attribute_usage,
+            concat_on_key_error,
+            top_node_tree_level,
+            type_distance_to_top,
+        )
+        if not self.file_processed and options == self.ingest_options:
+            print(f"No of docs processed during split: {self.no_of_docs_in_file}")
+            self.pm.commit_writes()
+            # like the process log truncated below, only the log of the documents
+            # is kept, not the one of the split (logged with doc id 0)
+            self.pm.truncate_process_log(doc_id=0)
+            self.pm.drop_indices(IndexGroup.PROCESS_LOG)
+            self.pm.create_indices(IndexGroup.PROCESS_LOG)
+            self.pm.create_indices(IndexGroup.XML_STORE)
+
+            self.file_processed = True
+            return self.ingest_result
+
         # truncate the process log and remove indices
         self.pm.drop_indices(IndexGroup.PROCESS_LOG)
         self.pm.truncate_process_log()
 
-        # check if file has already been processed
+        # check if file has already been processed (or parsed during the split)
         # if yes, truncate all xlm related tables and remove indices
-        if self.file_processed:
+        if self.file_processed or self.ingest_options:
             self.pm.drop_indices(IndexGroup.XML_STORE)
             self.pm.truncate_xml_store()
 
@@ -216,78 +333,27 @@ class FileProcessor:
         # ):
         #     print(index, doc_validity, xml_doc[:100])
 
+        # the flattening plans learned from the documents (expat backend only)
+        flattening_plans = FlatteningPlans()
+
         # process the data
         for index, doc_validity, xml_doc, doc_invalid_reason in self.pm.get_all_docs(
             DocValidity.VALID
         ):
-            if index % 20_000 == 0:
-                # commit every 20'000 records
-                self.pm.commit_writes()
-
             # print(f"START: Processing document #{index}...")
             progress_pct = round((index * 100) / docs_to_process, 2)
             if (progress_pct).is_integer():
                 print(f"Processing documents is at {progress_pct:3.0f}%...", end="\r")
             # the actual processing
-            try:
-                xml_parsed = XmlParser(
-                    xml_doc, top_node_tree_level, type_distance_to_top, index
-                )
-            except ValueError as e:
-                # print(
-                #     f"ERROR: skipping document #{index} due to the following error: {e}"
-                # )
-
-                self.pm.log_error(
-                    index,
-                    f"ERROR: skipping document #{index} due to the following error: {e}",
-                )
-                # self.process_log.append(
-                #     f"ERROR: skipping document #{index} due to the following error: {e}"
-                # )
+            parse_result = parse_document(
+                xml_doc,
+                index,
+                options,
+                backend=backend,
+                flattening_plans=flattening_plans,
+            )
+            if not self._store_parse_result(index, parse_result):
                 out = "error"
-                xml_parsed = None
-            except IndexError as e:
-
-                self.pm.log_error(
-                    index,
-                    f"ERROR: parsinng document #{index} failed due to the following error: {e}",
-                )
-                # self.process_log.append(
-                #     f"ERROR: parsinng document #{index} failed due to the following error: {e}"
-                # )
-                out = "error"
-                xml_parsed = None
-                # return out
-            else:
-                # print(f"INFO: document #{index} successfully loaded")
-                self.pm.log_success(
-                    index, f"INFO: document #{index} successfully loaded"
-                )
-                # self.process_log.append(f"INFO: document #{index} successfully loaded")
-                # check the document type and either get the list of records
-                # if already existing or create a new list if new document type
-                # if xml_parsed.type in self.doc_types:
-                #     doc_data = self.doc_types[xml_parsed.type]
-                # else:
-                #     doc_data = []
-
-                # read the tags and values from the parsed xml document
-                # the error handling is actually not needed as the option
-                # concat_on_key_error=True will not raise any KeyErrors
-
-                tags_n_values = xml_parsed.get_tags_and_values(
-                    attribute_usage, concat_on_key_error
-                )
-                if tags_n_values.ok:
-                    tags_n_values = tags_n_values.result
-                    self.pm.store_xml_parsed(index, tags_n_values, xml_parsed)
-                else:
-                    e = tags_n_values.result
-                    self.pm.log_error(
-                        index,
-                        f"ERROR: skipping document #{index} due to the following error: {e}",
-                    )
 
                 # try:
                 #     tags_n_values = xml_parsed.get_tags_and_values(
@@ -431,8 +497,19 @@ class FileProcessor:
             yield row_out
 
     # @profile
-    def to_excel(self, out_path=None, attrs_to_split_on=None):
-        # create the output
+    def to_excel(
+        self,
+        out_path=None,
+        attrs_to_split_on=None,
+        direct_output=False,
+        workbook_per_type=False,
+        excel_workers=1,
+    ):
+        # create the output, with direct_output the records are written straight
+        # to the sheets (opened in constant memory mode) instead of being stored in
+        # the FinalOutput tables first. With workbook_per_type each document type is
+        # written directly to a workbook of its own by excel_workers processes and the
+        # workbooks are returned as a zip file.
         cnt_files = 0
 
         dt_now = dt.datetime.now()
@@ -443,6 +520,11 @@ class FileProcessor:
         else:
             file_out_path = self._data_path
 
+        if workbook_per_type:
+            return self._to_excel_per_type(
+                file_out_path, timestamp, attrs_to_split_on, excel_workers
+            )
+
         file_out_name = f"{self.file_name_root}_{timestamp}.xlsx"
         file_out = os.path.join(file_out_path, file_out_name)
 
@@ -463,40 +545,29 @@ class FileProcessor:
         #     return "No output data extracted - Excel file not created!"
 
         # Create file
-        workbook = xlsxwriter.Workbook(file_out)
+        if direct_output:
+            workbook = xlsxwriter.Workbook(file_out, {"constant_memory": True})
+        else:
+            workbook = xlsxwriter.Workbook(file_out)
         for doc_type in self.pm.get_xml_types():
-            try:
-                # Sheet names in excel can have up to 31 chars
-                worksheet = workbook.add_worksheet(name=doc_type[0:31])
-            except:
-                pass
-
             # debug...
             # print(f"{datetime.now():%Y-%m-%d %H:%M:%S}: creating output for {doc_type}")
             # create the output table for each document type
-            if attrs_to_split_on:
-                # print(f"this is the data received from frontend: {attrs_to_split_on}")
-                if doc_type in attrs_to_split_on:
-                    create_record_on = set(attrs_to_split_on[doc_type])
-                    # print(
-                    #     f"passing on the following split on attrs for type {doc_type}: {create_record_on}"
-                    # )
-                    self.pm.create_output_by_xml_type(
-                        doc_type=doc_type, create_record_on=create_record_on
-                    )
-                else:
-                    self.pm.create_output_by_xml_type(doc_type=doc_type)
+            create_record_on = self._get_create_record_on(attrs_to_split_on, doc_type)
+
+            if direct_output:
+                output = self.pm.get_output_records_by_xml_type(
+                    doc_type=doc_type, create_record_on=create_record_on
+                )
             else:
-                self.pm.create_output_by_xml_type(doc_type=doc_type)
+                self.pm.create_output_by_xml_type(
+                    doc_type=doc_type, create_record_on=create_record_on
+                )
+                output = self.pm.get_output_by_xml_type(doc_type)
 
-            # write the header to the output sheet
+            # write the header and the data row by row to the output sheet(s)
             header = (row["Tag"] for row in self.pm.get_xml_tags_by_type(doc_type))
-            worksheet.write_row(0, 0, header)
-            # write the data row by row to the output sheet
-            for row_number, row in enumerate(
-                self.pm.get_output_by_xml_type(doc_type), start=1
-            ):
-                worksheet.write_row(row_number, 0, tuple(row))
+            write_excel_sheets(workbook, doc_type, header, output)
 
         # Saves the new document
         workbook.close()
@@ -504,15 +575,129 @@ class FileProcessor:
         self.generated_excel = True
         return file_out_name
 
+    def to_csv(self, out_path=None, attrs_to_split_on=None, compress=False):
+        """Writes the records of each document type to a csv file of its own (gzipped
+        with compress) and returns the list of file names.
+        """
+        file_extension = "csv.gz" if compress else "csv"
+        return self._export_by_type(
+            out_path,
+            attrs_to_split_on,
+            file_extension,
+            lambda file_out, header, records: write_csv(
+                file_out, header, records, compress
+            ),
+        )
+
+    def to_jsonl(self, out_path=None, attrs_to_split_on=None, compress=False):
+        """Writes the records of each document type to a json lines file of its own,
+        one json object per record (gzipped with compress) and returns the list of
+        file names.
+        """
+        file_extension = "jsonl.gz" if compress else "jsonl"
+        return self._export_by_type(
+            out_path,
+            attrs_to_split_on,
+            file_extension,
+            lambda file_out, header, records: write_jsonl(
+                file_out, header, records, compress
+            ),
+        )
+
+    def to_parquet(self, out_path=None, attrs_to_split_on=None, compress=False):
+        """Writes the records of each document type to a parquet file of its own
+        (with gzip compressed pages with compress) and returns the list of file
+        names. Requires pyarrow.
+        """
+        return self._export_by_type(
+            out_path,
+            attrs_to_split_on,
+            "parquet",
+            lambda file_out, header, records: write_parquet(
+                file_out, header, records, compress
+            ),
+        )
+
     # ------------------
     # Internal Functions
     # ------------------
+    def _export_by_type(self, out_path, attrs_to_split_on, file_extension, write_type):
+        # the records are streamed straight from the database, the same records
+        # to_excel() creates for each document type
+        dt_now = dt.datetime.now()
+        timestamp = dt_now.strftime("%Y%m%d_%H%M%S")
+
+        if out_path:
+            file_out_path = out_path
+        else:
+            file_out_path = self._data_path
+
+        files_out = []
+        for doc_type in self.pm.get_xml_types():
+            create_record_on = self._get_create_record_on(attrs_to_split_on, doc_type)
+            header = [row["Tag"] for row in self.pm.get_xml_tags_by_type(doc_type)]
+            records = self.pm.get_output_records_by_xml_type(
+                doc_type=doc_type, create_record_on=create_record_on
+            )
+
+            file_out_name = (
+                f"{self.file_name_root}_{timestamp}_{doc_type}.{file_extension}"
+            )
+            write_type(os.path.join(file_out_path, file_out_name), header, records)
+            files_out.append(file_out_name)
+
+        return files_out
+
+    def _get_create_record_on(self, attrs_to_split_on, doc_type):
+        # the attributes to create the records on for the document type, if any
+        if attrs_to_split_on and doc_type in attrs_to_split_on:
+            # print(f"this is the data received from frontend: {attrs_to_split_on}")
+            return set(attrs_to_split_on[doc_type])
+        return None
+
+    def _to_excel_per_type(
+        self, file_out_path, timestamp, attrs_to_split_on, excel_workers
+    ):
+        """Writes one workbook per document type and returns the name of the zip file
+        containing them. The workbooks are written from the database, in a process
+        pool if there is more than one excel worker.
+        """
+
+        # all data has to be in the database before other processes can read it
+        self.pm.commit_writes()
+
+        jobs = []
+        for doc_type in self.pm.get_xml_types():
+            file_out = os.path.join(
+                file_out_path, f"{self.file_name_root}_{timestamp}_{doc_type}.xlsx"
+            )
+            create_record_on = self._get_create_record_on(attrs_to_split_on, doc_type)
+            jobs.append((self.db_name, doc_type, create_record_on, file_out))
+
+        if excel_workers <= 1 or len(jobs) <= 1:
+            files_out = [write_type_workbook(*job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=excel_workers) as executor:
+                files_out = list(executor.map(write_type_workbook, *zip(*jobs)))
+
+        # the workbooks are compressed already, so they are only stored in the zip
+        file_out_name = f"{self.file_name_root}_{timestamp}.zip"
+        with zipfile.ZipFile(
+            os.path.join(file_out_path, file_out_name), "w", zipfile.ZIP_STORED
+        ) as zip_file:
+            for file_out in files_out:
+                zip_file.write(file_out, arcname=os.path.basename(file_out))
+                os.remove(file_out)
+
+        self.generated_excel_name = file_out_name
+        self.generated_excel = True
+        return file_out_name
+
     def _split_into_documents(self):
         out = True
 
         print(f"Splitting File with delim: {self.re_split}")
 
-        patts = set()
         idx_start = 0
 
         if not self.custom_separator:
@@ -534,63 +719,6 @@ class FileProcessor:
                 out = False
                 return out
 
-            # regex.split returns a list containing the resulting substrings.
-            # If capturing parentheses are used in pattern, then the text of all groups in the pattern are also returned as part of the resulting list.
-            # These groups are returned as elements *before* the actual resulting substring. I.e. if 4 capturing groups have been defined,
-            # 4 items representing matches of these groups will be returned and the actual substring itself will be returned as the 5th item in the list.
-            # the list can start with an empty string.
-
-            list_raw = self.comp_re_split.split(self.file_content)
-
-            if list_raw[0] is not None:
-                if len(list_raw[0]) == 0:
-                    # ignore 1st emptyp string
-                    idx_start = 1
-
-            docs_to_process = len(list_raw)
-            doc_idx = 0
-            for idx, item in enumerate(list_raw[idx_start:], start=1):
-
-                if idx % 20_000 == 0:
-                    # commit every 20'000 records
-                    self.pm.commit_writes()
-
-                progress_pct = round((idx * 100) / docs_to_process, 2)
-                if (progress_pct).is_integer():
-                    print(
-                        f"Processing split file is at {progress_pct:3.0f}%...", end="\r"
-                    )
-
-                # the actual processing
-                if item:
-                    if idx % num_groups == 0:
-                        # this is the actual content we want
-                        validation_result = self._validate_document(item)
-                        doc_idx += 1
-                        if validation_result.valid:
-                            # store the valid item
-                            # self.xml_source.append(item.strip())
-                            self.pm.store_doc(doc_idx, DocValidity.VALID, item.strip())
-                        else:
-                            out = False
-                            # store the invalid item
-                            # self.xml_source_invalid.append(
-                            #     {
-                            #         "Document": item.strip(),
-                            #         "Validation Result": validation_result.output,
-                            #     }
-                            # )
-                            self.pm.store_doc(
-                                doc_idx,
-                                DocValidity.INVALID,
-                                item.strip(),
-                                validation_result.output,
-                            )
-                    else:
-                        patts.add(item)
-
-            self.doc_delimiters = list(patts)
-
         else:
 
             # the custom delimiter has only one group, so add 1 + 1
@@ -606,63 +734,77 @@ class FileProcessor:
                 out = False
                 return out
 
-            # regex.split returns a list containing the resulting substrings.
-            # If capturing parentheses are used in pattern, then the text of all groups in the pattern are also returned as part of the resulting list.
-            # These groups are returned as elements *before* the actual resulting substring. I.e. if 4 capturing groups have been defined,
-            # 4 items representing matches of these groups will be returned and the actual substring itself will be returned as the 5th item in the list.
-            # the list can start with an empty string.
+        # regex.split returns a list containing the resulting substrings.
+        # If capturing parentheses are used in pattern, then the text of all groups in the pattern are also returned as part of the resulting list.
+        # These groups are returned as elements *before* the actual resulting substring. I.e. if 4 capturing groups have been defined,
+        # 4 items representing matches of these groups will be returned and the actual substring itself will be returned as the 5th item in the list.
+        # the list can start with an empty string.
 
-            list_raw = self.comp_re_split.split(self.file_content)
+        list_raw = self.comp_re_split.split(self.file_content)
 
-            if list_raw[0] is not None:
-                if len(list_raw[0]) == 0:
-                    # ignore 1st emptyp string
-                    idx_start = 1
+        if list_raw[0] is not None:
+            if len(list_raw[0]) == 0:
+                # ignore 1st emptyp string
+                idx_start = 1
 
-            docs_to_process = len(list_raw)
-            doc_idx = 0
-            for idx, item in enumerate(list_raw[idx_start:], start=1):
+        out = self._store_documents(
+            self._iter_documents_in_memory(list_raw, idx_start, num_groups)
+        )
 
-                if idx % 20_000 == 0:
-                    # commit every 20'000 records
-                    self.pm.commit_writes()
+        # once all data is processed and stored, create the indices
+        self.pm.commit_writes()
+        self.pm.create_indices(IndexGroup.DOC_STORE)
 
-                progress_pct = round((idx * 100) / docs_to_process, 2)
-                if (progress_pct).is_integer():
-                    print(
-                        f"Processing split file is at {progress_pct:3.0f}%...", end="\r"
-                    )
+        if out == False:
+            self.pm.log_warning(
+                0,
+                "File successfully split into single documents with invalid docutments found.",
+            )
+        else:
+            self.pm.log_success(
+                0, "File successfully split into single documents without any errors."
+            )
+        self.pm.commit_writes()
+        # print(f"out={out}")
+        return out
+
+    def _split_into_documents_iter(self, documents):
+        """Stores the (delimiter, document) tuples provided by the streaming or mmap_scan
+        split generator, with the same checks and log entries as _split_into_documents().
+
+        Differs from _split_into_documents() for files with text before the first of the
+        default delimiters: the text is stored as a document of its own (invalid unless
+        it is well-formed xml), while the in-memory split takes it for a delimiter and
+        does not store the documents following it. For the same reason, a file containing
+        <document but none of the delimiters is reported as having no delimiter here,
+        while the in-memory split reports success without storing any document.
+        """
+        print(f"Splitting File ({self.split_mode.name}) with delim: {self.re_split}")
+
+        # check if the file contains any known delimiter before anything is stored -
+        # the documents up to the first delimiter found are held back for this
+        documents = iter(documents)
+        held_back = []
+        if self.custom_separator or self._contains_known_delimiter():
+            for delimiter, item in documents:
+                held_back.append((delimiter, item))
+                if delimiter:
+                    break
+
+        if not any(delimiter for delimiter, _ in held_back):
+            # read the rest of the file nevertheless to complete the line count
+            for _ in documents:
+                pass
+            self.pm.log_error(
+                0,
+                "Error during splitting of document: None of the known delimiters <xml*> and/or <document*> found",
+            )
+            print("No delimiter found!!!")
+            self.pm.commit_writes()
+            out = False
+            return out
 
-                # the actual processing
-                if item:
-                    if self.comp_re_split.fullmatch(item):
-                        # this is the delimiter
-                        patts.add(item)
-                    else:
-                        # this is the actual content we want
-                        validation_result = self._validate_document(item)
-                        doc_idx += 1
-                        if validation_result.valid:
-                            # store the valid item
-                            # self.xml_source.append(item.strip())
-                            self.pm.store_doc(doc_idx, DocValidity.VALID, item.strip())
-                        else:
-                            out = False
-                            # store the invalid item
-                            # self.xml_source_invalid.append(
-                            #     {
-                            #         "Document": item.strip(),
-                            #         "Validation Result": validation_result.output,
-                            #     }
-                            # )
-                            self.pm.store_doc(
-                                doc_idx,
-                                DocValidity.INVALID,
-                                item.strip(),
-                                validation_result.output,
-                            )
-
-            self.doc_delimiters = list(patts)
+        out = self._store_documents(chain(held_back, documents))
 
         # once all data is processed and stored, create the indices
         self.pm.commit_writes()
@@ -678,9 +820,321 @@ class FileProcessor:
                 0, "File successfully split into single documents without any errors."
             )
         self.pm.commit_writes()
-        # print(f"out={out}")
         return out
 
+    def _store_documents(self, documents):
+        """Validates the (delimiter, document) tuples provided by one of the split
+        generators and stores them in the DocList. Returns False if any invalid
+        document has been found.
+        """
+        out = True
+
+        patts = set()
+        doc_idx = 0
+
+        for delimiter, item, validation_result, parse_result in self._validate_documents(
+            documents
+        ):
+
+            if delimiter:
+                patts.add(delimiter)
+
+            doc_idx += 1
+
+            # the actual processing
+            if validation_result.valid:
+                # store the valid item
+                self.pm.store_doc(doc_idx, DocValidity.VALID, item.strip())
+
+                # store the parsed item (fused ingest only)
+                if parse_result and not self._store_parse_result(doc_idx, parse_result):
+                    self.ingest_result = "error"
+            else:
+                out = False
+                # store the invalid item
+                self.pm.store_doc(
+                    doc_idx,
+                    DocValidity.INVALID,
+                    item.strip(),
+                    validation_result.output,
+                )
+
+        self.doc_delimiters = list(patts)
+        return out
+
+    def _validate_documents(self, documents):
+        """Yields (delimiter, document, validation_result, parse_result) in the order of
+        the documents provided. The parse_result is None unless fused ingest is enabled.
+        With more than one validation worker, batches of documents are validated in a
+        process pool. Only a limited number of batches is sent to the pool ahead of the
+        one being stored, so memory usage stays bounded.
+        """
+
+        if self.validation_workers <= 1:
+            validator = XmlValidator()
+            flattening_plans = FlatteningPlans()
+            for delimiter, item in documents:
+                if self.ingest_options:
+                    yield (delimiter, item) + validate_and_parse_document(
+                        validator, item, self.ingest_options, flattening_plans
+                    )
+                else:
+                    yield delimiter, item, self._validate_document(item), None
+            return
+
+        max_pending = 2 * self.validation_workers
+        pending = deque()
+
+        with ProcessPoolExecutor(max_workers=self.validation_workers) as executor:
+            while True:
+                batch = list(islice(documents, self.validation_batch_size))
+                if batch:
+                    future = executor.submit(
+                        validate_document_batch,
+                        [item for _, item in batch],
+                        self.ingest_options,
+                    )
+                    pending.append((batch, future))
+
+                # collect the oldest batch once enough batches are in progress
+                # or all documents have been submitted
+                while pending and (len(pending) >= max_pending or not batch):
+                    done_batch, future = pending.popleft()
+                    for (delimiter, item), (validation_result, parse_result) in zip(
+                        done_batch, future.result()
+                    ):
+                        yield delimiter, item, validation_result, parse_result
+
+                if not batch:
+                    break
+
+    def _contains_known_delimiter(self):
+        # the same check as in _split_into_documents(), reading the file in chunks
+        # until <xml or <document is found
+        comp_re_known = re.compile(r"<xml|<document", re.IGNORECASE)
+        tail = ""
+        with open(self.file_path) as file_handle:
+            while True:
+                chunk = file_handle.read(self.chunk_size)
+                if not chunk:
+                    return False
+                text = tail + chunk
+                if comp_re_known.search(text):
+                    return True
+                tail = text[-len("<document") :]
+
+    def _iter_documents_in_memory(self, list_raw, idx_start, num_groups):
+        """Yields (delimiter, document) tuples from the result of the regex split
+        of the full file content.
+        """
+
+        delimiter = None
+
+        docs_to_process = len(list_raw)
+        for idx, item in enumerate(list_raw[idx_start:], start=1):
+
+            progress_pct = round((idx * 100) / docs_to_process, 2)
+            if (progress_pct).is_integer():
+                print(f"Processing split file is at {progress_pct:3.0f}%...", end="\r")
+
+            if item:
+                if self.custom_separator:
+                    is_delimiter = self.comp_re_split.fullmatch(item)
+                else:
+                    is_delimiter = idx % num_groups != 0
+
+                if is_delimiter:
+                    delimiter = item
+                else:
+                    # this is the actual content we want
+                    yield delimiter, item
+
+    def _iter_documents_streaming(self):
+        """Reads the source file in chunks of self.chunk_size characters and yields
+        (delimiter, document) tuples one at a time. Every chunk is searched together
+        with the text not yet confirmed from the previous chunk only, the text of the
+        current document is collected in a list of parts.
+        """
+
+        # for the negative lookbehind of the 3rd delimiter regex, the text already
+        # confirmed on the current line is replaced by a line context, see _get_line_context()
+        comp_re_prolog = re.compile(r"<\?xml ", re.IGNORECASE)
+        context = ""
+        carry = ""
+        doc_parts = []
+        prev_delimiter = None
+
+        with open(self.file_path) as file_handle:
+            while True:
+                chunk = file_handle.read(self.chunk_size)
+                eof = not chunk
+                self.line_count += chunk.count("\n")
+
+                text = context + carry + chunk
+                search_from = len(context)
+                content_start = search_from
+
+                # delimiters ending within boundary_overlap of the end of the text are only
+                # confirmed once the next chunk has been read, as they might be cut in half
+                # (e.g. '<?xml ...?><Docu' would match as a prolog without document tag).
+                # The default delimiters do not span lines, so the ones on complete lines are final.
+                if eof:
+                    limit = len(text)
+                else:
+                    limit = len(text) - self.boundary_overlap
+                    if not self.custom_separator:
+                        limit = max(limit, text.rfind("\n") + 1)
+                    limit = max(limit, search_from)
+
+                cut = limit
+                for match in self.comp_re_split.finditer(text, search_from):
+                    if match.end(match.lastindex) > limit:
+                        # rescan this delimiter with the next chunk
+                        cut = match.start()
+                        break
+
+                    doc_parts.append(text[content_start : match.start()])
+                    item = "".join(doc_parts)
+                    if item.strip():
+                        yield prev_delimiter, item
+                    doc_parts = []
+
+                    # the capturing group of the regex that matched
+                    prev_delimiter = match.group(match.lastindex)
+                    content_start = match.end()
+
+                if eof:
+                    break
+
+                doc_parts.append(text[content_start:cut])
+                carry = text[cut:]
+                context = self._get_line_context(text, cut, comp_re_prolog)
+
+        # the last document in the file
+        doc_parts.append(text[content_start:])
+        item = "".join(doc_parts)
+        if item.strip():
+            yield prev_delimiter, item
+
+    def _get_line_context(self, text, cut, comp_re_prolog):
+        # the negative lookbehind (?<!<\?xml .*?>) only depends on whether there is a
+        # xml prolog on the same line and on the character in front of the position, so
+        # '<?xml ' (if the line contains a prolog starting before cut) plus the last
+        # character before cut give the same lookbehind results as the full line
+        if self.custom_separator:
+            return ""
+
+        line_start = text.rfind("\n", 0, cut) + 1
+        context = ""
+        if comp_re_prolog.search(text, line_start, cut + len("<?xml ") - 1):
+            context = "<?xml "
+        if cut > line_start:
+            context += text[cut - 1]
+        return context
+
+    def _iter_documents_mmap(self):
+        """Memory maps the source file and yields (delimiter, document) tuples. The
+        document boundaries are found on the raw bytes, only the single documents
+        are decoded with the encoding the file has been opened with.
+        """
+
+        # an empty file cannot be memory mapped
+        if os.path.getsize(self.file_path) == 0:
+            return
+
+        with open(self.file_path, "rb") as file_handle:
+            with mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+
+                for idx in range(0, len(mm), self.chunk_size):
+                    self.line_count += mm[idx : idx + self.chunk_size].count(b"\n")
+
+                prev_delimiter = None
+                prev_content_start = 0
+                for delimiter, start, end in self._scan_document_offsets(mm):
+                    item = self._decode(mm[prev_content_start:start])
+                    if item.strip():
+                        yield prev_delimiter, item
+                    prev_delimiter = self._decode(delimiter)
+                    prev_content_start = end
+
+                # the last document in the file
+                item = self._decode(mm[prev_content_start:])
+                if item.strip():
+                    yield prev_delimiter, item
+
+    def _scan_document_offsets(self, mm):
+        """Yields (delimiter, start, end) for every delimiter found in the memory mapped
+        file, where the document following the delimiter starts at offset end.
+        For the default delimiters the delimiter is part of the document, i.e. start == end.
+        """
+
+        if self.custom_separator:
+            comp_re_split = re.compile(
+                f"({self.custom_separator})".encode(self.file_encoding), re.IGNORECASE
+            )
+            for match in comp_re_split.finditer(mm):
+                yield match.group(1), match.start(), match.end()
+            return
+
+        # the byte level equivalent of the three regexes in self.re_split, evaluated at
+        # every <?xml and <document found, the same way the regex split does:
+        # 1st xml prolog + document tag, i.e. the prolog up to the first '><document '
+        #     on the same line, followed by the document tag
+        # 2nd xml prolog not followed by document tag, i.e. the prolog up to the first '>'
+        # 3rd document tag not preceeded by xml prolog, i.e. the document tag, unless it
+        #     directly follows a '>' and a xml prolog starts earlier on the same line
+        # As with the regexes, a delimiter has to end on the same line it starts.
+        comp_re_start = re.compile(rb"<\?xml |<document ", re.IGNORECASE)
+        comp_re_doc_tag = re.compile(rb"><document ", re.IGNORECASE)
+        comp_re_line_break = re.compile(rb"[\r\n]")
+
+        # the end of the current line, if a xml prolog has been found on it so far and the
+        # next '><document ' - kept from one match to the next, so every byte is only
+        # searched once, also on files with all the documents on a single line
+        line_end = -1
+        line_prolog = False
+        doc_tag_at = -1
+
+        for match in comp_re_start.finditer(mm):
+            start = match.start()
+
+            if start > line_end:
+                line_break = comp_re_line_break.search(mm, start)
+                line_end = line_break.start() if line_break else len(mm)
+                line_prolog = False
+
+            if match.group()[1:2] == b"?":
+                # xml prolog with (1st regex) or without (2nd regex) document tag
+                line_prolog = True
+                if doc_tag_at < start + len("<?xml "):
+                    doc_tag = comp_re_doc_tag.search(mm, start + len("<?xml "))
+                    doc_tag_at = doc_tag.start() if doc_tag else len(mm)
+
+                if doc_tag_at < line_end:
+                    tag_end = mm.find(b">", doc_tag_at + len("><document "), line_end)
+                    if tag_end != -1:
+                        yield mm[start : tag_end + 1], start, start
+                        continue
+
+                tag_end = mm.find(b">", start + len("<?xml "), line_end)
+
+            else:
+                # document tag (3rd regex)
+                if line_prolog and mm[start - 1 : start] == b">":
+                    continue
+                tag_end = mm.find(b">", start + len("<document "), line_end)
+
+            if tag_end != -1:
+                yield mm[start : tag_end + 1], start, start
+
+    def _decode(self, raw_bytes):
+        # decode as reading the file in text mode would, i.e. including the
+        # translation of \r\n and \r line endings to \n
+        text = raw_bytes.decode(self.file_encoding, errors="replace")
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        return text
+
     # @profile
     def _validate_document(self, xml_document):
 
@@ -692,10 +1146,269 @@ class FileProcessor:
 
         return validation_result
 
+    def _store_parse_result(self, doc_idx, parse_result):
+        """Logs the outcome of parsing a document and stores the tags and values of
+        a successfully parsed document. Returns False if the document could not be parsed.
+        """
+
+        if not parse_result.ok:
+            e = parse_result.result
+            if isinstance(e, IndexError):
+                self.pm.log_error(
+                    doc_idx,
+                    f"ERROR: parsinng document #{doc_idx} failed due to the following error: {e}",
+                )
+            else:
+                self.pm.log_error(
+                    doc_idx,
+                    f"ERROR: skipping document #{doc_idx} due to the following error: {e}",
+                )
+            return False
+
+        self.pm.log_success(doc_idx, f"INFO: document #{doc_idx} successfully loaded")
+
+        # read the tags and values from the parsed xml document
+        # the error handling is actually not needed as the option
+        # concat_on_key_error=True will not raise any KeyErrors
+        xml_parsed, tags_n_values = parse_result.result
+        xml_parsed.doc_id = doc_idx
+        if tags_n_values.ok:
+            self.pm.store_xml_parsed_columns(doc_idx, tags_n_values.result, xml_parsed)
+        else:
+            e = tags_n_values.result
+            self.pm.log_error(
+                doc_idx,
+                f"ERROR: skipping document #{doc_idx} due to the following error: {e}",
+            )
+        return True
+
 
 # -------------------------------------------------------------------------------
 # General Service Functions
 # ------------------------------------------------------------------------------
+def parse_document(
+    xml_document,
+    doc_idx,
+    ingest_options,
+    event_collector=None,
+    backend=ParserBackend.soup,
+    flattening_plans=None,
+):
+    """Parses the xml document with the given backend and reads its tags and values.
+    Returns a Result with the (XmlParser, TagsAndValuesColumns Result) tuple or the
+    ValueError / IndexError raised while parsing. If an event_collector is given, the
+    document is not parsed again but built from the collected sax events. The
+    flattening_plans are used for documents parsed with sax or expat.
+    """
+
+    (
+        attribute_usage,
+        concat_on_key_error,
+        top_node_tree_level,
+        type_distance_to_top,
+    ) = ingest_options
+
+    try:
+        xml_parsed = XmlParser(
+            xml_document,
+            top_node_tree_level,
+            type_distance_to_top,
+            doc_idx,
+            event_collector,
+            backend,
+        )
+    except (ValueError, IndexError) as e:
+        return Result(ok=False, result=e)
+
+    tags_n_values = xml_parsed.get_tags_and_values(
+        attribute_usage, concat_on_key_error, flattening_plans, columnar=True
+    )
+
+    # the collected events are no longer needed once the document is flattened
+    # (and they cannot be sent back from a process pool)
+    xml_parsed.collector = None
+
+    return Result(ok=True, result=(xml_parsed, tags_n_values))
+
+
+def validate_and_parse_document(
+    validator, xml_document, ingest_options, flattening_plans=None
+):
+    """Validates the xml document and, if valid, parses it from the events of the
+    same sax parse. Returns the (ValidationResult, parse Result) tuple.
+    """
+
+    # the document is stored stripped, so it is parsed stripped as well
+    doc_stripped = xml_document.strip()
+    collector = XmlEventCollector(doc_stripped)
+
+    validation_result = validator.validate_doc(xml_document, collector)
+    if not validation_result.valid:
+        return validation_result, None
+
+    return validation_result, parse_document(
+        doc_stripped,
+        0,
+        ingest_options,
+        collector,
+        flattening_plans=flattening_plans,
+    )
+
+
+def write_excel_sheets(workbook, doc_type, header, rows, max_rows=EXCEL_MAX_ROWS):
+    """Writes the header and the rows of the document type to a worksheet of the
+    workbook. A sheet holds up to max_rows rows including the header, further rows
+    spill over into continuation sheets named <type>_2, <type>_3, ... Returns the
+    number of sheets written.
+    """
+
+    header = list(header)
+    rows = iter(rows)
+    next_row = next(rows, None)
+    sheet_no = 0
+
+    while True:
+        sheet_no += 1
+
+        # Sheet names in excel can have up to 31 chars
+        if sheet_no == 1:
+            sheet_name = doc_type[0:31]
+        else:
+            suffix = f"_{sheet_no}"
+            sheet_name = f"{doc_type[0:31 - len(suffix)]}{suffix}"
+        try:
+            worksheet = workbook.add_worksheet(name=sheet_name)
+        except xlsxwriter.exceptions.DuplicateWorksheetName:
+            # types that only differ after the 31st char get a default sheet name
+            worksheet = workbook.add_worksheet()
+
+        worksheet.write_row(0, 0, header)
+        row_number = 0
+        while next_row is not None and row_number < max_rows - 1:
+            row_number += 1
+            worksheet.write_row(row_number, 0, tuple(next_row))
+            next_row = next(rows, None)
+
+        if next_row is None:
+            return sheet_no
+
+
+def write_type_workbook(db_name, doc_type, create_record_on, file_out):
+    """Writes the records of the document type straight from the database to a
+    workbook of its own (opened in constant memory mode). Defined on module level so
+    it can be run in a process pool. Returns the file name of the workbook.
+    """
+
+    # the connection keeps the journal mode of the database, i.e. it can read while
+    # the background writer of the file processor is running
+    pm = PersistenceManager(db_name=db_name)
+
+    workbook = xlsxwriter.Workbook(file_out, {"constant_memory": True})
+    header = (row["Tag"] for row in pm.get_xml_tags_by_type(doc_type))
+    write_excel_sheets(
+        workbook,
+        doc_type,
+        header,
+        pm.get_output_records_by_xml_type(doc_type, create_record_on),
+    )
+    workbook.close()
+
+    return file_out
+
+
+def iter_chunks(records, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields the records in lists of up to chunk_size records."""
+
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def open_export_file(file_out, compress=False):
+    """Opens the export file for writing text, gzipped with compress."""
+
+    if compress:
+        return gzip.open(
+            file_out,
+            "wt",
+            compresslevel=EXPORT_GZIP_LEVEL,
+            encoding="utf-8",
+            newline="",
+        )
+    return open(file_out, "w", encoding="utf-8", newline="")
+
+
+def write_csv(file_out, header, records, compress=False):
+    """Writes the header and the records to a csv file, chunk by chunk."""
+
+    with open_export_file(file_out, compress) as file_handle:
+        writer = csv.writer(file_handle)
+        writer.writerow(header)
+        for chunk in iter_chunks(records):
+            writer.writerows(chunk)
+
+
+def write_jsonl(file_out, header, records, compress=False):
+    """Writes the records as json objects with the header as keys, one per line,
+    chunk by chunk.
+    """
+
+    with open_export_file(file_out, compress) as file_handle:
+        for chunk in iter_chunks(records):
+            file_handle.write(
+                "".join(
+                    json.dumps(dict(zip(header, record)), ensure_ascii=False) + "\n"
+                    for record in chunk
+                )
+            )
+
+
+def write_parquet(file_out, header, records, compress=False):
+    """Writes the records to a parquet file with one text column per header, one
+    row group per chunk. Requires pyarrow, which is only imported when used.
+    """
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(tag, pa.string()) for tag in header])
+    with pq.ParquetWriter(
+        file_out, schema, compression="gzip" if compress else "none"
+    ) as writer:
+        for chunk in iter_chunks(records):
+            columns = list(zip(*chunk))
+            writer.write_batch(
+                pa.record_batch(
+                    [pa.array(column, type=pa.string()) for column in columns],
+                    schema=schema,
+                )
+            )
+
+
+def validate_document_batch(xml_documents, ingest_options=None):
+    """Validates a batch of xml documents and returns the list of (ValidationResult,
+    parse Result) tuples in the same order. The parse Result is None unless
+    ingest_options are given. Defined on module level so it can be run in a process pool.
+    """
+
+    # one validator object and set of flattening plans is sufficient for the whole batch
+    validator = XmlValidator()
+
+    if ingest_options:
+        flattening_plans = FlatteningPlans()
+        return [
+            validate_and_parse_document(
+                validator, xml_document, ingest_options, flattening_plans
+            )
+            for xml_document in xml_documents
+        ]
+
+    return [
+        (validator.validate_doc(xml_document), None) for xml_document in xml_documents
+    ]
 
 
 # -------------------------------------------------------------------------------
@@ -7,8 +7,15 @@ implementation, the elements in the tree need to be unique.
 # ------------------
 # Imports
 # ------------------
+import hashlib
+import json
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
 from dataclasses import dataclass
 
+import numpy as np
+
 from sqlalchemy import true
 
 # Public symbols.
@@ -24,6 +31,21 @@ __maintainer__ = "Daniel Grass"
 __email__ = "dani.grass@bluewin.ch"
 __status__ = "Development"
 
+# the binary representation of a forward star (see ForwardStar.to_bytes): a header
+# with the format tag, the number of nodes and links, the selected node, the integer
+# type code, the caption encoding and the first caption, followed by the first_link,
+# to_node and parent arrays as native integers and the node captions
+BLOB_HEADER = struct.Struct("=4s6i")
+BLOB_FORMAT = b"FST1"
+
+# forward stars of up to 32767 nodes are stored with 2 byte integers
+SHORT_MAX_NODES = 2**15 - 1
+
+# the node captions are consecutive integers, only the first caption is stored
+CAPTIONS_RANGE = 0
+# the node captions are stored as json list
+CAPTIONS_JSON = 1
+
 
 @dataclass
 class ForwardStarData:
@@ -54,6 +76,14 @@ class ForwardStar:
         "num_links",
         "num_nodes",
         "selected_node",
+        "caption_index",
+        "parent",
+        "pre_order",
+        "enter",
+        "exit",
+        "depth",
+        "depth_order",
+        "depth_start",
     )
 
     # ------------------
@@ -61,31 +91,237 @@ class ForwardStar:
     # ------------------
     def __init__(self, root_caption: str):
         self.node_caption = []
-        self.first_link = []
-        self.to_node = []
+        self.first_link = array("i")
+        self.to_node = array("i")
         self.num_links = 0
         self.num_nodes = 1
         self.selected_node = -1
 
+        # lookup structures: the node index by caption (None if the caption is not
+        # unique) and the parent node index by node (-1 for the root)
+        self.caption_index = {}
+        self.parent = array("i")
+
+        # interval labels: the nodes in pre-order, the enter and exit positions and
+        # depth by node and the nodes by depth, built on first use (see
+        # _build_interval_labels)
+        self._reset_interval_labels()
+
         # root
         self.first_link.append(0)
         self.node_caption.append(root_caption)
+        self.caption_index[root_caption] = 0
+        self.parent.append(-1)
 
         # sentinel
         self.first_link.append(0)
 
+    @classmethod
+    def from_parent_array(cls, parents: list, node_captions: list = None):
+        """Builds the forward star from a parent array in O(n), where parents[i] is the
+        index of the parent node of node i and the root (node 0) has the parent -1. The
+        result is the same as adding the nodes in order of their index with add_child().
+        """
+        num_nodes = len(parents)
+        if node_captions is None:
+            node_captions = list(range(num_nodes))
+
+        fstar = cls(node_captions[0])
+        if num_nodes == 1:
+            return fstar
+
+        # counting pass: the number of links of every node is stored in the
+        # first_link entry of the following node
+        first_link = array("i", [0]) * (num_nodes + 1)
+        for node in range(1, num_nodes):
+            parent = parents[node]
+            if not 0 <= parent < node:
+                raise IndexError(
+                    f"parent node {parent} of node {node} is not a node added before"
+                )
+            first_link[parent + 1] += 1
+
+        # prefix sum: the links of a node start after the links of all previous nodes
+        for node in range(num_nodes):
+            first_link[node + 1] += first_link[node]
+
+        # place the links, the children of a node in order of their index
+        to_node = array("i", [0]) * (num_nodes - 1)
+        next_link = first_link[:num_nodes]
+        for node in range(1, num_nodes):
+            parent = parents[node]
+            to_node[next_link[parent]] = node
+            next_link[parent] += 1
+
+        fstar.node_caption = list(node_captions)
+        fstar.first_link = first_link
+        fstar.to_node = to_node
+        fstar.num_links = num_nodes - 1
+        fstar.num_nodes = num_nodes
+        fstar.selected_node = parents[-1]
+        fstar.parent = array("i", parents)
+        fstar._build_caption_index()
+
+        return fstar
+
+    @classmethod
+    def from_bytes(cls, blob):
+        """Loads a forward star serialized with to_bytes(). The first_link, to_node and
+        parent arrays are memoryviews on the blob, so nothing is copied or decoded
+        (apart from captions stored as json). The arrays are only copied when the
+        forward star is changed with add_child().
+        """
+        view = memoryview(blob)
+        (
+            blob_format,
+            num_nodes,
+            num_links,
+            selected_node,
+            typecode,
+            caption_encoding,
+            first_caption,
+        ) = BLOB_HEADER.unpack_from(view)
+        if blob_format != BLOB_FORMAT:
+            raise ValueError(f"unknown forward star format {blob_format}")
+        typecode = chr(typecode)
+
+        # the arrays are stored one after the other: first_link, to_node, parent
+        start = BLOB_HEADER.size
+        end = start + (2 * num_nodes + 1 + num_links) * array(typecode).itemsize
+        ints = view[start:end].cast(typecode)
+
+        fstar = cls.__new__(cls)
+        fstar.first_link = ints[: num_nodes + 1]
+        fstar.to_node = ints[num_nodes + 1 : num_nodes + 1 + num_links]
+        fstar.parent = ints[num_nodes + 1 + num_links :]
+        fstar.num_links = num_links
+        fstar.num_nodes = num_nodes
+        fstar.selected_node = selected_node
+
+        if caption_encoding == CAPTIONS_RANGE:
+            fstar.node_caption = range(first_caption, first_caption + num_nodes)
+        else:
+            fstar.node_caption = json.loads(view[end:].tobytes())
+
+        # built on the first lookup by caption (if needed at all)
+        fstar.caption_index = None
+        fstar._reset_interval_labels()
+
+        return fstar
+
     # ------------------
     # Internal Functions
     # ------------------
     def _select_node_by_caption(self, node_caption: str) -> int:
-        sel_node = [i for i, j in enumerate(self.node_caption) if j == node_caption]
-
-        if len(sel_node) > 1:
+        if self.caption_index is None:
+            if isinstance(self.node_caption, range):
+                # consecutive captions are unique and map to the node index directly
+                if node_caption not in self.node_caption:
+                    raise IndexError(f"node caption '{node_caption}' not found")
+                return self.node_caption.index(node_caption)
+            self._build_caption_index()
+
+        if node_caption not in self.caption_index:
+            raise IndexError(f"node caption '{node_caption}' not found")
+
+        sel_node = self.caption_index[node_caption]
+        if sel_node is None:
             raise KeyError(
                 f"parent node caption '{node_caption}' is not unique, unique node caption required"
             )
         else:
-            return sel_node[0]
+            return sel_node
+
+    def _add_to_caption_index(self, caption: str, node: int):
+        if caption in self.caption_index:
+            # mark the caption as not unique
+            self.caption_index[caption] = None
+        else:
+            self.caption_index[caption] = node
+
+    def _build_caption_index(self):
+        self.caption_index = {}
+        for node, caption in enumerate(self.node_caption):
+            self._add_to_caption_index(caption, node)
+
+    def _build_parent_array(self):
+        self.parent = array("i", [-1]) * self.num_nodes
+        for node in range(self.num_nodes):
+            for link in range(self.first_link[node], self.first_link[node + 1]):
+                self.parent[self.to_node[link]] = node
+
+    def _reset_interval_labels(self):
+        self.pre_order = None
+        self.enter = None
+        self.exit = None
+        self.depth = None
+        self.depth_order = None
+        self.depth_start = None
+
+    def _build_interval_labels(self):
+        # the descendants of a node are the nodes after it in the pre-order up to its
+        # exit position, i.e. pre_order[enter[node] + 1 : exit[node]]
+        pre_order = array("i")
+        enter = array("i", [0]) * self.num_nodes
+        exit_pos = array("i", [0]) * self.num_nodes
+        depth = array("i", [0]) * self.num_nodes
+
+        # explicit stack, the children pushed in reverse order to be visited in order
+        nodes_to_visit = [0]
+        while nodes_to_visit:
+            node = nodes_to_visit.pop()
+            enter[node] = len(pre_order)
+            exit_pos[node] = len(pre_order) + 1
+            pre_order.append(node)
+            for link in reversed(
+                range(self.first_link[node], self.first_link[node + 1])
+            ):
+                child = self.to_node[link]
+                depth[child] = depth[node] + 1
+                nodes_to_visit.append(child)
+
+        # the subtree of a node ends where the subtree of its last descendant ends,
+        # the descendants come after the node in the pre-order
+        for node in reversed(pre_order[1:]):
+            parent = self.parent[node]
+            if exit_pos[node] > exit_pos[parent]:
+                exit_pos[parent] = exit_pos[node]
+
+        # the nodes sorted by depth (counting sort, in pre-order within a depth), the
+        # nodes at depth d are depth_order[depth_start[d] : depth_start[d + 1]]
+        depth_start = array("i", [0]) * (max(depth) + 2)
+        for node_depth in depth:
+            depth_start[node_depth + 1] += 1
+        for node_depth in range(len(depth_start) - 1):
+            depth_start[node_depth + 1] += depth_start[node_depth]
+        depth_order = array("i", [0]) * self.num_nodes
+        next_pos = depth_start[:-1]
+        for node in pre_order:
+            depth_order[next_pos[depth[node]]] = node
+            next_pos[depth[node]] += 1
+
+        self.pre_order = pre_order
+        self.enter = enter
+        self.exit = exit_pos
+        self.depth = depth
+        self.depth_order = depth_order
+        self.depth_start = depth_start
+
+    def get_shape_hash(self) -> str:
+        """Returns a hash of the shape of the tree, i.e. of its binary representation.
+        Trees with the same links and the same (or the same consecutive) captions have
+        the same shape hash.
+        """
+        return get_blob_hash(self.to_bytes())
+
+    def _has_consecutive_captions(self) -> bool:
+        captions = self.node_caption
+        if isinstance(captions, range):
+            return captions.step == 1
+        first_caption = captions[0]
+        return type(first_caption) is int and captions == list(
+            range(first_caption, first_caption + self.num_nodes)
+        )
 
     def _add_link(self, from_node: int, to_node: int):
         # Create room for the new link
@@ -111,11 +347,26 @@ class ForwardStar:
         for i in range(var_from, var_to):
             self.first_link[i] = self.first_link[i] + 1
 
+    def _make_writable(self):
+        # a forward star loaded with from_bytes() holds memoryviews on the blob and
+        # may have range captions, both are copied before the first change
+        if not isinstance(self.first_link, array):
+            self.first_link = array("i", self.first_link)
+            self.to_node = array("i", self.to_node)
+            self.parent = array("i", self.parent)
+        if not isinstance(self.node_caption, list):
+            self.node_caption = list(self.node_caption)
+        if self.caption_index is None:
+            self._build_caption_index()
+
     def _new_node(self, caption: str) -> int:
         # new entry
         self.first_link.append(self.first_link[self.num_nodes])
 
         self.node_caption.append(caption)
+        self._add_to_caption_index(caption, self.num_nodes)
+        self.parent.append(-1)
+        self._reset_interval_labels()
         out = self.num_nodes
         self.num_nodes += 1
         return out
@@ -125,12 +376,14 @@ class ForwardStar:
     # ------------------
     def add_child(self, parent_node_caption: str, child_caption: str):
 
+        self._make_writable()
         # select the parent node
         self.selected_node = self._select_node_by_caption(parent_node_caption)
         # create the new node
         node = self._new_node(child_caption)
         # add the link from the parent to the new node
         self._add_link(self.selected_node, node)
+        self.parent[node] = self.selected_node
 
     def find_parent_by_caption(self, node_caption: str):
 
@@ -140,29 +393,60 @@ class ForwardStar:
 
     def find_parent(self, node: int):
 
-        # initialize parent and link as "we did not find a parent"
-        parent = -1
-        link = -1
-        out = (parent, link)
-
-        # Find the link into this node
-        for parent in range(
-            0, self.num_nodes
-        ):  # the - 1 is non needed as range works <from> inclusive to <to> exclusive
-            for link in range(
-                self.first_link[parent], self.first_link[parent + 1]
-            ):  # the - 1 is non needed as range works <from> inclusive to <to> exclusive
-                if self.to_node[link] == node:
-                    out = (parent, link)
-                    break
+        # the root has no parent (and no link into it)
+        parent = self.parent[node]
+        if parent == -1:
+            return (-1, -1)
 
-        return out
+        # find the link into this node among the links of the parent - the children
+        # of a node are always linked in the order of their node index
+        link = bisect_left(
+            self.to_node, node, self.first_link[parent], self.first_link[parent + 1]
+        )
+        return (parent, link)
 
     def find_node_by_caption(self, node_caption: str):
         # get the node index
         node = self._select_node_by_caption(node_caption)
         return node
 
+    def is_ancestor(self, ancestor: int, node: int) -> bool:
+        """Returns True if the node ancestor is a (proper) ancestor of the node."""
+        if self.enter is None:
+            self._build_interval_labels()
+        return self.enter[ancestor] < self.enter[node] < self.exit[ancestor]
+
+    def subtree_range(self, node: int) -> tuple:
+        """Returns the (start, end) positions of the subtree of the node in the
+        pre-order of the tree, i.e. get_pre_order()[start:end] are the node and its
+        descendants.
+        """
+        if self.enter is None:
+            self._build_interval_labels()
+        return (self.enter[node], self.exit[node])
+
+    def nodes_at_depth(self, depth: int) -> list:
+        """Returns the nodes at the given depth (the root has depth 0) in pre-order,
+        a slice of the nodes sorted by depth.
+        """
+        if self.enter is None:
+            self._build_interval_labels()
+        if not 0 <= depth < len(self.depth_start) - 1:
+            return []
+        return list(
+            self.depth_order[self.depth_start[depth] : self.depth_start[depth + 1]]
+        )
+
+    def get_depth(self, node: int) -> int:
+        if self.enter is None:
+            self._build_interval_labels()
+        return self.depth[node]
+
+    def get_pre_order(self) -> array:
+        if self.enter is None:
+            self._build_interval_labels()
+        return self.pre_order
+
     def get_tree(self) -> dict:
         tree_data = {}
         frist_link_caption = []
@@ -197,13 +481,54 @@ class ForwardStar:
         return fstar_data
 
     def load_from_fstar_data(self, fstar_data: ForwardStarData):
-        self.node_caption = fstar_data.node_caption
-        self.first_link = fstar_data.first_link
-        self.to_node = fstar_data.to_node
+        self.node_caption = list(fstar_data.node_caption)
+        self.first_link = array("i", fstar_data.first_link)
+        self.to_node = array("i", fstar_data.to_node)
         self.num_links = fstar_data.num_links
         self.num_nodes = fstar_data.num_nodes
         self.selected_node = fstar_data.selected_node
 
+        # rebuild the lookup structures
+        self._build_caption_index()
+        self._build_parent_array()
+        self._reset_interval_labels()
+
+    def to_bytes(self) -> bytes:
+        """Serializes the forward star into a compact binary blob which can be loaded
+        with from_bytes(). Consecutive integer captions (like the tag ids used by the
+        XmlParser) are stored as the first caption only.
+        """
+        typecode = "h" if self.num_nodes <= SHORT_MAX_NODES else "i"
+
+        if self._has_consecutive_captions():
+            caption_encoding = CAPTIONS_RANGE
+            first_caption = self.node_caption[0]
+            captions = b""
+        else:
+            caption_encoding = CAPTIONS_JSON
+            first_caption = 0
+            captions = json.dumps(obj=list(self.node_caption)).encode("utf-8")
+
+        header = BLOB_HEADER.pack(
+            BLOB_FORMAT,
+            self.num_nodes,
+            self.num_links,
+            self.selected_node,
+            ord(typecode),
+            caption_encoding,
+            first_caption,
+        )
+
+        return b"".join(
+            (
+                header,
+                array(typecode, self.first_link).tobytes(),
+                array(typecode, self.to_node).tobytes(),
+                array(typecode, self.parent).tobytes(),
+                captions,
+            )
+        )
+
     def debug_tree(self):
         print("Index", "Label", "FirstLink", sep="\t")
         idx_bound = len(self.first_link) - 1
@@ -224,33 +549,32 @@ class ForwardStar:
 
     def display_node(self, node: int, parent: int, display_node_only=True):
 
-        if node != parent:
-            # display the node and parent
-            print(f"{self.node_caption[parent]} -> {self.node_caption[node]}")
-        else:
-            if display_node_only:
-                # display the node
-                print(self.node_caption[node])
+        # explicit stack of (node, parent) instead of recursion
+        nodes_to_visit = [(node, parent)]
+        while nodes_to_visit:
+            node, parent = nodes_to_visit.pop()
 
-        # display the children
-        for link in range(
-            self.first_link[node], self.first_link[node + 1]
-        ):  # -1 in <to> argument not needed as range works <from> inclusive to <to> exclusive
-            self.display_node(self.to_node[link], node, display_node_only)
+            if node != parent:
+                # display the node and parent
+                print(f"{self.node_caption[parent]} -> {self.node_caption[node]}")
+            else:
+                if display_node_only:
+                    # display the node
+                    print(self.node_caption[node])
+
+            # display the children - pushed in reverse order to be displayed in order
+            for link in reversed(
+                range(self.first_link[node], self.first_link[node + 1])
+            ):  # -1 in <to> argument not needed as range works <from> inclusive to <to> exclusive
+                nodes_to_visit.append((self.to_node[link], node))
 
     def display_node_descendants(self, node_caption: str):
         node = self._select_node_by_caption(node_caption)
         self.display_node(node, node, False)
 
     def display_node_ancestors(self, node_caption: str):
-        parent, link = self.find_parent_by_caption(node_caption=node_caption)
-        if parent == -1:
-            # print(f"{node_caption} is the root")
-            pass
-        else:
-            # print(f"{self.node_caption[parent]} is the parent of {node_caption}")
-            print(f"{self.node_caption[parent]} <- {node_caption}")
-            self.display_node_ancestors(self.node_caption[parent])
+        for parent_caption, node_caption in self.visit_node_ancestors(node_caption):
+            print(f"{parent_caption} <- {node_caption}")
 
     def visit_tree(self):
         yield from self.visit_node(0, 0)
@@ -261,25 +585,242 @@ class ForwardStar:
 
     def visit_node(self, node: int, parent: int):
 
-        if node != parent:
-            # return the node and parent
-            yield (self.node_caption[parent], self.node_caption[node])
+        # explicit stack of (node, parent) instead of recursive generators
+        nodes_to_visit = [(node, parent)]
+        while nodes_to_visit:
+            node, parent = nodes_to_visit.pop()
+
+            if node != parent:
+                # return the node and parent
+                yield (self.node_caption[parent], self.node_caption[node])
 
-        # return the children
-        for link in range(
-            self.first_link[node], self.first_link[node + 1]
-        ):  # -1 in <to> argument not needed as range works <from> inclusive to <to> exclusive
-            yield from self.visit_node(self.to_node[link], node)
+            # return the children - pushed in reverse order to be returned in order
+            for link in reversed(
+                range(self.first_link[node], self.first_link[node + 1])
+            ):  # -1 in <to> argument not needed as range works <from> inclusive to <to> exclusive
+                nodes_to_visit.append((self.to_node[link], node))
 
     def visit_node_ancestors(self, node_caption: str):
         parent, link = self.find_parent_by_caption(node_caption=node_caption)
-        if parent == -1:
-            # print(f"{node_caption} is the root")
-            pass
-        else:
+        while parent != -1:
             # print(f"{self.node_caption[parent]} is the parent of {node_caption}")
             yield (self.node_caption[parent], node_caption)
-            yield from self.visit_node_ancestors(self.node_caption[parent])
+            node_caption = self.node_caption[parent]
+            parent, link = self.find_parent(parent)
+
+
+class ForwardStarForest:
+    """Holds the forward stars of many documents (e.g. all documents of a xml type) in
+    one set of shared arrays. The nodes of the k-th document are the global nodes
+    node_offsets[k] to node_offsets[k + 1] - 1, its links a contiguous range of
+    to_node and its pre-order the same range of the global pre-order, so the subtree
+    of a node is a range of the global pre-order as well. With node labels (e.g. the
+    tags) structural questions are answered for all documents in one vectorised pass
+    (see count_by_label).
+    """
+
+    __slots__ = (
+        "doc_ids",
+        "doc_index",
+        "doc_fstars",
+        "node_offsets",
+        "node_caption",
+        "first_link",
+        "to_node",
+        "parent",
+        "pre_order",
+        "enter",
+        "exit",
+        "depth",
+        "labels",
+        "label_index",
+        "label_ids",
+        "num_nodes",
+    )
+
+    # ------------------
+    # Standard Functions
+    # ------------------
+    def __init__(self, doc_fstars: dict, node_labels: dict = None):
+        """Builds the forest from the forward stars by doc id (documents of the same
+        shape can share one) and optionally the labels of their nodes by doc id, in
+        node order.
+        """
+        self.doc_ids = list(doc_fstars)
+        self.doc_index = {doc_id: idx for idx, doc_id in enumerate(self.doc_ids)}
+        self.doc_fstars = [doc_fstars[doc_id] for doc_id in self.doc_ids]
+
+        # the arrays of every distinct forward star are converted once
+        shapes = {}
+        for fstar in self.doc_fstars:
+            if id(fstar) not in shapes:
+                fstar.get_pre_order()
+                shapes[id(fstar)] = {
+                    name: np.asarray(values, dtype=np.int64)
+                    for name, values in (
+                        ("first_link", fstar.first_link[:-1]),
+                        ("to_node", fstar.to_node),
+                        ("parent", fstar.parent),
+                        ("pre_order", fstar.pre_order),
+                        ("enter", fstar.enter),
+                        ("exit", fstar.exit),
+                        ("depth", fstar.depth),
+                    )
+                }
+        doc_shapes = [shapes[id(fstar)] for fstar in self.doc_fstars]
+
+        num_docs = len(self.doc_fstars)
+        num_nodes = np.fromiter(
+            (fstar.num_nodes for fstar in self.doc_fstars), np.int64, num_docs
+        )
+        num_links = np.fromiter(
+            (fstar.num_links for fstar in self.doc_fstars), np.int64, num_docs
+        )
+        node_offsets = np.zeros(num_docs + 1, np.int64)
+        np.cumsum(num_nodes, out=node_offsets[1:])
+        link_offsets = np.zeros(num_docs + 1, np.int64)
+        np.cumsum(num_links, out=link_offsets[1:])
+
+        # the local node and link indices of a document are shifted by its offsets
+        node_shift = np.repeat(node_offsets[:-1], num_nodes)
+
+        def concat(name):
+            if not doc_shapes:
+                return np.zeros(0, np.int64)
+            return np.concatenate([shape[name] for shape in doc_shapes])
+
+        first_link = np.append(
+            concat("first_link") + np.repeat(link_offsets[:-1], num_nodes),
+            link_offsets[-1],
+        )
+        to_node = concat("to_node") + np.repeat(node_offsets[:-1], num_links)
+        parent = concat("parent")
+        parent = np.where(parent == -1, -1, parent + node_shift)
+
+        self.num_nodes = int(node_offsets[-1])
+        self.node_offsets = to_int_array(node_offsets)
+        self.first_link = to_int_array(first_link)
+        self.to_node = to_int_array(to_node)
+        self.parent = to_int_array(parent)
+        self.pre_order = to_int_array(concat("pre_order") + node_shift)
+        self.enter = to_int_array(concat("enter") + node_shift)
+        self.exit = to_int_array(concat("exit") + node_shift)
+        self.depth = to_int_array(concat("depth"))
+
+        self.node_caption = []
+        for fstar in self.doc_fstars:
+            self.node_caption.extend(fstar.node_caption)
+
+        # the labels are stored once, the nodes refer to them by label id
+        self.labels = []
+        self.label_index = {}
+        self.label_ids = None
+        if node_labels is not None:
+            label_ids = array("i")
+            for doc_id, fstar in zip(self.doc_ids, self.doc_fstars):
+                labels = node_labels[doc_id]
+                if len(labels) != fstar.num_nodes:
+                    raise ValueError(
+                        f"{len(labels)} labels for the {fstar.num_nodes} nodes of "
+                        f"document {doc_id}"
+                    )
+                for label in labels:
+                    label_id = self.label_index.get(label)
+                    if label_id is None:
+                        label_id = len(self.labels)
+                        self.label_index[label] = label_id
+                        self.labels.append(label)
+                    label_ids.append(label_id)
+            self.label_ids = label_ids
+
+    # ------------------
+    # Public Functions
+    # ------------------
+    def get_doc_nodes(self, doc_id) -> range:
+        """Returns the global nodes of the document."""
+        doc = self.doc_index[doc_id]
+        return range(self.node_offsets[doc], self.node_offsets[doc + 1])
+
+    def get_doc_id(self, node: int):
+        """Returns the id of the document the global node belongs to."""
+        return self.doc_ids[bisect_right(self.node_offsets, node) - 1]
+
+    def find_node(self, doc_id, node_caption) -> int:
+        """Returns the global node of the node with the caption in the document."""
+        doc = self.doc_index[doc_id]
+        node = self.doc_fstars[doc].find_node_by_caption(node_caption)
+        return self.node_offsets[doc] + node
+
+    def get_parent(self, node: int) -> int:
+        """Returns the global parent node of the global node (-1 for a root)."""
+        return self.parent[node]
+
+    def subtree_range(self, node: int) -> tuple:
+        """Returns the (start, end) positions of the subtree of the global node in the
+        global pre-order, i.e. get_pre_order()[start:end] are the node and its
+        descendants.
+        """
+        return (self.enter[node], self.exit[node])
+
+    def get_pre_order(self) -> array:
+        return self.pre_order
+
+    def count_by_label(
+        self, ancestor_label, descendant_label, children_only: bool = True
+    ) -> list:
+        """Counts for every node with the ancestor label the nodes with the descendant
+        label below it in one pass over all documents, e.g. the number of DrctDbtTxInf
+        per PmtInf in every document. The direct children are counted, or all
+        descendants if children_only is False. Returns (doc_id, ancestor node caption,
+        count) tuples in node order.
+        """
+        if self.label_ids is None:
+            raise ValueError("the forest has no node labels")
+        ancestor_id = self.label_index.get(ancestor_label)
+        descendant_id = self.label_index.get(descendant_label, -1)
+        if ancestor_id is None:
+            return []
+
+        label_ids = np.frombuffer(self.label_ids, dtype=np.int32)
+        ancestors = np.flatnonzero(label_ids == ancestor_id)
+
+        if children_only:
+            # the parents of the nodes with the descendant label
+            parent = np.frombuffer(self.parent, dtype=np.int32)
+            parents = parent[label_ids == descendant_id]
+            counts = np.bincount(parents[parents >= 0], minlength=self.num_nodes)
+            counts = counts[ancestors]
+        else:
+            # the descendants are a range of the pre-order: the difference of the
+            # running count of the nodes with the descendant label at its ends
+            pre_order = np.frombuffer(self.pre_order, dtype=np.int32)
+            running_count = np.zeros(self.num_nodes + 1, np.int64)
+            np.cumsum(label_ids[pre_order] == descendant_id, out=running_count[1:])
+            enter = np.frombuffer(self.enter, dtype=np.int32)[ancestors]
+            exit_pos = np.frombuffer(self.exit, dtype=np.int32)[ancestors]
+            counts = running_count[exit_pos] - running_count[enter + 1]
+
+        docs = np.searchsorted(
+            np.frombuffer(self.node_offsets, dtype=np.int32), ancestors, side="right"
+        )
+        return [
+            (self.doc_ids[doc - 1], self.node_caption[node], count)
+            for doc, node, count in zip(
+                docs.tolist(), ancestors.tolist(), counts.tolist()
+            )
+        ]
+
+
+def get_blob_hash(blob: bytes) -> str:
+    """Returns the shape hash of a forward star serialized with to_bytes(), the hex
+    string of its 16 byte digest.
+    """
+    return hashlib.blake2b(blob, digest_size=16).hexdigest()
+
+
+def to_int_array(values) -> array:
+    """Returns the integer numpy array as array of native integers."""
+    return array("i", np.asarray(values, dtype=np.int32).tobytes())
 
 
 def breadth_first():
@@ -6,11 +6,16 @@
 # ------------------
 from ast import For
 import os
+import queue
 import sqlite3
-from copy import deepcopy
+import threading
+import time
+from dataclasses import dataclass
 from typing import Optional, List, Set
 import uuid
 import json
+from itertools import groupby, islice, repeat
+from operator import itemgetter
 from xmlrpc.client import Boolean
 
 from numpy import isin, record
@@ -20,8 +25,13 @@ USAGE = "flask"
 
 # import for usage in flask app
 if USAGE == "flask":
-    from webapp.xmlparser import XmlParser, AttributeUsage, TagType
-    from webapp.forwardstar import ForwardStar, ForwardStarData
+    from webapp.xmlparser import (
+        XmlParser,
+        AttributeUsage,
+        TagType,
+        TagsAndValuesColumns,
+    )
+    from webapp.forwardstar import ForwardStar, ForwardStarForest, get_blob_hash
     from webapp.profiler import profile
 
 # # import for standalone usage
@@ -72,15 +82,116 @@ class XmlAttribute:
     TopNode = "TopNode"
 
 
+# the default memory budget of the write cache in bytes
+DEFAULT_CACHE_BUDGET = 64 * 1024 * 1024
+
+# the approximate size of a cached record and of a field without the text/blob data
+RECORD_OVERHEAD = 64
+FIELD_OVERHEAD = 16
+
+# the number of FinalOutput records written with one executemany
+OUTPUT_BATCH_SIZE = 10_000
+
+
+@dataclass
+class CacheStats:
+    flushes: int = 0
+    auto_flushes: int = 0
+    rows_flushed: int = 0
+    bytes_flushed: int = 0
+    flush_seconds: float = 0.0
+    peak_bytes: int = 0
+
+
+class DatabaseWriter(threading.Thread):
+    """Writes the batches put on its bounded queue to the database on its own
+    connection. A batch is a list of (insert statement, records) pairs, written in
+    one transaction. put() blocks while the queue is full (backpressure), wait()
+    blocks until all batches are written and raises the first error of the writes.
+    """
+
+    def __init__(self, db_name: str, max_queue_size: int):
+        super().__init__(name="DatabaseWriter", daemon=True)
+        self.db_name = db_name
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.error = None
+        self.start()
+
+    def run(self):
+        conn = sqlite3.connect(self.db_name, isolation_level="DEFERRED")
+        conn.execute("PRAGMA synchronous = OFF")
+
+        while True:
+            batch = self.queue.get()
+            try:
+                if batch is None:
+                    break
+                with conn:
+                    for sql_ins, records in batch:
+                        conn.executemany(sql_ins, records)
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+            finally:
+                self.queue.task_done()
+
+        conn.close()
+
+    def put(self, batch: list):
+        self._raise_error()
+        self.queue.put(batch)
+
+    def wait(self):
+        self.queue.join()
+        self._raise_error()
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+
 class PersistenceManager:
 
     # ------------------
     # Standard Functions
     # ------------------
-    def __init__(self, db_name=None, data_directory=None):
+    def __init__(
+        self,
+        db_name=None,
+        data_directory=None,
+        cache_budget=DEFAULT_CACHE_BUDGET,
+        background_writer=False,
+        writer_queue_size=4,
+    ):
         self.conn = None
         # self.c = None
 
+        # with the background writer, the cache is written by a separate thread on
+        # its own connection while the data is read (WAL journal mode)
+        self.background_writer = background_writer
+        self.writer_queue_size = writer_queue_size
+        self.writer = None
+
+        # initialize the cache, it is written to the database as soon as the
+        # approximate size of the cached records exceeds the budget (None = no limit)
+        self.cache = self._init_cache()
+        self.cache_budget = cache_budget
+        self.cache_bytes = 0
+        self.cache_stats = CacheStats()
+
+        # the shape ids of the fstars stored by shape hash, loaded on first use
+        self.fstar_shapes = None
+
+        # the ids of the tags (tag paths) and xml types stored by name, loaded on
+        # first use - the XmlTagsAndValues table only stores the ids
+        self.tag_path_ids = None
+        self.type_ids = None
+
         if db_name:
             self.db_name = db_name
             self._connect_db()
@@ -91,15 +202,21 @@ class PersistenceManager:
                 self.db_name = os.path.join(data_directory, f"{db_id}.db")
             else:
                 self.db_name = f"{db_id}.db"
-            self._connect_db()
+            self._connect_db(create_db=True)
             self._create_tables()
 
-        # initialize the cache
-        self.cache = self._init_cache()
+        if self.background_writer:
+            self.writer = DatabaseWriter(self.db_name, self.writer_queue_size)
 
     def __del__(self):
+        # nothing to commit if the database could not be connected or the object
+        # is a copy in a forked process
+        if getattr(self, "conn", None) is None or self.conn_pid != os.getpid():
+            return
         # make sure all data in commited before object is deleted
         self.commit_writes()
+        if self.writer:
+            self.writer.stop()
 
     def __str__(self):
         out_string = f"db_file: {self.db_name}\n" f"file_path: {self.file_path}"
@@ -113,14 +230,22 @@ class PersistenceManager:
     # ------------------
 
     def __getstate__(self):
+        # Write the cached records and wait for the background writer, so the
+        # database is complete and the pickled cache is empty.
+        self.commit_writes()
         # Copy the object's state from self.__dict__ which contains
         # all our instance attributes. Always use the dict.copy()
         # method to avoid modifying the original state.
         state = self.__dict__.copy()
-        # Remove the unpicklable entries, i.e. the cursor 'c' and the
-        # connection 'conn' objecgt
+        # Remove the unpicklable entries, i.e. the cursor 'c', the
+        # connection 'conn' objecgt and the background writer thread
         # del state["c"]
         del state["conn"]
+        state["writer"] = None
+        # the id lookups are loaded from the database again on first use
+        state["fstar_shapes"] = None
+        state["tag_path_ids"] = None
+        state["type_ids"] = None
         return state
 
     def __setstate__(self, state):
@@ -128,6 +253,9 @@ class PersistenceManager:
         self.__dict__.update(state)
         # Restore the connection and cursor.
         self._connect_db()
+        # Start a background writer of its own
+        if self.background_writer:
+            self.writer = DatabaseWriter(self.db_name, self.writer_queue_size)
 
     # ------------------
     # Public Functions
@@ -176,11 +304,17 @@ class PersistenceManager:
         row = curr.fetchone()
         return row["NoOfLogs"]
 
-    def truncate_process_log(self):
+    def truncate_process_log(self, doc_id: int = None):
         with self.conn:
-            self.conn.execute(
-                "DELETE FROM ProcessLog",
-            )
+            if doc_id is not None:
+                self.conn.execute(
+                    "DELETE FROM ProcessLog WHERE DocID=:doc_id",
+                    {"doc_id": doc_id},
+                )
+            else:
+                self.conn.execute(
+                    "DELETE FROM ProcessLog",
+                )
 
     # Document Management
     def store_doc(
@@ -240,16 +374,15 @@ class PersistenceManager:
         # tags = json.dumps(obj=xml_obj.tags)
         top_node = ""
         tags = ""
-        tags_and_value = json.dumps(obj=tags_and_values)
 
-        # cache the information
-        # "INSERT INTO ParsedXmlStore VALUES (:DocID, :Type, :ParsedXml, :SoupNoOfTags, :SourceNoOfTags, :Tags, :TopNode)"
+        # cache the information - the tags and values themselves are only stored in
+        # the XmlTagsAndValues table (see get_xml_doc_parsed)
+        # "INSERT INTO ParsedXmlStore VALUES (:DocID, :Type, :SoupNoOfTags, :SourceNoOfTags, :Tags, :TopNode)"
         self._add_to_cache(
             "ParsedXmlStore",
             (
                 doc_id,
                 type,
-                tags_and_value,
                 soup_no_of_tags,
                 source_no_of_tags,
                 tags,
@@ -259,9 +392,11 @@ class PersistenceManager:
 
         # store the information
         # store all tag and value pairs
+        type_id = self._get_type_id(type)
         tag_idx = 0
         for tag, value in tags_and_values.items():
             tag_idx += 1
+            tag_path_id = self._get_tag_path_id(tag)
 
             if isinstance(value, list) and len(value) > 1:
                 # this is a list with tag id, depth, value triplets in the following form: [[tagid, depth, value, tag_type], [tagid, depth, value, tag_type], [tagid, depth, value, tag_type], ...]
@@ -272,14 +407,14 @@ class PersistenceManager:
                     tag_type = itm[3]
 
                     # cache the information
-                    # "INSERT INTO XmlTagsAndValues VALUES (:DocID, :Type, :TagOrder, :Tag, :TagType, :TagDepth, :TagID, :RepNo, :Value)"
+                    # "INSERT INTO XmlTagsAndValues VALUES (:DocID, :TypeID, :TagOrder, :TagPathID, :TagType, :TagDepth, :TagID, :RepNo, :Value)"
                     self._add_to_cache(
                         "XmlTagsAndValues",
                         (
                             doc_id,
-                            type,
+                            type_id,
                             tag_idx,
-                            tag,
+                            tag_path_id,
                             tag_type,
                             depth,
                             tag_id,
@@ -296,19 +431,78 @@ class PersistenceManager:
                 tag_type = value[0][3]
 
                 # cache the information
-                # "INSERT INTO XmlTagsAndValues VALUES (:DocID, :Type, :TagOrder, :Tag, :TagType, :TagDepth, :TagID, :RepNo, :Value)"
+                # "INSERT INTO XmlTagsAndValues VALUES (:DocID, :TypeID, :TagOrder, :TagPathID, :TagType, :TagDepth, :TagID, :RepNo, :Value)"
                 self._add_to_cache(
                     "XmlTagsAndValues",
-                    (doc_id, type, tag_idx, tag, tag_type, depth, tag_id, 0, tag_value),
+                    (
+                        doc_id,
+                        type_id,
+                        tag_idx,
+                        tag_path_id,
+                        tag_type,
+                        depth,
+                        tag_id,
+                        0,
+                        tag_value,
+                    ),
                 )
 
         # store the forward star of the xml document
         self._store_fstar_data(doc_id, xml_obj)
 
+    def store_xml_parsed_columns(
+        self, doc_id: int, columns: TagsAndValuesColumns, xml_obj: XmlParser
+    ):
+        # the same as store_xml_parsed(), but the tags and values are taken from the
+        # columnar representation and handed over to the cache as rows in one go
+
+        # get the meta data
+        type = xml_obj.type
+        top_node = ""
+        tags = ""
+
+        # cache the information
+        # "INSERT INTO ParsedXmlStore VALUES (:DocID, :Type, :SoupNoOfTags, :SourceNoOfTags, :Tags, :TopNode)"
+        self._add_to_cache(
+            "ParsedXmlStore",
+            (
+                doc_id,
+                type,
+                xml_obj.soup_no_of_tags,
+                xml_obj.source_no_of_tags,
+                tags,
+                top_node,
+            ),
+        )
+
+        # store all tag and value pairs, the tag order is the position of the path
+        # "INSERT INTO XmlTagsAndValues VALUES (:DocID, :TypeID, :TagOrder, :TagPathID, :TagType, :TagDepth, :TagID, :RepNo, :Value)"
+        tag_path_ids = [self._get_tag_path_id(path) for path in columns.paths]
+        self._extend_cache(
+            "XmlTagsAndValues",
+            zip(
+                repeat(doc_id),
+                repeat(self._get_type_id(type)),
+                [path_id + 1 for path_id in columns.path_ids],
+                [tag_path_ids[path_id] for path_id in columns.path_ids],
+                columns.tag_types,
+                columns.depths,
+                columns.tag_ids,
+                columns.repetitions,
+                columns.values,
+            ),
+        )
+
+        # store the forward star of the xml document
+        self._store_fstar_data(doc_id, xml_obj)
+
     def get_xml_doc_parsed(
         self, doc_id: int, attribute: XmlAttribute, data_tags_only: Boolean = False
     ):
 
+        if attribute == XmlAttribute.ParsedXml:
+            return self._get_parsed_xml(doc_id, data_tags_only)
+
         str_select = f"SELECT {attribute} FROM ParsedXmlStore where DocID=:id"
         curr = self.conn.execute(str_select, {"id": doc_id})
         xml_parsed = curr.fetchone()
@@ -317,9 +511,6 @@ class PersistenceManager:
 
         if attribute == XmlAttribute.Tags:
             output = json.loads(xml_ret)
-        elif attribute == XmlAttribute.ParsedXml:
-            dict_to_process = json.loads(xml_ret)
-            output = self._replace_lists(dict_to_process, data_tags_only)
         else:
             output = xml_ret
 
@@ -346,8 +537,8 @@ class PersistenceManager:
 
     def get_single_xml_type_stats(self, doc_type: str):
 
-        sql_cre_tmp_tbl = f"CREATE TEMP TABLE temp_{doc_type}_xmlTypeStats AS SELECT TagOrder, Tag, DocID, max(TagDepth) as maxDepth, max(TagRepetition) AS maxRepetition FROM XmlTagsAndValues WHERE Type=:doc_type  AND TagType=:tag_type GROUP BY TagOrder, Tag, DocID"
-        sql_sel_result = f"SELECT Tag, max(maxDepth) as maxDepth, max(maxRepetition) AS maxRep, min(maxRepetition) AS minRep, avg(maxRepetition) AS avgRep FROM temp_{doc_type}_xmlTypeStats GROUP BY TagOrder ORDER BY TagOrder"
+        sql_cre_tmp_tbl = f"CREATE TEMP TABLE temp_{doc_type}_xmlTypeStats AS SELECT TagOrder, TagPathID, DocID, max(TagDepth) as maxDepth, max(TagRepetition) AS maxRepetition FROM XmlTagsAndValues WHERE TypeID=(SELECT TypeID FROM XmlDocTypes WHERE Type=:doc_type) AND TagType=:tag_type GROUP BY TagOrder, TagPathID, DocID"
+        sql_sel_result = f"SELECT c.Tag, s.maxDepth, s.maxRep, s.minRep, s.avgRep FROM (SELECT TagOrder, TagPathID, max(maxDepth) as maxDepth, max(maxRepetition) AS maxRep, min(maxRepetition) AS minRep, avg(maxRepetition) AS avgRep FROM temp_{doc_type}_xmlTypeStats GROUP BY TagOrder) s INNER JOIN XmlTagCatalog c ON c.TagPathID = s.TagPathID ORDER BY s.TagOrder"
 
         self.conn.execute(
             sql_cre_tmp_tbl,
@@ -367,7 +558,13 @@ class PersistenceManager:
 
     def get_xml_tags_by_type(self, doc_type: str):
         curr = self.conn.execute(
-            "SELECT DISTINCT Tag FROM XmlTagsAndValues WHERE Type=:doc_type AND TagType=:tag_type ORDER BY TagOrder",
+            """SELECT c.TagPathID, c.Tag FROM (
+                SELECT TagPathID, MIN(TagOrder) AS TagOrder FROM XmlTagsAndValues
+                WHERE TypeID=(SELECT TypeID FROM XmlDocTypes WHERE Type=:doc_type)
+                AND TagType=:tag_type GROUP BY TagPathID
+            ) t
+            INNER JOIN XmlTagCatalog c ON c.TagPathID = t.TagPathID
+            ORDER BY t.TagOrder""",
             {"doc_type": doc_type, "tag_type": TagType.data_tag},
         )
         for row in curr:
@@ -375,7 +572,9 @@ class PersistenceManager:
 
     def get_xml_tag_stats_by_doc_id(self, doc_id: int):
         curr = self.conn.execute(
-            "SELECT Tag, MAX(TagDepth), MAX(TagRepetition) FROM XmlTagsAndValues WHERE DocID=:doc_id GROUP BY Tag",
+            """SELECT c.Tag, MAX(t.TagDepth), MAX(t.TagRepetition) FROM XmlTagsAndValues t
+            INNER JOIN XmlTagCatalog c ON c.TagPathID = t.TagPathID
+            WHERE t.DocID=:doc_id GROUP BY c.Tag""",
             {"doc_id": doc_id},
         )
         for row in curr:
@@ -383,7 +582,9 @@ class PersistenceManager:
 
     def get_xml_tags_and_values_by_doc_id(self, doc_id: int):
         curr = self.conn.execute(
-            "SELECT TagID, Tag, TagType, Value FROM XmlTagsAndValues WHERE DocID=:doc_id order by TagID;",
+            """SELECT t.TagID, c.Tag, t.TagType, t.Value FROM XmlTagsAndValues t
+            INNER JOIN XmlTagCatalog c ON c.TagPathID = t.TagPathID
+            WHERE t.DocID=:doc_id order by t.TagID;""",
             {"doc_id": doc_id},
         )
         for row in curr:
@@ -394,7 +595,9 @@ class PersistenceManager:
     ):
         fields = [f"'{field}'" for field in create_record_on]
         str_fields = ", ".join(fields)
-        sql = f"SELECT TagID, Tag, TagType, TagRepetition, Value FROM XmlTagsAndValues WHERE DocID=:doc_id AND Tag IN({str_fields}) order by TagRepetition, TagID;"
+        sql = f"""SELECT t.TagID, c.Tag, t.TagType, t.TagRepetition, t.Value FROM XmlTagsAndValues t
+            INNER JOIN XmlTagCatalog c ON c.TagPathID = t.TagPathID
+            WHERE t.DocID=:doc_id AND c.Tag IN({str_fields}) order by t.TagRepetition, t.TagID;"""
         curr = self.conn.execute(
             sql,
             {"doc_id": doc_id},
@@ -407,7 +610,9 @@ class PersistenceManager:
     ):
         fields = [f"'{field}'" for field in create_record_on]
         str_fields = ", ".join(fields)
-        sql = f"SELECT TagID, Tag, TagType, TagRepetition, Value FROM XmlTagsAndValues WHERE DocID=:doc_id AND Tag NOT IN({str_fields}) order by TagRepetition, TagID;"
+        sql = f"""SELECT t.TagID, c.Tag, t.TagType, t.TagRepetition, t.Value FROM XmlTagsAndValues t
+            INNER JOIN XmlTagCatalog c ON c.TagPathID = t.TagPathID
+            WHERE t.DocID=:doc_id AND c.Tag NOT IN({str_fields}) order by t.TagRepetition, t.TagID;"""
         curr = self.conn.execute(
             sql,
             {"doc_id": doc_id},
@@ -420,12 +625,8 @@ class PersistenceManager:
         self, doc_type: str, create_record_on: Optional[Set[str]] = None
     ):
         # get the headers and create the fieldlist
-        headers = [
-            f"[{row['Tag']}] text, " for row in self.get_xml_tags_by_type(doc_type)
-        ]
-        s = ""
-        fieldlist = s.join(headers)
-        fieldlist = fieldlist[:-2]
+        headers = list(self.get_xml_tags_by_type(doc_type))
+        fieldlist = ", ".join(f"[{row['Tag']}] text" for row in headers)
 
         # create table with headers
         # print(f"drop if exists with subsequent create table for: {doc_type}FinalOutput")
@@ -437,125 +638,35 @@ class PersistenceManager:
 
         # process the documents
         if not create_record_on:
-            for type, id in self.get_xml_doc_id_by_type(doc_type):
-                # simply process each document without taking care of any repetitive elements
-                tags_n_values = self.get_xml_doc_parsed(
-                    id, XmlAttribute.ParsedXml, True
-                )
-                # # replace the record structure with simple key/value pairs
-                # for tag, record in tags_n_values.items():
-                #     tags_n_values[tag] = record[2]
-                self._create_single_record_output(
-                    tags_n_values=tags_n_values, type=type
-                )
+            # simply pivot the tags and values of all documents without taking care
+            # of any repetitive elements
+            self._create_pivot_output(doc_type=doc_type, headers=headers)
         else:
-            # create a new forward star object
-            fstar = ForwardStar("empty")
-
-            # process the documents
-            for type, id in self.get_xml_doc_id_by_type(doc_type):
-                # build the fstar
-                fstar_data = self._get_fstar_data(doc_id=id)
-                fstar.load_from_fstar_data(fstar_data)
-
-                # build tags and value dict
-                tags_and_values = {}
-                for (
-                    tag_id,
-                    tag,
-                    tag_type,
-                    value,
-                ) in self.get_xml_tags_and_values_by_doc_id(doc_id=id):
-                    tags_and_values[tag_id] = (tag, tag_type, value)
-
-                # build the repetitive tags table
-                # TagID, Tag, TagRepetition, Value
-                rep_tags_and_values = {}
-                for (
-                    r_tag_id,
-                    r_tag,
-                    r_tag_type,
-                    r_tag_rep,
-                    r_value,
-                ) in self.get_xml_tags_and_values_repetitive_by_doc_id(
-                    doc_id=id, create_record_on=create_record_on
-                ):
-                    rep_tags_and_values[r_tag_id] = (
-                        r_tag,
-                        r_tag_type,
-                        r_tag_rep,
-                        r_value,
-                    )
-
-                # build the non-repetitive tags table
-                non_rep_tags_and_values = {}
-                for (
-                    nr_tag_id,
-                    nr_tag,
-                    nr_tag_type,
-                    nr_tag_rep,
-                    nr_value,
-                ) in self.get_xml_tags_and_values_non_repetitive_by_doc_id(
-                    doc_id=id, create_record_on=create_record_on
-                ):
-                    non_rep_tags_and_values[nr_tag_id] = (
-                        nr_tag,
-                        nr_tag_type,
-                        nr_tag_rep,
-                        nr_value,
-                    )
-
-                # build the empty target record structure
-                target_record = {}
-                tags = self.get_xml_doc_parsed(id, XmlAttribute.ParsedXml, True)
-                for t_tag in tags:
-                    target_record[t_tag] = ""
-
-                # process each document while creating new records for fields provided
-                # based on the list of repetitive tags
-                r_tag_rep_prev = 0
-                first_run = True
-                records = []
-                curr_record = deepcopy(target_record)
-
-                # process the repetitive tags
-                for r_tag_id, r_tag_record in rep_tags_and_values.items():
-
-                    # record structure of r_tag_record: (tag, tag_type, tag_rep, value)
-                    r_tag, _, r_tag_rep, r_value = r_tag_record
-
-                    # Step 1 - enrich all the non repetitive tags based on the
-                    # frist repetitive tag
-                    if first_run:
-                        first_run = False
-                        curr_record = self._get_non_repetitive_tags(
-                            record=curr_record,
-                            fstar=fstar,
-                            start_tag_id=r_tag_id,
-                            tags_and_values=tags_and_values,
-                            nr_tags_n_values=non_rep_tags_and_values,
-                            r_tags_n_values=rep_tags_and_values,
-                        )
-
-                    # Step 2 - if we have moved to the next repetition,
-                    # save the current record and initiate a new record
-                    if r_tag_rep != r_tag_rep_prev:
-                        records.append(curr_record)
-                        r_tag_rep_prev = r_tag_rep
-                        curr_record = deepcopy(target_record)
-                        first_run = True
-
-                    # Setp 3 - add the tag and it's value
-                    curr_record[r_tag] = r_value
-
-                # save the last record
-                records.append(curr_record)
-
-                # create the output for the records
-                for curr_record in records:
-                    self._create_single_record_output(
-                        tags_n_values=curr_record, type=type
-                    )
+            # the records are written in batches with one prepared statement
+            placeholders = ", ".join("?" * len(headers))
+            sql_ins = f"INSERT INTO {doc_type}FinalOutput VALUES ({placeholders})"
+            records = self._get_split_records(doc_type, headers, create_record_on)
+            while True:
+                output_records = list(islice(records, OUTPUT_BATCH_SIZE))
+                if not output_records:
+                    break
+                self.conn.executemany(sql_ins, output_records)
+
+    def get_output_records_by_xml_type(
+        self, doc_type: str, create_record_on: Optional[Set[str]] = None
+    ):
+        # the records of create_output_by_xml_type() without storing them in the
+        # FinalOutput table, the values in the order of get_xml_tags_by_type()
+        headers = list(self.get_xml_tags_by_type(doc_type))
+        if not create_record_on:
+            curr = self.conn.execute(
+                self._get_pivot_sql(headers),
+                {"doc_type": doc_type, "tag_type": TagType.data_tag},
+            )
+            for row in curr:
+                yield row
+        else:
+            yield from self._get_split_records(doc_type, headers, create_record_on)
 
     def get_output_by_xml_type(self, doc_type: str):
 
@@ -565,26 +676,55 @@ class PersistenceManager:
         for row in curr:
             yield row
 
+    def get_fstar_forest_by_xml_type(
+        self, doc_type: str, with_tags: bool = False
+    ) -> ForwardStarForest:
+        # the fstars of all documents of the type in one forest, with_tags the nodes
+        # are labelled with their tags
+        fstars = self._get_fstars_by_xml_type(doc_type)
+
+        node_labels = None
+        if with_tags:
+            node_labels = {}
+            curr = self.conn.execute(
+                """SELECT t.DocID, t.TagID, c.Tag FROM XmlTagsAndValues t
+                INNER JOIN XmlTagCatalog c ON c.TagPathID = t.TagPathID
+                WHERE t.TypeID=(SELECT TypeID FROM XmlDocTypes WHERE Type=:doc_type)""",
+                {"doc_type": doc_type},
+            )
+            for doc_id, doc_rows in groupby(curr, key=itemgetter(0)):
+                fstar = fstars[doc_id]
+                labels = node_labels.setdefault(doc_id, [None] * fstar.num_nodes)
+                for _, tag_id, tag in doc_rows:
+                    labels[fstar.find_node_by_caption(tag_id)] = tag
+
+        return ForwardStarForest(fstars, node_labels)
+
+    def count_tags_by_xml_type(
+        self,
+        doc_type: str,
+        ancestor_tag: str,
+        descendant_tag: str,
+        children_only: bool = True,
+    ) -> list:
+        # the number of descendant tags per ancestor tag in every document of the
+        # type, e.g. the DrctDbtTxInf per PmtInf, as (DocID, TagID, count) tuples
+        forest = self.get_fstar_forest_by_xml_type(doc_type, with_tags=True)
+        return forest.count_by_label(ancestor_tag, descendant_tag, children_only)
+
     # general database Management
     def remove_db_file(self):
         os.remove(self.db_name)
 
     def commit_writes(self):
+        self._flush_cache(auto_flush=False)
 
-        for table_name, values in self.cache.items():
-            # only process lists that actually do contain data
-            if len(values["Data"]) > 0:
-                # get the number of elements in the 1st tuple
-                field_list = ", ".join(values["Fields"])
-                no_elems = len(values["Data"][0])
-                params_string = ", ".join("?" for _ in range(0, no_elems))
-                sql_ins = (
-                    f"INSERT INTO {table_name} ({field_list}) VALUES ({params_string})"
-                )
-                with self.conn:
-                    self.conn.executemany(sql_ins, values["Data"])
+        # wait for the background writer to write all data
+        if self.writer:
+            self.writer.wait()
 
-        self._clear_chache()
+    def get_cache_stats(self) -> CacheStats:
+        return self.cache_stats
 
     def truncate_doc_store(self):
         with self.conn:
@@ -612,6 +752,18 @@ class PersistenceManager:
             self.conn.execute(
                 "DELETE FROM XmlFStarAttributes",
             )
+            self.conn.execute(
+                "DELETE FROM XmlFStarShapes",
+            )
+            self.conn.execute(
+                "DELETE FROM XmlTagCatalog",
+            )
+            self.conn.execute(
+                "DELETE FROM XmlDocTypes",
+            )
+        self.fstar_shapes = None
+        self.tag_path_ids = None
+        self.type_ids = None
 
     def create_indices(self, index_group: IndexGroup):
 
@@ -657,17 +809,17 @@ class PersistenceManager:
                 # the XmlTagsAndValues indices
                 self.conn.execute(
                     """CREATE INDEX IdxXmlTagsAndValuesDocID
-                    ON XmlTagsAndValues (DocID)"""
+                    ON XmlTagsAndValues (DocID, TagOrder, TagRepetition)"""
                 )
 
                 self.conn.execute(
                     """CREATE INDEX IdxXmlTagsAndValuesTag
-                    ON XmlTagsAndValues (Tag)"""
+                    ON XmlTagsAndValues (TagPathID)"""
                 )
 
                 self.conn.execute(
                     """CREATE INDEX IdxXmlTagsAndValuesType
-                    ON XmlTagsAndValues (Type)"""
+                    ON XmlTagsAndValues (TypeID)"""
                 )
 
                 # the XmlFStarAttributes index
@@ -676,6 +828,12 @@ class PersistenceManager:
                     ON XmlFStarAttributes (DocID)"""
                 )
 
+                # the XmlFStarShapes index
+                self.conn.execute(
+                    """CREATE UNIQUE INDEX IdxXmlFStarShapes
+                    ON XmlFStarShapes (ShapeID)"""
+                )
+
     def drop_indices(self, index_group: IndexGroup):
 
         if index_group == IndexGroup.PROCESS_LOG:
@@ -709,14 +867,28 @@ class PersistenceManager:
                 # the XmlFStarAttributes index
                 self.conn.execute("""DROP INDEX IF EXISTS IdxXmlFStarAttributes""")
 
+                # the XmlFStarShapes index
+                self.conn.execute("""DROP INDEX IF EXISTS IdxXmlFStarShapes""")
+
     # ------------------
     # Internal Functions
     # ------------------
 
-    def _connect_db(self):
+    def _connect_db(self, create_db: bool = False):
         self.conn = sqlite3.connect(self.db_name, isolation_level="DEFERRED")
+        # the process owning the connection, a copy of the object in a forked process
+        # (e.g. of a process pool) must not write through it
+        self.conn_pid = os.getpid()
         self.conn.execute("PRAGMA synchronous = OFF")
-        self.conn.execute("PRAGMA journal_mode = OFF")
+        # the WAL journal mode is stored in the database, it is only set when the
+        # database is created - switching a database out of WAL would need exclusive
+        # access while other connections (e.g. the background writer) are open.
+        # Without WAL the journal is switched off for this connection only.
+        journal_mode = self.conn.execute("PRAGMA journal_mode").fetchone()[0]
+        if create_db and self.background_writer:
+            self.conn.execute("PRAGMA journal_mode = WAL")
+        elif journal_mode.lower() != "wal":
+            self.conn.execute("PRAGMA journal_mode = OFF")
         self.conn.row_factory = sqlite3.Row
 
         # self.c = self.conn.cursor()
@@ -730,18 +902,20 @@ class PersistenceManager:
         cache = {}
         cache["ProcessLog"] = {
             "Data": [],
+            "Bytes": 0,
             "Fields": ["DocID", "LogLevel", "LogEntry"],
         }
         cache["DocList"] = {
             "Data": [],
+            "Bytes": 0,
             "Fields": ["DocID", "DocValidity", "DocText", "DocInvalidReason"],
         }
         cache["ParsedXmlStore"] = {
             "Data": [],
+            "Bytes": 0,
             "Fields": [
                 "DocID",
                 "Type",
-                "ParsedXml",
                 "SoupNoOfTags",
                 "SourceNoOfTags",
                 "Tags",
@@ -750,11 +924,12 @@ class PersistenceManager:
         }
         cache["XmlTagsAndValues"] = {
             "Data": [],
+            "Bytes": 0,
             "Fields": [
                 "DocID",
-                "Type",
+                "TypeID",
                 "TagOrder",
-                "Tag",
+                "TagPathID",
                 "TagType",
                 "TagDepth",
                 "TagID",
@@ -764,28 +939,45 @@ class PersistenceManager:
         }
         cache["XmlFStarFirstLink"] = {
             "Data": [],
+            "Bytes": 0,
             "Fields": ["DocID", "FSIndex", "FristLink"],
         }
         cache["XmlFStarToNode"] = {
             "Data": [],
+            "Bytes": 0,
             "Fields": ["DocID", "FSIndex", "ToNode"],
         }
         cache["XmlFStarNodeCaption"] = {
             "Data": [],
+            "Bytes": 0,
             "Fields": ["DocID", "FSIndex", "NodeCaptionTagID"],
         }
         cache["XmlFStarAttributes"] = {
             "Data": [],
+            "Bytes": 0,
             "Fields": [
                 "DocID",
                 "NumLinks",
                 "NumNodes",
                 "SelectedNode",
-                "FristLink",
-                "ToNode",
-                "NodeCaption",
+                "ShapeID",
             ],
         }
+        cache["XmlFStarShapes"] = {
+            "Data": [],
+            "Bytes": 0,
+            "Fields": ["ShapeID", "ShapeHash", "FStar"],
+        }
+        cache["XmlTagCatalog"] = {
+            "Data": [],
+            "Bytes": 0,
+            "Fields": ["TagPathID", "Tag"],
+        }
+        cache["XmlDocTypes"] = {
+            "Data": [],
+            "Bytes": 0,
+            "Fields": ["TypeID", "Type"],
+        }
 
         return cache
 
@@ -815,7 +1007,6 @@ class PersistenceManager:
                 """CREATE TABLE ParsedXmlStore (
                             DocID integer,
                             Type text,
-                            ParsedXml text,
                             SoupNoOfTags integer,
                             SourceNoOfTags integer,
                             Tags text,
@@ -827,9 +1018,9 @@ class PersistenceManager:
             self.conn.execute(
                 """CREATE TABLE XmlTagsAndValues (
                             DocID integer,
-                            Type text,
+                            TypeID integer,
                             TagOrder integer,
-                            Tag text,
+                            TagPathID integer,
                             TagType integer,
                             TagDepth integer,
                             TagID integer,
@@ -845,177 +1036,441 @@ class PersistenceManager:
                             NumLinks integer,
                             NumNodes integer,
                             SelectedNode integer,
-                            FristLink text,
-                            ToNode text,
-                            NodeCaption text
+                            ShapeID integer
                             )"""
             )
 
-    def _replace_lists(self, dict_in: dict, data_tags_only: Boolean = False):
+            # the XmlFStarShapes table
+            self.conn.execute(
+                """CREATE TABLE XmlFStarShapes (
+                            ShapeID integer,
+                            ShapeHash text,
+                            FStar blob
+                            )"""
+            )
 
+            # the XmlTagCatalog table (the tags of XmlTagsAndValues by id)
+            self.conn.execute(
+                """CREATE TABLE XmlTagCatalog (
+                            TagPathID integer PRIMARY KEY,
+                            Tag text
+                            )"""
+            )
+
+            # the XmlDocTypes table (the types of XmlTagsAndValues by id)
+            self.conn.execute(
+                """CREATE TABLE XmlDocTypes (
+                            TypeID integer PRIMARY KEY,
+                            Type text
+                            )"""
+            )
+
+    def _get_parsed_xml(self, doc_id: int, data_tags_only: Boolean = False):
+
+        # the tags and values of the document in tag order, i.e. a range scan on the
+        # XmlTagsAndValues index (the left join returns a row without tag for parsed
+        # documents without tags and no row for documents not parsed)
+        curr = self.conn.execute(
+            """SELECT t.TagOrder, c.Tag, t.TagType, t.Value FROM ParsedXmlStore s
+            LEFT JOIN XmlTagsAndValues t ON t.DocID = s.DocID
+            LEFT JOIN XmlTagCatalog c ON c.TagPathID = t.TagPathID
+            WHERE s.DocID=:doc_id ORDER BY t.TagOrder, t.TagRepetition""",
+            {"doc_id": doc_id},
+        )
+        rows = curr.fetchall()
+        if not rows:
+            raise KeyError(f"no parsed xml found for document {doc_id}")
+
+        # one entry per tag: blank for nodes (left out with data_tags_only) and the
+        # values of all repetitions for data tags
         separator = " | "
-        dict_tmp = {}
-        for key in dict_in:
-            # check if the item is a node
-            if isinstance(dict_in[key], list):
-                if isinstance(dict_in[key][0], list):
-                    # this is a list containing tag id, depth, value, tag_type triplets
-                    # get the value which is at position 2 (the 3rd position)
-                    if dict_in[key][0][3] == TagType.node:
-                        if data_tags_only:
-                            # this is a list of nodes - don't transfer to temp dict
-                            pass
-                        else:
-                            # this is list of nodes - keep it but blank out value
-                            # dict_in[key] = ""
-                            dict_tmp[key] = ""
-                    else:
-                        # lst_tmp = []
-                        # for pair in dict_in[key]:
-                        #     lst_tmp.append(pair[2])
-                        lst_tmp = [pair[2] for pair in dict_in[key]]
-                        # dict_in[key] = separator.join(lst_tmp)
-                        dict_tmp[key] = separator.join(lst_tmp)
-                else:
-                    # this is a single value containing a tag id, depth, value, tag_type triplet
-                    # get the value which is at position 2 (the 3rd position)
-                    if dict_in[key][3] == TagType.node:
-                        # this is a node - blank out value
-                        # dict_in[key] = ""
-                        dict_tmp[key] = ""
-                    else:
-                        # dict_in[key] = dict_in[key][2]
-                        dict_tmp[key] = dict_in[key][2]
-        # return dict_in
-        return dict_tmp
+        output = {}
+        for _, tag_rows in groupby(rows, key=itemgetter(0)):
+            tag_rows = list(tag_rows)
+            _, tag, tag_type, _ = tag_rows[0]
+            if tag is None:
+                continue
+            if tag_type == TagType.node:
+                if not data_tags_only:
+                    output[tag] = ""
+            else:
+                output[tag] = separator.join(row[3] for row in tag_rows)
+
+        return output
 
     def _store_fstar_data(self, doc_id: int, xml_obj: XmlParser):
 
         # get the fstar from xml_obj
-        fstar_data = xml_obj.fstar.get_fstar_data()
-
-        # the frist link list
-        first_link = json.dumps(obj=fstar_data.first_link)
-
-        # the to node list
-        to_node = json.dumps(obj=fstar_data.to_node)
+        fstar = xml_obj.fstar
 
-        # the node caption list
-        node_caption = json.dumps(obj=fstar_data.node_caption)
+        # documents with the same tree shape share the stored fstar
+        shape_id = self._get_fstar_shape_id(fstar)
 
-        # store the all lists and attributes in the attributes table
+        # store the attributes and the shape in the attributes table
         self._add_to_cache(
             "XmlFStarAttributes",
             (
                 doc_id,
-                fstar_data.num_links,
-                fstar_data.num_nodes,
-                fstar_data.selected_node,
-                first_link,
-                to_node,
-                node_caption,
+                fstar.num_links,
+                fstar.num_nodes,
+                fstar.selected_node,
+                shape_id,
             ),
         )
 
-    def _get_fstar_data(self, doc_id: int) -> ForwardStarData:
-
-        # node_caption = []
-        # first_link = []
-        # to_node = []
-        num_links = 0
-        num_nodes = 0
-        selected_node = -1
-
-        # get the attributes
+    def _get_fstar_shape_id(self, fstar: ForwardStar) -> int:
+
+        # get the shapes stored so far
+        if self.fstar_shapes is None:
+            self.fstar_shapes = {}
+            curr = self.conn.execute("SELECT ShapeID, ShapeHash FROM XmlFStarShapes")
+            for shape_id, shape_hash in curr:
+                self.fstar_shapes[shape_hash] = shape_id
+
+        # the binary representation (and so its hash) is the same for the same shape
+        fstar_blob = fstar.to_bytes()
+        shape_hash = get_blob_hash(fstar_blob)
+        shape_id = self.fstar_shapes.get(shape_hash)
+        if shape_id is None:
+            shape_id = len(self.fstar_shapes) + 1
+            self.fstar_shapes[shape_hash] = shape_id
+            self._add_to_cache("XmlFStarShapes", (shape_id, shape_hash, fstar_blob))
+
+        return shape_id
+
+    def _get_tag_path_id(self, tag: str) -> int:
+
+        # get the tags stored so far
+        if self.tag_path_ids is None:
+            self.tag_path_ids = {}
+            curr = self.conn.execute("SELECT TagPathID, Tag FROM XmlTagCatalog")
+            for tag_path_id, catalog_tag in curr:
+                self.tag_path_ids[catalog_tag] = tag_path_id
+
+        tag_path_id = self.tag_path_ids.get(tag)
+        if tag_path_id is None:
+            tag_path_id = len(self.tag_path_ids) + 1
+            self.tag_path_ids[tag] = tag_path_id
+            self._add_to_cache("XmlTagCatalog", (tag_path_id, tag))
+
+        return tag_path_id
+
+    def _get_type_id(self, type: str) -> int:
+
+        # get the types stored so far
+        if self.type_ids is None:
+            self.type_ids = {}
+            curr = self.conn.execute("SELECT TypeID, Type FROM XmlDocTypes")
+            for type_id, doc_type in curr:
+                self.type_ids[doc_type] = type_id
+
+        type_id = self.type_ids.get(type)
+        if type_id is None:
+            type_id = len(self.type_ids) + 1
+            self.type_ids[type] = type_id
+            self._add_to_cache("XmlDocTypes", (type_id, type))
+
+        return type_id
+
+    def _get_fstars_by_xml_type(self, doc_type: str) -> dict:
+        # the fstars of all documents of the type by doc id, read with one statement
+        # for the shapes of the documents and one for the fstar blobs. The fstars
+        # are read-only, so documents of the same shape share one.
         curr = self.conn.execute(
-            "SELECT NumLinks, NumNodes, SelectedNode, FristLink, ToNode, NodeCaption FROM XmlFStarAttributes WHERE DocID=:doc_id",
-            {"doc_id": doc_id},
+            """SELECT DocID, ShapeID FROM XmlFStarAttributes
+            WHERE DocID IN (SELECT DocID FROM ParsedXmlStore WHERE Type=:doc_type)
+            ORDER BY DocID""",
+            {"doc_type": doc_type},
         )
-        row = curr.fetchone()
-        first_link = json.loads(row["FristLink"])
-        to_node = json.loads(row["ToNode"])
-        node_caption = json.loads(row["NodeCaption"])
-        num_links = row["NumLinks"]
-        num_nodes = row["NumNodes"]
-        selected_node = row["SelectedNode"]
-
-        fstar_data = ForwardStarData(
-            node_caption=node_caption,
-            first_link=first_link,
-            to_node=to_node,
-            num_links=num_links,
-            num_nodes=num_nodes,
-            selected_node=selected_node,
+        shape_ids = {row["DocID"]: row["ShapeID"] for row in curr}
+
+        curr = self.conn.execute(
+            """SELECT ShapeID, FStar FROM XmlFStarShapes WHERE ShapeID IN (
+                SELECT ShapeID FROM XmlFStarAttributes
+                WHERE DocID IN (SELECT DocID FROM ParsedXmlStore WHERE Type=:doc_type)
+            )""",
+            {"doc_type": doc_type},
         )
+        # the fstar is loaded without copying the arrays out of the blob
+        fstars = {
+            row["ShapeID"]: ForwardStar.from_bytes(row["FStar"]) for row in curr
+        }
 
-        return fstar_data
+        return {doc_id: fstars[shape_id] for doc_id, shape_id in shape_ids.items()}
 
     def _get_non_repetitive_tags(
         self,
-        record: dict,
-        fstar: ForwardStar,
+        record: list,
+        columns: dict,
+        forest: ForwardStarForest,
+        doc_id: int,
         start_tag_id: int,
         tags_and_values: dict,
-        nr_tags_n_values: dict,
         r_tags_n_values: dict,
     ) -> dict:
         # structure of tags_and_values: tags_and_values[tag_id] = (tag, tag_type, value)
+        # the values are stored in the record at the column of the tag
 
         # set with tag_id's which have been processed
         tags_processed = {key for key in r_tags_n_values.keys()}
 
+        # the descendants of a node are a contiguous range of the pre-order of the
+        # fstar, so there is no need to enumerate a subtree more than once:
         # Step 1 - get all the child values down to the bottom
-        # and store the tag_id's to prevent override of the values
-        # in step 2
-        for _, child in fstar.visit_node_descendants(start_tag_id):
-            if (
-                tags_and_values[child][1] == TagType.data_tag
-                and child not in tags_processed
-            ):
-                record[tags_and_values[child][0]] = tags_and_values[child][2]
-                tags_processed.add(child)
-
-        # Step 2 - get all the parent values up to the root
-        # and process the child values, i.e. repeat Step 1
-        for parent, _ in fstar.visit_node_ancestors(start_tag_id):
-            # Step 1 (2nd iteration) - get all the child values down to the bottom
-            # and store the tag_id's to prevent override of the values in a
-            # later visit
-            for _, child in fstar.visit_node_descendants(parent):
+        # Step 2 - get all the parent values up to the root, for each parent only
+        # the descendants before and after the subtree processed in the step before
+        node = forest.find_node(doc_id, start_tag_id)
+        start, end = forest.subtree_range(node)
+        ranges_to_process = [(start + 1, end)]
+
+        parent = forest.get_parent(node)
+        while parent != -1:
+            parent_start, parent_end = forest.subtree_range(parent)
+            ranges_to_process.append((parent_start + 1, start))
+            ranges_to_process.append((end, parent_end))
+            start, end = parent_start, parent_end
+            parent = forest.get_parent(parent)
+
+        # store the tag_id's to prevent override of the values of a later visit
+        pre_order = forest.get_pre_order()
+        node_caption = forest.node_caption
+        for range_start, range_end in ranges_to_process:
+            for node in pre_order[range_start:range_end]:
+                child = node_caption[node]
                 if (
                     tags_and_values[child][1] == TagType.data_tag
                     and child not in tags_processed
                 ):
-                    record[tags_and_values[child][0]] = tags_and_values[child][2]
+                    tag, _, value = tags_and_values[child]
+                    record[columns[tag]] = value
                     tags_processed.add(child)
-                # elif child == start_tag_id:
-                #     break
 
         # return the enriched record
         return record
 
-    def _create_single_record_output(self, tags_n_values: dict, type: str):
-        fields = []
-        values = []
-        for tag, value in tags_n_values.items():
-            fields.append(f"[{tag}]")
-            values.append(f"'{value}'")
-        field_str = ", ".join(fields)
-        value_str = ", ".join(values)
-        sql_ins = f"INSERT INTO {type}FinalOutput ({field_str}) VALUES ({value_str})"
-        try:
-            self.conn.execute(sql_ins)
-        except sqlite3.OperationalError as e:
-            print(
-                f"DocID: {id} with statement:\n{sql_ins}\nled to the following error: {e}"
+    def _get_tags_and_values_by_xml_type(
+        self, doc_type: str, create_record_on: Set[str]
+    ):
+        # the tags and values of all documents of the type in tag id order, with the
+        # repetitive tags flagged and the tag type of the first repetition of each
+        # tag, which decides whether the tag is a data tag (see _get_parsed_xml)
+        fields = list(create_record_on)
+        str_fields = ", ".join("?" * len(fields))
+        sql = f"""SELECT t.DocID, t.TagID, c.Tag, t.TagType, t.TagRepetition, t.Value,
+            c.Tag IN ({str_fields}) AS Repetitive,
+            first_value(t.TagType) OVER (
+                PARTITION BY t.DocID, t.TagOrder ORDER BY t.TagRepetition
+            ) AS FirstTagType
+            FROM XmlTagsAndValues t
+            INNER JOIN XmlTagCatalog c ON c.TagPathID = t.TagPathID
+            WHERE t.TypeID=(SELECT TypeID FROM XmlDocTypes WHERE Type=?)
+            ORDER BY t.DocID, t.TagID"""
+        curr = self.conn.execute(sql, (*fields, doc_type))
+        for row in curr:
+            yield row
+
+    def _create_pivot_output(self, doc_type: str, headers: list):
+        field_str = ", ".join(f"[{row['Tag']}]" for row in headers)
+        sql_ins = f"""INSERT INTO {doc_type}FinalOutput ({field_str})
+            {self._get_pivot_sql(headers)}"""
+        self.conn.execute(
+            sql_ins, {"doc_type": doc_type, "tag_type": TagType.data_tag}
+        )
+
+    def _get_pivot_sql(self, headers: list) -> str:
+        # one record per document with one column per data tag and the values of
+        # all repetitions of a tag joined (see _get_parsed_xml), i.e. the output of
+        # all documents of the type is created by a single statement. The
+        # repetitions of a tag are joined by a window in repetition order (the
+        # order of a plain group_concat() is arbitrary), which also gives the tag
+        # type of the first repetition deciding whether the tag is a data tag, as
+        # in _get_tags_and_values_by_xml_type(). The conditional aggregation then
+        # turns the tags of a document into the columns of its record.
+        pivot_str = ", ".join(
+            f"max(CASE WHEN TagPathID = {row['TagPathID']} THEN Value END)"
+            for row in headers
+        )
+        return f"""SELECT {pivot_str} FROM (
+                SELECT DocID, TagPathID,
+                row_number() OVER tag_window AS RowNo,
+                first_value(TagType) OVER tag_window AS FirstTagType,
+                group_concat(Value, ' | ') OVER tag_window AS Value
+                FROM XmlTagsAndValues
+                WHERE DocID IN (SELECT DocID FROM ParsedXmlStore WHERE Type=:doc_type)
+                WINDOW tag_window AS (
+                    PARTITION BY DocID, TagOrder ORDER BY TagRepetition
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+                )
             )
+            WHERE RowNo=1 AND FirstTagType=:tag_type
+            GROUP BY DocID ORDER BY DocID"""
+
+    def _get_split_records(
+        self, doc_type: str, headers: list, create_record_on: Set[str]
+    ):
+        # the records are lists with the values in the order of the columns
+        columns = {row["Tag"]: idx for idx, row in enumerate(headers)}
+
+        # the fstars of all documents in one forest
+        forest = self.get_fstar_forest_by_xml_type(doc_type)
+
+        # process the documents
+        for id, doc_rows in groupby(
+            self._get_tags_and_values_by_xml_type(doc_type, create_record_on),
+            key=itemgetter(0),
+        ):
+            # build the tags and value dict, the repetitive tags table and the
+            # empty target record (blank for the data tags of the document)
+            tags_and_values = {}
+            rep_rows = []
+            target_record = [None] * len(columns)
+            for (
+                _,
+                tag_id,
+                tag,
+                tag_type,
+                tag_rep,
+                value,
+                repetitive,
+                first_tag_type,
+            ) in doc_rows:
+                tags_and_values[tag_id] = (tag, tag_type, value)
+                if repetitive:
+                    rep_rows.append((tag_rep, tag_id, tag, tag_type, value))
+                if first_tag_type == TagType.data_tag:
+                    target_record[columns[tag]] = ""
+
+            # TagID, Tag, TagRepetition, Value in repetition order
+            rep_tags_and_values = {}
+            for r_tag_rep, r_tag_id, r_tag, r_tag_type, r_value in sorted(
+                rep_rows
+            ):
+                rep_tags_and_values[r_tag_id] = (
+                    r_tag,
+                    r_tag_type,
+                    r_tag_rep,
+                    r_value,
+                )
+
+            # process each document while creating new records for fields provided
+            # based on the list of repetitive tags
+            r_tag_rep_prev = 0
+            first_run = True
+            records = []
+            curr_record = target_record.copy()
+
+            # process the repetitive tags
+            for r_tag_id, r_tag_record in rep_tags_and_values.items():
+
+                # record structure of r_tag_record: (tag, tag_type, tag_rep, value)
+                r_tag, _, r_tag_rep, r_value = r_tag_record
+
+                # Step 1 - enrich all the non repetitive tags based on the
+                # frist repetitive tag
+                if first_run:
+                    first_run = False
+                    curr_record = self._get_non_repetitive_tags(
+                        record=curr_record,
+                        columns=columns,
+                        forest=forest,
+                        doc_id=id,
+                        start_tag_id=r_tag_id,
+                        tags_and_values=tags_and_values,
+                        r_tags_n_values=rep_tags_and_values,
+                    )
+
+                # Step 2 - if we have moved to the next repetition,
+                # save the current record and initiate a new record
+                if r_tag_rep != r_tag_rep_prev:
+                    records.append(curr_record)
+                    r_tag_rep_prev = r_tag_rep
+                    curr_record = target_record.copy()
+                    first_run = True
+
+                # Setp 3 - add the tag and it's value (the tags provided are
+                # only part of the output if they are data tags)
+                r_column = columns.get(r_tag)
+                if r_column is not None:
+                    curr_record[r_column] = r_value
+
+            # save the last record
+            records.append(curr_record)
+
+            # hand over the records of the document
+            yield from records
 
     def _add_to_cache(self, cache_name: str, record: tuple):
         self.cache[cache_name]["Data"].append(record)
+        self._add_cache_bytes(cache_name, self._get_record_size(record))
+
+    def _extend_cache(self, cache_name: str, records):
+        records = list(records)
+        self.cache[cache_name]["Data"].extend(records)
+        self._add_cache_bytes(
+            cache_name, sum(self._get_record_size(record) for record in records)
+        )
+
+    def _add_cache_bytes(self, cache_name: str, no_of_bytes: int):
+        self.cache[cache_name]["Bytes"] += no_of_bytes
+        self.cache_bytes += no_of_bytes
+        if self.cache_bytes > self.cache_stats.peak_bytes:
+            self.cache_stats.peak_bytes = self.cache_bytes
+
+        # write the cache to the database once the budget is exceeded
+        if self.cache_budget is not None and self.cache_bytes >= self.cache_budget:
+            self._flush_cache(auto_flush=True)
+
+    @staticmethod
+    def _get_record_size(record: tuple) -> int:
+        # the length of the text and blob data plus a fixed overhead
+        size = RECORD_OVERHEAD
+        for value in record:
+            if isinstance(value, (str, bytes)):
+                size += len(value)
+            size += FIELD_OVERHEAD
+        return size
+
+    def _flush_cache(self, auto_flush: bool):
+        # with the background writer, the time is the time spent waiting for a free
+        # place in the queue of the writer
+        start = time.perf_counter()
+        batch = []
+
+        for table_name, values in self.cache.items():
+            # only process lists that actually do contain data
+            if len(values["Data"]) > 0:
+                # get the number of elements in the 1st tuple
+                field_list = ", ".join(values["Fields"])
+                no_elems = len(values["Data"][0])
+                params_string = ", ".join("?" for _ in range(0, no_elems))
+                sql_ins = (
+                    f"INSERT INTO {table_name} ({field_list}) VALUES ({params_string})"
+                )
+                batch.append((sql_ins, values["Data"]))
+                self.cache_stats.rows_flushed += len(values["Data"])
+
+        if self.writer:
+            # the writer gets the cached lists, the cache starts with new lists
+            if batch:
+                self.writer.put(batch)
+        else:
+            with self.conn:
+                for sql_ins, records in batch:
+                    self.conn.executemany(sql_ins, records)
+
+        self.cache_stats.flushes += 1
+        if auto_flush:
+            self.cache_stats.auto_flushes += 1
+        self.cache_stats.bytes_flushed += self.cache_bytes
+        self.cache_stats.flush_seconds += time.perf_counter() - start
+
+        self._clear_chache()
 
     def _clear_chache(self):
         for key in self.cache:
             self.cache[key]["Data"] = []
+            self.cache[key]["Bytes"] = 0
+        self.cache_bytes = 0
 
 
 # -------------------------------------------------------------------------------
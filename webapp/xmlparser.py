@@ -21,11 +21,14 @@ from xmlrpc.client import Boolean
 # import re
 import regex as re
 import enum
+import xml.sax
+import xml.parsers.expat
 from dataclasses import dataclass
 
 # import pandas as pd
 
 from bs4 import BeautifulSoup as bs
+from bs4.element import NavigableString
 
 # import for usage in flask app
 from webapp.forwardstar import ForwardStar, ForwardStarData
@@ -85,19 +88,321 @@ class TagType(int, enum.Enum):
     data_tag: int = 1
 
 
+class ParserBackend(enum.Enum):
+    soup = 1
+    expat = 2
+
+
+class TagsAndValuesColumns:
+    """Columnar representation of the tags and values of a flattened document. Every
+    tag is an entry in the parallel lists tag_ids, path_ids, depths, tag_types,
+    repetitions and values (in tag id order), the path of a tag is paths[path_id].
+    The repetition is the number of tags with the same path before the tag.
+    """
+
+    __slots__ = (
+        "paths",
+        "path_ids_by_path",
+        "no_of_tags_by_path",
+        "tag_ids",
+        "path_ids",
+        "depths",
+        "tag_types",
+        "repetitions",
+        "values",
+    )
+
+    def __init__(self):
+        self.paths = []
+        self.path_ids_by_path = {}
+        self.no_of_tags_by_path = []
+        self.tag_ids = []
+        self.path_ids = []
+        self.depths = []
+        self.tag_types = []
+        self.repetitions = []
+        self.values = []
+
+    def __len__(self):
+        return len(self.tag_ids)
+
+    @classmethod
+    def from_dict(cls, doc_cont: dict):
+        columns = cls()
+        tags = []
+        for path_id, (path, fields) in enumerate(doc_cont.items()):
+            columns.paths.append(path)
+            columns.path_ids_by_path[path] = path_id
+            columns.no_of_tags_by_path.append(len(fields))
+            for repetition, (tag_id, depth, value, tag_type) in enumerate(fields):
+                tags.append((tag_id, path_id, depth, tag_type, repetition, value))
+
+        # the tag ids are unique, so only the tag ids are compared when sorting
+        tags.sort()
+        for tag_id, path_id, depth, tag_type, repetition, value in tags:
+            columns.tag_ids.append(tag_id)
+            columns.path_ids.append(path_id)
+            columns.depths.append(depth)
+            columns.tag_types.append(tag_type)
+            columns.repetitions.append(repetition)
+            columns.values.append(value)
+        return columns
+
+    def add_tag(self, path, tag_id, depth, value, tag_type, concat_on_key_error=True):
+        path_id = self.path_ids_by_path.get(path)
+        if path_id is None:
+            path_id = len(self.paths)
+            self.paths.append(path)
+            self.path_ids_by_path[path] = path_id
+            self.no_of_tags_by_path.append(0)
+        elif not concat_on_key_error:
+            raise KeyError(
+                f"Trying to append the tag {path} which already exists in document! "
+                f"Current tag value: {value} "
+                f"Existing tag value: {self.to_dict()[path]}"
+            )
+
+        self.tag_ids.append(tag_id)
+        self.path_ids.append(path_id)
+        self.depths.append(depth)
+        self.tag_types.append(tag_type)
+        self.repetitions.append(self.no_of_tags_by_path[path_id])
+        self.values.append(value)
+        self.no_of_tags_by_path[path_id] += 1
+
+    def with_values(self, values):
+        # a copy sharing everything but the values, e.g. to fill a flattening plan
+        columns = TagsAndValuesColumns()
+        columns.paths = self.paths
+        columns.path_ids_by_path = self.path_ids_by_path
+        columns.no_of_tags_by_path = self.no_of_tags_by_path
+        columns.tag_ids = self.tag_ids
+        columns.path_ids = self.path_ids
+        columns.depths = self.depths
+        columns.tag_types = self.tag_types
+        columns.repetitions = self.repetitions
+        columns.values = values
+        return columns
+
+    def to_dict(self) -> dict:
+        # the representation returned by get_tags_and_values(), i.e. the lists of
+        # (tag id, depth, value, tag type) tuples by path
+        fields_by_path = [[] for _ in self.paths]
+        for tag_id, path_id, depth, value, tag_type in zip(
+            self.tag_ids, self.path_ids, self.depths, self.values, self.tag_types
+        ):
+            fields_by_path[path_id].append((tag_id, depth, value, tag_type))
+        return dict(zip(self.paths, fields_by_path))
+
+
+@dataclass
+class FlatteningPlan:
+
+    __slots__ = ("columns", "fstar_data")
+
+    # the tags of the flattened document without values
+    columns: TagsAndValuesColumns
+    fstar_data: ForwardStarData
+
+
+class FlatteningPlans:
+    """Stores the flattening plans learned from the documents processed. A plan is
+    learned per document type and structural fingerprint (tag names, tree structure,
+    data tag vs node and attributes) from the 1st document flattened with the generic
+    path. Later documents with the same fingerprint are filled into the plan, without
+    building any paths, keys or forward star. At most max_plans_per_type plans are
+    learned per document type, the documents of other shapes are flattened generically.
+    """
+
+    def __init__(self, max_plans_per_type=16):
+        self.max_plans_per_type = max_plans_per_type
+        self.plans = {}
+        self.no_of_plans_by_type = {}
+
+        # statistics
+        self.hits = 0
+        self.misses = 0
+
+    def get_plan(self, plan_key, fingerprint):
+        plan = self.plans.get((plan_key, fingerprint))
+        if plan:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return plan
+
+    def add_plan(self, plan_key, fingerprint, plan):
+        no_of_plans = self.no_of_plans_by_type.get(plan_key, 0)
+        if no_of_plans < self.max_plans_per_type:
+            self.plans[(plan_key, fingerprint)] = plan
+            self.no_of_plans_by_type[plan_key] = no_of_plans + 1
+
+
+class XmlEventCollector(xml.sax.ContentHandler):
+    """Collects the elements of an xml document from the sax event stream, so the
+    document can be flattened by XmlParser without building a BeautifulSoup tree.
+    The elements are kept in document order in parallel lists. An element ends up
+    as data tag (with a value) or node following the same rules as the soup path,
+    i.e. it is a data tag if its only content is a single non-empty string.
+    """
+
+    # the chars BeautifulSoup considers as whitespace when collapsing whitespace only strings
+    ascii_spaces = "\x20\x0a\x09\x0c\x0d"
+
+    def __init__(self, document_string=""):
+        super().__init__()
+
+        # the element store
+        self.names = []
+        self.depths = []
+        self.parents = []
+        self.ends = []
+        self.attrs = []
+        self.values = []
+
+        # the open elements: [index, no of child items, text parts, last item was text, has child elements]
+        self._stack = []
+
+        # XmlParser replaces the xml prolog <?xml ...?> with a <xml ...> tag before handing the
+        # document to BeautifulSoup, which turns it into the root node of the document
+        self._prolog_tag = None
+        prolog = re.match(r"(<)(\?)(xml .*?)(\?)(>)", document_string, re.IGNORECASE)
+        if prolog:
+            self._prolog_tag = prolog.group(3).split()[0]
+
+    # ------------------
+    # Public Functions
+    # ------------------
+    def collect(self, document_string):
+        """Parses the document with pyexpat and collects its elements. Raises a
+        ValueError if the document is not well-formed.
+        """
+
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self.startElement
+        parser.EndElementHandler = self.endElement
+        parser.CharacterDataHandler = self.characters
+        parser.ProcessingInstructionHandler = self.processingInstruction
+        parser.CommentHandler = self.comment
+        parser.StartCdataSectionHandler = self.startCDATA
+
+        self.startDocument()
+        try:
+            parser.Parse(document_string, True)
+        except xml.parsers.expat.ExpatError as e:
+            raise ValueError(f"expat failed to parse the document: {e}")
+        self.endDocument()
+
+    # ContentHandler functions
+    def startDocument(self):
+        if self._prolog_tag:
+            self.startElement(self._prolog_tag, {})
+
+    def endDocument(self):
+        if self._prolog_tag:
+            self.endElement(self._prolog_tag)
+
+    def startElement(self, name, attrs):
+        if self._stack:
+            parent = self._stack[-1]
+            parent[1] += 1
+            parent[3] = False
+            parent[4] = True
+            parent_idx = parent[0]
+        else:
+            parent_idx = -1
+
+        idx = len(self.names)
+        # BeautifulSoup uses the local name as tag name and lists the namespace declarations
+        # after the other attributes
+        self.names.append(name.rpartition(":")[2])
+        self.depths.append(len(self._stack) + 1)
+        self.parents.append(parent_idx)
+        self.ends.append(idx + 1)
+        if attrs:
+            self.attrs.append(
+                {
+                    **{k: v for k, v in attrs.items() if not k.startswith("xmlns")},
+                    **{k: v for k, v in attrs.items() if k.startswith("xmlns")},
+                }
+            )
+        else:
+            self.attrs.append(None)
+        self.values.append(None)
+
+        self._stack.append([idx, 0, None, False, False])
+
+    def endElement(self, name):
+        idx, no_of_items, text_parts, _, has_child_elements = self._stack.pop()
+        self.ends[idx] = len(self.names)
+
+        if no_of_items == 1 and not has_child_elements:
+            value = "".join(text_parts)
+            # BeautifulSoup replaces whitespace only strings by a single newline or space
+            if not value.strip(self.ascii_spaces):
+                value = "\n" if "\n" in value else " "
+            self.values[idx] = value
+            return
+
+        # this is a node, attributes of nodes are not processed
+        self.attrs[idx] = None
+
+    def characters(self, content):
+        if not self._stack:
+            return
+        curr = self._stack[-1]
+        if curr[3]:
+            curr[2].append(content)
+        else:
+            curr[1] += 1
+            curr[2] = [content]
+            curr[3] = True
+
+    def processingInstruction(self, target, data):
+        self._add_non_text_item(f"{target} {data}")
+
+    # LexicalHandler functions
+    def comment(self, content):
+        self._add_non_text_item(content)
+
+    def startCDATA(self):
+        # an empty CDATA section still is a (whitespace only) string for BeautifulSoup
+        self.characters("")
+
+    def endCDATA(self):
+        pass
+
+    def startDTD(self, name, public_id, system_id):
+        pass
+
+    def endDTD(self):
+        pass
+
+    def _add_non_text_item(self, content):
+        if not self._stack:
+            return
+        curr = self._stack[-1]
+        curr[1] += 1
+        curr[2] = [content]
+        curr[3] = False
+
+
 class XmlParser:
 
     __slots__ = (
         "doc_id",
         "doc_str",
         "soup",
-        "tags",
+        "_tags",
         "top_node",
         "type",
         "source_no_of_tags",
         "soup_no_of_tags",
         "tag_id",
+        "parent_tag_ids",
         "fstar",
+        "collector",
     )
 
     # ------------------
@@ -109,8 +414,27 @@ class XmlParser:
         top_node_tree_level=0,
         type_distance_to_top=1,
         document_id=0,
+        event_collector=None,
+        backend=ParserBackend.soup,
     ):
 
+        # with the expat backend the elements are collected from the pyexpat event stream
+        if not event_collector and backend == ParserBackend.expat:
+            event_collector = XmlEventCollector(document_string)
+            event_collector.collect(document_string)
+
+        # the document has already been parsed with sax, e.g. during validation,
+        # so take the elements from there instead of parsing it with BeautifulSoup
+        if event_collector:
+            self._init_from_collector(
+                document_string,
+                top_node_tree_level,
+                type_distance_to_top,
+                document_id,
+                event_collector,
+            )
+            return
+
         # replace the ? in the XML Prolog as this caused
         # BeautifulSoup to return a completely broken object
         if "?" in document_string:
@@ -124,14 +448,20 @@ class XmlParser:
         # set the basic attributes
         self.doc_id = document_id
         self.doc_str = document_string
+        self.collector = None
         self.soup = bs(document_string, "xml")
-        self.tags = self._get_tags()
-        self.top_node = self.soup(self.tags[top_node_tree_level])[0]
+        self._tags = None
+
+        # a single walk over the soup provides the top node, the tag names needed
+        # to determine the type and the number of tags
+        doc_type_level = top_node_tree_level + type_distance_to_top
+        leading_tags, self.top_node, self.soup_no_of_tags = self._scan_tags(
+            top_node_tree_level, doc_type_level + 2
+        )
         try:
-            doc_type_level = top_node_tree_level + type_distance_to_top
-            self.type = self.soup(self.tags[doc_type_level])[0].name
+            self.type = leading_tags[doc_type_level]
             if str(self.type).lower() == "document":
-                self.type = self.soup(self.tags[doc_type_level + 1])[0].name
+                self.type = leading_tags[doc_type_level + 1]
         except IndexError as e:
             raise IndexError(
                 f"Index out of range occurred while trying to access 'self.soup(self.tags[1])[0].name'\nInput string processed: {document_string}\nParsed result: {self.soup}\nTags identified: {self.tags}"
@@ -140,12 +470,18 @@ class XmlParser:
         # do some basic checks post parsing
         self.source_no_of_tags = document_string.count("</")
 
-        self.soup_no_of_tags = len(self.tags)
         if self.soup_no_of_tags < (0.5 * self.source_no_of_tags):
             raise ValueError(
                 f"BeautifulSoup has recognized {self.soup_no_of_tags} tags whearas raw document contains {self.source_no_of_tags} tags"
             )
 
+    @property
+    def tags(self):
+        # the full list of tag names is only built if requested
+        if self._tags is None:
+            self._tags = self._get_tags()
+        return self._tags
+
     # ------------------
     # Public Functions
     # ------------------
@@ -159,7 +495,11 @@ class XmlParser:
         self._traverse_document_flat(self.top_node, attribute_usage)
 
     def get_tags_and_values(
-        self, attribute_usage=AttributeUsage.add_to_tag_name, concat_on_key_error=False
+        self,
+        attribute_usage=AttributeUsage.add_to_tag_name,
+        concat_on_key_error=False,
+        flattening_plans=None,
+        columnar=False,
     ):
 
         # # OLD: initialize the forward star - 0 is the static root element of the tree
@@ -167,14 +507,27 @@ class XmlParser:
         # # parent_tag_id = 0
         # self.fstar = ForwardStar(self.tag_id)
 
-        # NEW: initialize the forward star as None
+        # NEW: initialize the forward star as None, the forward star is built from
+        # the parent tag ids recorded during the flattening
         self.fstar = None
+        self.parent_tag_ids = []
 
-        doc_cont = {}
+        # the columnar output is a TagsAndValuesColumns object instead of the dict
+        doc_cont = TagsAndValuesColumns() if columnar else {}
         try:
-            self._process_document(
-                self.top_node, doc_cont, attribute_usage, concat_on_key_error
-            )
+            if self.collector and flattening_plans is not None:
+                # documents parsed with sax or expat can be filled into a learned plan
+                doc_cont = self._process_collected_elements_with_plans(
+                    attribute_usage, concat_on_key_error, flattening_plans, columnar
+                )
+            elif self.collector:
+                self._process_collected_elements(
+                    doc_cont, attribute_usage, concat_on_key_error
+                )
+            else:
+                self._process_document(
+                    self.top_node, doc_cont, attribute_usage, concat_on_key_error
+                )
             return Result(ok=True, result=doc_cont)
         except Exception as e:
             return Result(ok=False, result=e)
@@ -184,6 +537,44 @@ class XmlParser:
     # ------------------
     # Internal Functions
     # ------------------
+    def _init_from_collector(
+        self,
+        document_string,
+        top_node_tree_level,
+        type_distance_to_top,
+        document_id,
+        event_collector,
+    ):
+
+        # set the basic attributes
+        self.doc_id = document_id
+        self.doc_str = document_string
+        self.collector = event_collector
+        self.soup = None
+        self._tags = event_collector.names
+
+        # the top node is the 1st element with the tag name found at the top node level,
+        # the same as self.soup(self.tags[top_node_tree_level])[0] in the soup path
+        self.top_node = self.tags.index(self.tags[top_node_tree_level])
+        try:
+            doc_type_level = top_node_tree_level + type_distance_to_top
+            self.type = self.tags[doc_type_level]
+            if str(self.type).lower() == "document":
+                self.type = self.tags[doc_type_level + 1]
+        except IndexError as e:
+            raise IndexError(
+                f"Index out of range occurred while trying to access 'self.tags[{doc_type_level}]'\nInput string processed: {document_string}\nTags identified: {self.tags}"
+            )
+
+        # do some basic checks post parsing
+        self.source_no_of_tags = document_string.count("</")
+
+        self.soup_no_of_tags = len(self.tags)
+        if self.soup_no_of_tags < (0.5 * self.source_no_of_tags):
+            raise ValueError(
+                f"The sax parser has recognized {self.soup_no_of_tags} tags whearas raw document contains {self.source_no_of_tags} tags"
+            )
+
     def _get_tags(self):
         soup_tags = [itm.name for itm in self.soup.descendants if itm.name]
         # for itm in self.soup.descendants:
@@ -192,56 +583,100 @@ class XmlParser:
 
         return soup_tags
 
-    def _traverse_document_tree(self, bs_elem, attribute_usage, level=0):
+    def _scan_tags(self, top_node_tree_level, no_of_leading_tags):
+        # walks the soup once and returns the names of the leading tags, the top node, i.e.
+        # the 1st tag with the name found at the top node level (the same as
+        # self.soup(self.tags[top_node_tree_level])[0]), and the total number of tags
+        leading_tags = []
+        first_tag_by_name = {}
+        top_node = None
+        no_of_tags = 0
+
+        for itm in self.soup.descendants:
+            if not itm.name:
+                continue
+            if no_of_tags < no_of_leading_tags:
+                leading_tags.append(itm.name)
+            if no_of_tags <= top_node_tree_level:
+                first_tag_by_name.setdefault(itm.name, itm)
+                if no_of_tags == top_node_tree_level:
+                    top_node = first_tag_by_name[itm.name]
+            no_of_tags += 1
+
+        if top_node is None:
+            raise IndexError("list index out of range")
+
+        return leading_tags, top_node, no_of_tags
+
+    @staticmethod
+    def _is_data_tag(bs_elem):
+        # a tag with a single non-empty string as its only descendant, checked on the
+        # direct children only, as walking all descendants of every tag is quadratic
+        contents = bs_elem.contents
+        return (
+            len(contents) == 1
+            and isinstance(contents[0], NavigableString)
+            and bool(bs_elem.string)
+        )
 
-        level += 1
-        spacing = "  " * level
+    def _traverse_document_tree(self, bs_elem, attribute_usage, level=0):
 
-        if str(type(bs_elem)) == "<class 'bs4.element.Tag'>":
-            if bs_elem.name:
-                if bs_elem.string and len(list(bs_elem.descendants)) == 1:
-                    # Tag with value and no further descendants -> we are at the bottom of the tree, print both the tag and the value
-                    if bs_elem.attrs:
-                        print(
-                            f"{level}{spacing}{bs_elem.name} ({bs_elem.attrs}) -> {bs_elem.string}"
-                        )
+        # explicit stack of (element, level) instead of recursion
+        elems_to_process = [(bs_elem, level + 1)]
+        while elems_to_process:
+            bs_elem, level = elems_to_process.pop()
+            spacing = "  " * level
+
+            if str(type(bs_elem)) == "<class 'bs4.element.Tag'>":
+                if bs_elem.name:
+                    if self._is_data_tag(bs_elem):
+                        # Tag with value and no further descendants -> we are at the bottom of the tree, print both the tag and the value
+                        if bs_elem.attrs:
+                            print(
+                                f"{level}{spacing}{bs_elem.name} ({bs_elem.attrs}) -> {bs_elem.string}"
+                            )
+                        else:
+                            print(f"{level}{spacing}{bs_elem.name} -> {bs_elem.string}")
                     else:
-                        print(f"{level}{spacing}{bs_elem.name} -> {bs_elem.string}")
-                else:
-                    print(f"{level}{spacing}{bs_elem.name}")
+                        print(f"{level}{spacing}{bs_elem.name}")
 
-                for child in bs_elem.children:
-                    self._traverse_document_tree(child, attribute_usage, level)
+                    for child in reversed(bs_elem.contents):
+                        elems_to_process.append((child, level + 1))
 
     def _traverse_document_flat(self, bs_elem, attribute_usage, path="", level=0):
 
-        if str(type(bs_elem)) == "<class 'bs4.element.Tag'>":
-            if bs_elem.name:
-                if bs_elem.string and len(list(bs_elem.descendants)) == 1:
-                    # Tag with value and no further descendants -> we are at the bottom of the tree, print both the tag and the value
-
-                    # old version expanding the attributes -> as this is to inspect the document, new version just displays
-                    # the attributes as they are in the docuemnt
-                    # attribs = ''
-                    # if bs_elem.attrs:
-                    #     for item in bs_elem.attrs:
-                    #         attribs = attribs + '-' + bs_elem.attrs[item]
-                    # print(f'{path}.{bs_elem.name}{attribs} -> {bs_elem.string}')
-
-                    if bs_elem.attrs:
-                        print(
-                            f"{path}.{bs_elem.name} ({bs_elem.attrs}) -> {bs_elem.string}"
-                        )
-                    else:
-                        print(f"{path}.{bs_elem.name} -> {bs_elem.string}")
-                else:
-                    if len(path) > 0:
-                        path = path + "." + bs_elem.name
+        # explicit stack of (element, path) instead of recursion
+        elems_to_process = [(bs_elem, path)]
+        while elems_to_process:
+            bs_elem, path = elems_to_process.pop()
+
+            if str(type(bs_elem)) == "<class 'bs4.element.Tag'>":
+                if bs_elem.name:
+                    if self._is_data_tag(bs_elem):
+                        # Tag with value and no further descendants -> we are at the bottom of the tree, print both the tag and the value
+
+                        # old version expanding the attributes -> as this is to inspect the document, new version just displays
+                        # the attributes as they are in the docuemnt
+                        # attribs = ''
+                        # if bs_elem.attrs:
+                        #     for item in bs_elem.attrs:
+                        #         attribs = attribs + '-' + bs_elem.attrs[item]
+                        # print(f'{path}.{bs_elem.name}{attribs} -> {bs_elem.string}')
+
+                        if bs_elem.attrs:
+                            print(
+                                f"{path}.{bs_elem.name} ({bs_elem.attrs}) -> {bs_elem.string}"
+                            )
+                        else:
+                            print(f"{path}.{bs_elem.name} -> {bs_elem.string}")
                     else:
-                        path = bs_elem.name
+                        if len(path) > 0:
+                            path = path + "." + bs_elem.name
+                        else:
+                            path = bs_elem.name
 
-                for child in bs_elem.children:
-                    self._traverse_document_flat(child, attribute_usage, path, level)
+                    for child in reversed(bs_elem.contents):
+                        elems_to_process.append((child, path))
 
     def _process_document(
         self,
@@ -253,19 +688,41 @@ class XmlParser:
         level=0,
         parent_tag_id=0,
     ):
-        level += 1
-        if str(type(bs_elem)) == "<class 'bs4.element.Tag'>":
-            if bs_elem.name:
-                if bs_elem.string and len(list(bs_elem.descendants)) == 1:
-                    # Tag with value and no further descendants -> we are at the bottom of the tree, print both the tag and the value
-                    attrs = None
-                    if bs_elem.attrs:
-                        attrs = self._process_attrs(bs_elem, path, attribute_usage)
-                        if isinstance(attrs, list):
-                            # we have a list of attrs to turn into fields
-                            for attr in attrs:
-                                key = attr.key
-                                value = attr.value
+        # explicit stack of (element, path, level, parent tag id) instead of recursion,
+        # the children are pushed in reverse order to be processed in document order
+        elems_to_process = [(bs_elem, path, level + 1, parent_tag_id)]
+        while elems_to_process:
+            bs_elem, path, level, parent_tag_id = elems_to_process.pop()
+            if str(type(bs_elem)) == "<class 'bs4.element.Tag'>":
+                if bs_elem.name:
+                    if self._is_data_tag(bs_elem):
+                        # Tag with value and no further descendants -> we are at the bottom of the tree, print both the tag and the value
+                        attrs = None
+                        if bs_elem.attrs:
+                            attrs = self._process_attrs(
+                                bs_elem.name,
+                                bs_elem.attrs,
+                                bs_elem.string,
+                                path,
+                                attribute_usage,
+                            )
+                            if isinstance(attrs, list):
+                                # we have a list of attrs to turn into fields
+                                for attr in attrs:
+                                    key = attr.key
+                                    value = attr.value
+                                    self._process_field(
+                                        doc_cont,
+                                        key,
+                                        value,
+                                        concat_on_key_error,
+                                        level,
+                                        parent_tag_id,
+                                        TagType.data_tag,
+                                    )
+                            else:
+                                key = attrs.key
+                                value = attrs.value
                                 self._process_field(
                                     doc_cont,
                                     key,
@@ -276,8 +733,8 @@ class XmlParser:
                                     TagType.data_tag,
                                 )
                         else:
-                            key = attrs.key
-                            value = attrs.value
+                            key = f"{path}.{bs_elem.name}"
+                            value = bs_elem.string
                             self._process_field(
                                 doc_cont,
                                 key,
@@ -288,8 +745,18 @@ class XmlParser:
                                 TagType.data_tag,
                             )
                     else:
-                        key = f"{path}.{bs_elem.name}"
-                        value = bs_elem.string
+                        # Tag with further descendants
+                        # TODO: check for attributes that would need to be processed
+
+                        # build path
+                        if len(path) > 0:
+                            path = path + "." + bs_elem.name
+                        else:
+                            path = bs_elem.name
+
+                        # add a "node only" field
+                        key = path
+                        value = "__node__"
                         self._process_field(
                             doc_cont,
                             key,
@@ -297,50 +764,198 @@ class XmlParser:
                             concat_on_key_error,
                             level,
                             parent_tag_id,
-                            TagType.data_tag,
+                            TagType.node,
                         )
-                else:
-                    # Tag with further descendants
-                    # TODO: check for attributes that would need to be processed
 
-                    # build path
-                    if len(path) > 0:
-                        path = path + "." + bs_elem.name
-                    else:
-                        path = bs_elem.name
+                        # disabled as already done in _process_field for "node only" field
+                        # self.tag_id += 1
+                        # self.fstar.add_child(parent_tag_id, self.tag_id)
+
+                        # make the child the new parent
+                        parent_tag_id = self.tag_id
 
-                    # add a "node only" field
-                    key = path
-                    value = "__node__"
+                    for child in reversed(bs_elem.contents):
+                        elems_to_process.append((child, path, level + 1, parent_tag_id))
+
+        self._build_fstar()
+
+    def _process_collected_elements(
+        self, doc_cont, attribute_usage, concat_on_key_error
+    ):
+        # the elements collected are in document order, so the descendants of the
+        # top node are the elements up to the end index of the top node
+        collector = self.collector
+        top_node = self.top_node
+        top_depth = collector.depths[top_node]
+
+        # the paths and tag ids of the nodes processed, by element index
+        node_paths = {}
+        node_tag_ids = {}
+
+        for idx in range(top_node, collector.ends[top_node]):
+            name = collector.names[idx]
+            value = collector.values[idx]
+            level = collector.depths[idx] - top_depth + 1
+
+            if idx == top_node:
+                path = ""
+                parent_tag_id = 0
+            else:
+                parent = collector.parents[idx]
+                path = node_paths[parent]
+                parent_tag_id = node_tag_ids[parent]
+
+            if value is not None:
+                # Tag with value and no further descendants
+                attrs = collector.attrs[idx]
+                if attrs:
+                    attrs = self._process_attrs(
+                        name, attrs, value, path, attribute_usage
+                    )
+                    if not isinstance(attrs, list):
+                        attrs = [attrs]
+                    for attr in attrs:
+                        self._process_field(
+                            doc_cont,
+                            attr.key,
+                            attr.value,
+                            concat_on_key_error,
+                            level,
+                            parent_tag_id,
+                            TagType.data_tag,
+                        )
+                else:
                     self._process_field(
                         doc_cont,
-                        key,
+                        f"{path}.{name}",
                         value,
                         concat_on_key_error,
                         level,
                         parent_tag_id,
-                        TagType.node,
+                        TagType.data_tag,
                     )
+            else:
+                # Tag with further descendants
+                if len(path) > 0:
+                    path = path + "." + name
+                else:
+                    path = name
+
+                self._process_field(
+                    doc_cont,
+                    path,
+                    "__node__",
+                    concat_on_key_error,
+                    level,
+                    parent_tag_id,
+                    TagType.node,
+                )
 
-                    # disabled as already done in _process_field for "node only" field
-                    # self.tag_id += 1
-                    # self.fstar.add_child(parent_tag_id, self.tag_id)
+                node_paths[idx] = path
+                node_tag_ids[idx] = self.tag_id
 
-                    # make the child the new parent
-                    parent_tag_id = self.tag_id
+        self._build_fstar()
 
-                for child in bs_elem.children:
-                    self._process_document(
-                        child,
-                        doc_cont,
-                        attribute_usage,
-                        concat_on_key_error,
-                        path,
-                        level,
-                        parent_tag_id,
-                    )
+    def _build_fstar(self):
+        # the tag ids are 1, 2, 3, ... so the node index of a tag is its tag id - 1;
+        # the 1st tag is the root of the fstar, its parent is not used
+        if self.tag_id == 0:
+            return
+        parents = [-1]
+        parents.extend(tag_id - 1 for tag_id in self.parent_tag_ids[1:])
+        self.fstar = ForwardStar.from_parent_array(
+            parents, list(range(1, self.tag_id + 1))
+        )
 
-    def _process_attrs(self, bs_elem, path, attribute_usage):
+    def _process_collected_elements_with_plans(
+        self, attribute_usage, concat_on_key_error, flattening_plans, columnar
+    ):
+        plan_key = (self.type, attribute_usage, concat_on_key_error)
+        fingerprint = self._get_structural_fingerprint(attribute_usage)
+
+        plan = flattening_plans.get_plan(plan_key, fingerprint)
+        if plan:
+            columns = self._fill_plan(plan, attribute_usage)
+            return columns if columnar else columns.to_dict()
+
+        # unknown shape: flatten generically and learn the plan from the result
+        if columnar:
+            doc_cont = TagsAndValuesColumns()
+            self._process_collected_elements(
+                doc_cont, attribute_usage, concat_on_key_error
+            )
+            columns = doc_cont.with_values(None)
+        else:
+            doc_cont = {}
+            self._process_collected_elements(
+                doc_cont, attribute_usage, concat_on_key_error
+            )
+            columns = TagsAndValuesColumns.from_dict(doc_cont).with_values(None)
+
+        flattening_plans.add_plan(
+            plan_key,
+            fingerprint,
+            FlatteningPlan(columns=columns, fstar_data=self.fstar.get_fstar_data()),
+        )
+        return doc_cont
+
+    def _get_structural_fingerprint(self, attribute_usage):
+        # everything the keys and the forward star of a document depend on
+        collector = self.collector
+        top_node = self.top_node
+        end = collector.ends[top_node]
+
+        if attribute_usage == AttributeUsage.add_to_tag_name:
+            # the attribute values are part of the key
+            attrs = tuple(
+                tuple(attrs.items()) if attrs else None
+                for attrs in collector.attrs[top_node:end]
+            )
+        else:
+            attrs = tuple(
+                tuple(attrs) if attrs else None
+                for attrs in collector.attrs[top_node:end]
+            )
+
+        return (
+            top_node,
+            tuple(collector.names[top_node:end]),
+            tuple(collector.parents[top_node:end]),
+            tuple(value is None for value in collector.values[top_node:end]),
+            attrs,
+        )
+
+    def _fill_plan(self, plan, attribute_usage):
+        collector = self.collector
+        top_node = self.top_node
+
+        # the values by tag id - 1, in the same order the generic path creates the tags
+        values = []
+        for idx in range(top_node, collector.ends[top_node]):
+            value = collector.values[idx]
+            attrs = collector.attrs[idx]
+            if value is None:
+                values.append("__node__")
+            elif attrs:
+                attrs = self._process_attrs(
+                    collector.names[idx], attrs, value, "", attribute_usage
+                )
+                if isinstance(attrs, list):
+                    values.extend(attr.value for attr in attrs)
+                else:
+                    values.append(attrs.value)
+            else:
+                values.append(value)
+
+        # every document of the same shape has the same forward star
+        fstar_data = plan.fstar_data
+        self.fstar = ForwardStar(fstar_data.node_caption[0])
+        self.fstar.load_from_fstar_data(fstar_data)
+        self.tag_id = len(values)
+
+        return plan.columns.with_values(values)
+
+    def _process_attrs(self, tag_name, tag_attrs, tag_string, path, attribute_usage):
         attribs = ""
         key = ""
         value = ""
@@ -348,34 +963,34 @@ class XmlParser:
         ret_val = None
 
         if attribute_usage == AttributeUsage.add_to_tag_name:
-            for item in bs_elem.attrs:
-                attribs = attribs + "-" + bs_elem.attrs[item]
-            key = f"{path}.{bs_elem.name}{attribs}"
-            value = bs_elem.string
+            for item in tag_attrs:
+                attribs = attribs + "-" + tag_attrs[item]
+            key = f"{path}.{tag_name}{attribs}"
+            value = tag_string
             ret_val = TagAndValue(key=key, value=value)
 
         elif attribute_usage == AttributeUsage.add_to_tag_value:
-            for item in bs_elem.attrs:
-                attribs = attribs + bs_elem.attrs[item] + "-"
-            key = f"{path}.{bs_elem.name}"
-            value = f"{attribs}{bs_elem.string}"
+            for item in tag_attrs:
+                attribs = attribs + tag_attrs[item] + "-"
+            key = f"{path}.{tag_name}"
+            value = f"{attribs}{tag_string}"
             ret_val = TagAndValue(key=key, value=value)
 
         elif attribute_usage == AttributeUsage.add_separate_tag:
-            for item in bs_elem.attrs:
+            for item in tag_attrs:
                 # build a list of tags and values for each attribute
-                key = f"{path}.{bs_elem.name}.{item}"
-                value = bs_elem.attrs[item]
+                key = f"{path}.{tag_name}.{item}"
+                value = tag_attrs[item]
                 list_out.append(TagAndValue(key=key, value=value))
             # and finally the tags value
-            key = f"{path}.{bs_elem.name}.{bs_elem.name}"
-            value = bs_elem.string
+            key = f"{path}.{tag_name}.{tag_name}"
+            value = tag_string
             list_out.append(TagAndValue(key=key, value=value))
             ret_val = list_out
 
         elif attribute_usage == AttributeUsage.ignore:
-            key = f"{path}.{bs_elem.name}"
-            value = bs_elem.string
+            key = f"{path}.{tag_name}"
+            value = tag_string
             ret_val = TagAndValue(key=key, value=value)
 
         return ret_val
@@ -384,15 +999,16 @@ class XmlParser:
         self, doc_cont, key, value, concat_on_key_error, level, parent_tag_id, tag_type
     ):
 
-        # icrease tag id and add tag to fstar
+        # icrease tag id and record the parent of the tag for the fstar
         self.tag_id += 1
-        if self.fstar:
-            self.fstar.add_child(parent_tag_id, self.tag_id)
-        else:
-            self.fstar = ForwardStar(self.tag_id)
+        self.parent_tag_ids.append(parent_tag_id)
 
         # process the key / value pair
-        if key in doc_cont:
+        if isinstance(doc_cont, TagsAndValuesColumns):
+            doc_cont.add_tag(
+                key, self.tag_id, level, value, tag_type, concat_on_key_error
+            )
+        elif key in doc_cont:
             if concat_on_key_error:
                 old_value = doc_cont[key]
                 # doc_cont[key] = old_value + " | " + value
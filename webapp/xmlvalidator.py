@@ -1,7 +1,9 @@
 # ------------------
 # Imports
 # ------------------
+import io
 import xml.sax
+import xml.sax.handler
 from dataclasses import dataclass
 
 # ------------------
@@ -34,17 +36,38 @@ class XmlValidator:
 
         self.dummy_handler = DummyHandler()
 
-    def validate_doc(self, string_to_validate):
+    def validate_doc(self, string_to_validate, content_handler=None):
+        """Validates the well-formedness of the xml document. If a content_handler is
+        provided (e.g. a XmlEventCollector), it receives the content and lexical events
+        of the same parse.
+        """
 
         ret_val = ValidationResult(valid=True, output="Valid xml document!")
 
         try:
-            xml.sax.parseString(string_to_validate, self.dummy_handler)
+            if content_handler:
+                self._parse_string(string_to_validate, content_handler)
+            else:
+                xml.sax.parseString(string_to_validate, self.dummy_handler)
         except Exception as e:
             ret_val = ValidationResult(valid=False, output=f"Invalid xml document! The following error occured: {e}")
             
         return ret_val
 
+    def _parse_string(self, string_to_parse, content_handler):
+        # the same as xml.sax.parseString, but the content handler is registered
+        # as lexical handler as well to receive the comments
+        parser = xml.sax.make_parser()
+        parser.setContentHandler(content_handler)
+        parser.setProperty(xml.sax.handler.property_lexical_handler, content_handler)
+
+        inpsrc = xml.sax.xmlreader.InputSource()
+        if isinstance(string_to_parse, str):
+            inpsrc.setCharacterStream(io.StringIO(string_to_parse))
+        else:
+            inpsrc.setByteStream(io.BytesIO(string_to_parse))
+        parser.parse(inpsrc)
+
 
 if __name__ == "__main__":
 